@@ -0,0 +1,78 @@
+"""
+Benchmark DuckDBStore insert throughput for random and time-ordered ids, with and
+without a primary key.
+
+    python benchmarks/duckdb_inserts.py --records 200000 --batch-size 1000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+from observers.models.openai import OpenAIRecord
+from observers.stores.duckdb import DuckDBStore
+
+CONFIGURATIONS = {
+    "uuid4 ids, primary key": {"ids": "uuid4", "primary_key": True},
+    "uuid7 ids, primary key": {"ids": "uuid7", "primary_key": True},
+    "uuid7 ids, no primary key": {"ids": "uuid7", "primary_key": False},
+}
+
+
+def make_record(ids: str) -> OpenAIRecord:
+    record = OpenAIRecord(
+        model="gpt-4o",
+        messages=[{"role": "user", "content": "Tell me a joke."}],
+        assistant_message="Why did the chicken cross the road?",
+        prompt_tokens=12,
+        completion_tokens=9,
+        total_tokens=21,
+        finish_reason="stop",
+        tags=["benchmark"],
+        properties={"tenant": "acme"},
+        latency_ms=250.0,
+    )
+    if ids == "uuid4":
+        record.id = str(uuid.uuid4())
+    return record
+
+
+def run(records: int, batch_size: int, ids: str, primary_key: bool):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "store.db")
+        store = DuckDBStore(path=path, batch_size=batch_size, primary_key=primary_key)
+        batch = [make_record(ids) for _ in range(records)]
+
+        start = time.perf_counter()
+        for record in batch:
+            store.add(record)
+        store.flush()
+        inserted = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store._execute("CHECKPOINT")
+        checkpoint = time.perf_counter() - start
+        store.close()
+        return records / inserted, checkpoint, os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--records", type=int, default=200_000)
+    parser.add_argument("--batch-size", type=int, default=1_000)
+    args = parser.parse_args()
+
+    print(f"{args.records} records, batches of {args.batch_size}")
+    print(f"{'configuration':<28} {'records/s':>12} {'checkpoint':>12} {'size':>10}")
+    for name, config in CONFIGURATIONS.items():
+        throughput, checkpoint, size = run(args.records, args.batch_size, **config)
+        print(
+            f"{name:<28} {throughput:>12,.0f} {checkpoint:>11.3f}s "
+            f"{size / 2**20:>8.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
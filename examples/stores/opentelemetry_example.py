@@ -1,6 +1,7 @@
 import os
 
 from openai import OpenAI
+from opentelemetry import trace
 
 from observers import wrap_openai
 from observers.stores.opentelemetry import OpenTelemetryStore
@@ -21,12 +22,15 @@ openai_client = OpenAI()
 
 client = wrap_openai(openai_client, store=store)
 
-response = client.chat.completions.create(
-    model="gpt-4o", messages=[{"role": "user", "content": "Tell me a joke."}]
-)
-
-# The OpenTelemetryStore links multiple completions into a trace
-response = client.chat.completions.create(
-    model="gpt-4o", messages=[{"role": "user", "content": "Tell me another joke."}]
-)
+# Completions are exported as spans of the current trace, so completions made
+# under the same span end up in the same trace
+tracer = trace.get_tracer("llm-observer-example")
+with tracer.start_as_current_span("jokes"):
+    response = client.chat.completions.create(
+        model="gpt-4o", messages=[{"role": "user", "content": "Tell me a joke."}]
+    )
+    response = client.chat.completions.create(
+        model="gpt-4o",
+        messages=[{"role": "user", "content": "Tell me another joke."}],
+    )
 # Now query your Opentelemetry Compatible observability store as you usually do!
@@ -1,5 +1,6 @@
 from typing import List
 
+from .base import PromotedProperty
 from .models.aisuite import wrap_aisuite
 from .models.base import ChatCompletionObserver, ChatCompletionRecord
 from .models.hf_client import wrap_hf_client
@@ -12,6 +13,7 @@ from .stores.datasets import DatasetsStore
 __all__: List[str] = [
     "ChatCompletionObserver",
     "ChatCompletionRecord",
+    "PromotedProperty",
     "TransformersRecord",
     "OpenAIRecord",
     "wrap_openai",
@@ -1,4 +1,8 @@
+import os
+import threading
+import time
 import uuid
+import warnings
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional
@@ -8,6 +12,121 @@ if TYPE_CHECKING:
     from argilla import Argilla
 
 
+_uuid7_lock = threading.Lock()
+_uuid7_last = (0, 0)
+
+
+def uuid7() -> str:
+    """
+    Generate a time-ordered UUID (version 7).
+
+    Ids generated by this process are strictly increasing, so they are appended at
+    the end of indexes instead of being inserted at random positions.
+    """
+    global _uuid7_last
+    with _uuid7_lock:
+        millis = time.time_ns() // 1_000_000
+        last_millis, last_counter = _uuid7_last
+        if millis <= last_millis:
+            # 12 bits of counter within the same millisecond
+            millis, counter = last_millis, last_counter + 1
+            if counter > 0xFFF:
+                millis, counter = millis + 1, 0
+        else:
+            counter = int.from_bytes(os.urandom(2), "big") & 0x7FF
+        _uuid7_last = (millis, counter)
+    value = (
+        (millis & 0xFFFFFFFFFFFF) << 80
+        | 0x7 << 76
+        | counter << 64
+        | 0b10 << 62
+        | int.from_bytes(os.urandom(8), "big") >> 2
+    )
+    return str(uuid.UUID(int=value))
+
+
+BOOLEANS = {
+    "true": True,
+    "false": False,
+    "1": True,
+    "0": False,
+    "yes": True,
+    "no": False,
+}
+
+
+def _to_bool(value: Any) -> Optional[bool]:
+    """Parse a boolean, `None` for values such as `"maybe"` or `2`"""
+    if isinstance(value, str):
+        return BOOLEANS.get(value.strip().lower())
+    if isinstance(value, (bool, int, float)) and value in (0, 1):
+        return bool(value)
+    return None
+
+
+@dataclass(frozen=True)
+class PromotedProperty:
+    """
+    A property promoted out of the `properties` of records, so that stores can
+    filter and group by it without parsing JSON.
+
+    DuckDB stores it in a typed `property_<name>` column, Argilla as a metadata
+    property of the same name, and OpenTelemetry as a span attribute.
+
+    Args:
+        name (`str`):
+            The key of the property.
+        type (`Literal["str", "int", "float", "bool"]`, *optional*):
+            The type of the property, values that can't be converted are dropped.
+        attribute (`str`, *optional*):
+            The OpenTelemetry attribute name, defaults to `properties.<name>`.
+    """
+
+    name: str
+    type: Literal["str", "int", "float", "bool"] = "str"
+    attribute: Optional[str] = None
+
+    @property
+    def column(self) -> str:
+        """The name of the column holding the property"""
+        return f"property_{self.name}"
+
+    @property
+    def duckdb_type(self) -> str:
+        return {
+            "str": "VARCHAR",
+            "int": "BIGINT",
+            "float": "DOUBLE",
+            "bool": "BOOLEAN",
+        }[self.type]
+
+    @property
+    def otel_attribute(self) -> str:
+        return self.attribute or f"properties.{self.name}"
+
+    def value(self, properties: Optional[Dict[str, Any]]) -> Any:
+        """Return the value of the property in `properties`, converted to its type"""
+        value = (properties or {}).get(self.name)
+        if value is None:
+            return None
+        try:
+            return {"str": str, "int": int, "float": float, "bool": _to_bool}[
+                self.type
+            ](value)
+        except (TypeError, ValueError):
+            return None
+
+    def argilla_metadata(self, client: "Argilla"):
+        """Return the Argilla metadata property holding the property"""
+        import argilla as rg
+
+        if self.type == "int":
+            return rg.IntegerMetadataProperty(name=self.column, client=client)
+        if self.type == "float":
+            return rg.FloatMetadataProperty(name=self.column, client=client)
+        return rg.TermsMetadataProperty(name=self.column, client=client)
+
+
 @dataclass
 class Function:
     """Function tool call information"""
@@ -47,7 +166,7 @@ class Record(ABC):
     """
 
     client_name: str = field(init=False)
-    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = field(default_factory=uuid7)
     tags: List[str] = None
     properties: Dict[str, Any] = None
     error: Optional[str] = None
@@ -73,10 +192,29 @@ class Record(ABC):
 
     @property
     @abstractmethod
-    def duckdb_schema(self):
-        """Return the DuckDB schema for the record"""
+    def duckdb_columns(self) -> Dict[str, str]:
+        """Return the DuckDB type of each table column"""
         pass
 
+    @property
+    def duckdb_schema(self):
+        """
+        Return the DuckDB schema for the record.
+
+        Deprecated: stores build their tables from `duckdb_columns`, with their own
+        constraints.
+        """
+        warnings.warn(
+            "`Record.duckdb_schema` is deprecated, use `Record.duckdb_columns`",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        columns = ",\n".join(
+            f"    {name} {type}{' PRIMARY KEY' if name == 'id' else ''}"
+            for name, type in self.duckdb_columns.items()
+        )
+        return f"CREATE TABLE IF NOT EXISTS {self.table_name} (\n{columns}\n)"
+
     @property
     @abstractmethod
     def table_name(self):
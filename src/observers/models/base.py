@@ -1,5 +1,6 @@
 import datetime
 import random
+import time
 from dataclasses import dataclass, field
 from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Union
 
@@ -32,6 +33,8 @@ class ChatCompletionRecord(Record):
     finish_reason: str = None
     tool_calls: Optional[Any] = None
     function_call: Optional[Any] = None
+    latency_ms: Optional[float] = None
+    time_to_first_token_ms: Optional[float] = None
 
     @classmethod
     def from_response(cls, response=None, error=None, model=None, **kwargs):
@@ -40,47 +43,31 @@ class ChatCompletionRecord(Record):
 
     @property
     def table_columns(self):
-        return [
-            "id",
-            "model",
-            "timestamp",
-            "messages",
-            "assistant_message",
-            "completion_tokens",
-            "prompt_tokens",
-            "total_tokens",
-            "finish_reason",
-            "tool_calls",
-            "function_call",
-            "tags",
-            "properties",
-            "error",
-            "raw_response",
-            "arguments",
-        ]
+        return list(self.duckdb_columns)
 
     @property
-    def duckdb_schema(self):
-        return f"""
-        CREATE TABLE IF NOT EXISTS {self.table_name} (
-            id VARCHAR PRIMARY KEY,
-            model VARCHAR,
-            timestamp TIMESTAMP,
-            messages JSON,
-            assistant_message TEXT,
-            completion_tokens INTEGER,
-            prompt_tokens INTEGER,
-            total_tokens INTEGER,
-            finish_reason VARCHAR,
-            tool_calls JSON,
-            function_call JSON,
-            tags VARCHAR[],
-            properties JSON,
-            error VARCHAR,
-            raw_response JSON,
-            arguments JSON,
-        )
-        """
+    def duckdb_columns(self) -> Dict[str, str]:
+        """Return the DuckDB type of each table column"""
+        return {
+            "id": "VARCHAR",
+            "model": "VARCHAR",
+            "timestamp": "TIMESTAMP",
+            "messages": "JSON",
+            "assistant_message": "TEXT",
+            "completion_tokens": "INTEGER",
+            "prompt_tokens": "INTEGER",
+            "total_tokens": "INTEGER",
+            "finish_reason": "VARCHAR",
+            "tool_calls": "JSON",
+            "function_call": "JSON",
+            "tags": "VARCHAR[]",
+            "properties": "JSON",
+            "error": "VARCHAR",
+            "raw_response": "JSON",
+            "arguments": "JSON",
+            "latency_ms": "DOUBLE",
+            "time_to_first_token_ms": "DOUBLE",
+        }
 
     def argilla_settings(self, client: "Argilla"):
         import argilla as rg
@@ -152,6 +139,8 @@ class ChatCompletionRecord(Record):
                 rg.TermsMetadataProperty(name="model", client=client),
                 rg.TermsMetadataProperty(name="finish_reason", client=client),
                 rg.TermsMetadataProperty(name="tags", client=client),
+                rg.FloatMetadataProperty(name="latency_ms", client=client),
+                rg.FloatMetadataProperty(name="time_to_first_token_ms", client=client),
             ],
         )
 
@@ -232,7 +221,14 @@ class ChatCompletionObserver:
         return self
 
     def _log_record(
-        self, response, error=None, model=None, messages=None, arguments=None
+        self,
+        response,
+        error=None,
+        model=None,
+        messages=None,
+        arguments=None,
+        latency_ms=None,
+        time_to_first_token_ms=None,
     ):
         record = self.parse_response(
             response,
@@ -242,6 +238,8 @@ class ChatCompletionObserver:
             tags=self.tags,
             properties=self.properties,
             arguments=arguments,
+            latency_ms=latency_ms,
+            time_to_first_token_ms=time_to_first_token_ms,
         )
         if random.random() < self.logging_rate:
             self.store.add(record)
@@ -276,8 +274,14 @@ class ChatCompletionObserver:
 
             def stream_responses():
                 response_buffer = []
+                time_to_first_token_ms = None
+                start = time.perf_counter()
                 try:
                     for chunk in self.create_fn(**input_data):
+                        if time_to_first_token_ms is None:
+                            time_to_first_token_ms = (
+                                time.perf_counter() - start
+                            ) * 1000
                         yield chunk
                         response_buffer.append(chunk)
                     self._log_record(
@@ -285,6 +289,8 @@ class ChatCompletionObserver:
                         model=model,
                         messages=messages,
                         arguments=arguments,
+                        latency_ms=(time.perf_counter() - start) * 1000,
+                        time_to_first_token_ms=time_to_first_token_ms,
                     )
                 except Exception as e:
                     self._log_record(
@@ -293,20 +299,32 @@ class ChatCompletionObserver:
                         model=model,
                         messages=messages,
                         arguments=arguments,
+                        latency_ms=(time.perf_counter() - start) * 1000,
+                        time_to_first_token_ms=time_to_first_token_ms,
                     )
                     raise
 
             return stream_responses()
 
+        start = time.perf_counter()
         try:
             response = self.create_fn(**input_data)
             self._log_record(
-                response, model=model, messages=messages, arguments=arguments
+                response,
+                model=model,
+                messages=messages,
+                arguments=arguments,
+                latency_ms=(time.perf_counter() - start) * 1000,
             )
             return response
         except Exception as e:
             self._log_record(
-                response, error=e, model=model, messages=messages, arguments=arguments
+                response,
+                error=e,
+                model=model,
+                messages=messages,
+                arguments=arguments,
+                latency_ms=(time.perf_counter() - start) * 1000,
             )
             raise
 
@@ -348,7 +366,14 @@ class AsyncChatCompletionObserver(ChatCompletionObserver):
     """
 
     async def _log_record_async(
-        self, response, error=None, model=None, messages=None, arguments=None
+        self,
+        response,
+        error=None,
+        model=None,
+        messages=None,
+        arguments=None,
+        latency_ms=None,
+        time_to_first_token_ms=None,
     ):
         record = self.parse_response(
             response,
@@ -358,6 +383,8 @@ class AsyncChatCompletionObserver(ChatCompletionObserver):
             tags=self.tags,
             properties=self.properties,
             arguments=arguments,
+            latency_ms=latency_ms,
+            time_to_first_token_ms=time_to_first_token_ms,
         )
         if random.random() < self.logging_rate:
             await self.store.add_async(record)
@@ -388,8 +415,14 @@ class AsyncChatCompletionObserver(ChatCompletionObserver):
 
             async def stream_responses():
                 response_buffer = []
+                time_to_first_token_ms = None
+                start = time.perf_counter()
                 try:
                     async for chunk in await self.create_fn(**input_data):
+                        if time_to_first_token_ms is None:
+                            time_to_first_token_ms = (
+                                time.perf_counter() - start
+                            ) * 1000
                         yield chunk
                         response_buffer.append(chunk)
                     await self._log_record_async(
@@ -397,6 +430,8 @@ class AsyncChatCompletionObserver(ChatCompletionObserver):
                         model=model,
                         messages=messages,
                         arguments=arguments,
+                        latency_ms=(time.perf_counter() - start) * 1000,
+                        time_to_first_token_ms=time_to_first_token_ms,
                     )
                 except Exception as e:
                     await self._log_record_async(
@@ -405,20 +440,32 @@ class AsyncChatCompletionObserver(ChatCompletionObserver):
                         model=model,
                         messages=messages,
                         arguments=arguments,
+                        latency_ms=(time.perf_counter() - start) * 1000,
+                        time_to_first_token_ms=time_to_first_token_ms,
                     )
                     raise
 
             return stream_responses()
 
+        start = time.perf_counter()
         try:
             response = await self.create_fn(**input_data)
             await self._log_record_async(
-                response, model=model, messages=messages, arguments=arguments
+                response,
+                model=model,
+                messages=messages,
+                arguments=arguments,
+                latency_ms=(time.perf_counter() - start) * 1000,
             )
             return response
         except Exception as e:
             await self._log_record_async(
-                response, error=e, model=model, messages=messages, arguments=arguments
+                response,
+                error=e,
+                model=model,
+                messages=messages,
+                arguments=arguments,
+                latency_ms=(time.perf_counter() - start) * 1000,
             )
             raise
 
@@ -1,9 +1,9 @@
-import uuid
 from dataclasses import asdict
 from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 
 from huggingface_hub import AsyncInferenceClient, InferenceClient
 
+from observers.base import uuid7
 from observers.models.base import (
     AsyncChatCompletionObserver,
     ChatCompletionObserver,
@@ -48,7 +48,7 @@ class HFRecord(ChatCompletionRecord):
         if isinstance(response, list):
             first_dump = asdict(response[0])
             last_dump = asdict(response[-1])
-            id = first_dump.get("id") or str(uuid.uuid4())
+            id = first_dump.get("id") or uuid7()
 
             choices = last_dump.get("choices", [{}])[0]
             delta = choices.get("delta", {})
@@ -87,7 +87,7 @@ class HFRecord(ChatCompletionRecord):
         usage = response_dump.get("usage", {})
 
         return cls(
-            id=response_dump.get("id") or str(uuid.uuid4()),
+            id=response_dump.get("id") or uuid7(),
             completion_tokens=usage.get("completion_tokens"),
             prompt_tokens=usage.get("prompt_tokens"),
             total_tokens=usage.get("total_tokens"),
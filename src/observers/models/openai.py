@@ -1,9 +1,9 @@
-import uuid
 from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 from observers.stores.duckdb import DuckDBStore
 from openai import AsyncOpenAI, OpenAI
 from typing_extensions import Self
 
+from observers.base import uuid7
 from observers.models.base import (
     AsyncChatCompletionObserver,
     ChatCompletionObserver,
@@ -57,7 +57,7 @@ class OpenAIRecord(ChatCompletionRecord):
                 total_tokens += usage.get("total_tokens", 0)
 
             return cls(
-                id=first_dump.get("id") or str(uuid.uuid4()),
+                id=first_dump.get("id") or uuid7(),
                 messages=messages,
                 completion_tokens=completion_tokens,
                 prompt_tokens=prompt_tokens,
@@ -75,7 +75,7 @@ class OpenAIRecord(ChatCompletionRecord):
         choices = response_dump.get("choices", [{}])[0].get("message", {})
         usage = response_dump.get("usage", {}) or {}
         return cls(
-            id=response.id or str(uuid.uuid4()),
+            id=response.id or uuid7(),
             messages=messages,
             completion_tokens=usage.get("completion_tokens"),
             prompt_tokens=usage.get("prompt_tokens"),
@@ -91,7 +91,7 @@ class OpenAIRecord(ChatCompletionRecord):
 
 def wrap_openai(
     client: Union["OpenAI", "AsyncOpenAI"],
-    store: Optional[Union["DuckDBStore", "DatasetsStore"]] = DuckDBStore(),
+    store: Optional[Union["DuckDBStore", "DatasetsStore"]] = None,
     tags: Optional[List[str]] = None,
     properties: Optional[Dict[str, Any]] = None,
     logging_rate: Optional[float] = 1,
@@ -103,7 +103,8 @@ def wrap_openai(
         client (`Union[OpenAI, AsyncOpenAI]`):
             The OpenAI client to wrap.
         store (`Union[DuckDBStore, DatasetsStore]`, *optional*):
-            The store to use to save the records.
+            The store to use to save the records, defaults to the shared
+            `DuckDBStore` of `store.db` in the working directory.
         tags (`List[str]`, *optional*):
             The tags to associate with records.
         properties (`Dict[str, Any]`, *optional*):
@@ -120,7 +121,7 @@ def wrap_openai(
         "create": client.chat.completions.create,
         "format_input": lambda messages, **kwargs: kwargs | {"messages": messages},
         "parse_response": OpenAIRecord.from_response,
-        "store": store,
+        "store": store or DuckDBStore.connect(),
         "tags": tags,
         "properties": properties,
         "logging_rate": logging_rate,
@@ -1,6 +1,6 @@
-import uuid
 from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 
+from observers.base import uuid7
 from observers.models.base import (
     ChatCompletionObserver,
     ChatCompletionRecord,
@@ -32,7 +32,7 @@ class TransformersRecord(ChatCompletionRecord):
             return cls(finish_reason="error", error=str(error), **kwargs)
         generated_text = response[0]["generated_text"][-1]
         return cls(
-            id=str(uuid.uuid4()),
+            id=uuid7(),
             assistant_message=generated_text.get("content"),
             tool_calls=generated_text.get("tool_calls"),
             raw_response=response,
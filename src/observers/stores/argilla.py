@@ -1,6 +1,12 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
 import uuid
+from concurrent.futures import Future
 from dataclasses import asdict, dataclass, field
-from typing import TYPE_CHECKING, List, Optional, Union
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 
 import argilla as rg
 from argilla import (
@@ -13,17 +19,50 @@ from argilla import (
     TextQuestion,
 )
 
+from observers.base import PromotedProperty
 from observers.stores.base import Store
+from observers.stores.registry import acquire, release
+from observers.stores.worker import PeriodicWorker
 
 
 if TYPE_CHECKING:
     from observers.base import Record
 
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class ArgillaStore(Store):
     """
     Argilla store
+
+    Records are buffered and logged in batches by a background worker, once
+    `batch_size` records are waiting or every `flush_interval` seconds, and the
+    buffer is flushed when the store is closed.
+
+    The dataset is looked up or created once, in a background thread, when the
+    first record is added. Adding records never waits for it: they are buffered,
+    and the worker waits for the dataset before logging them, so records added
+    while Argilla can't be reached are kept, up to `max_buffer_size`.
+
+    Args:
+        promoted_properties (`List[PromotedProperty]`, *optional*):
+            Properties logged as `property_<name>` metadata properties, so that
+            records can be filtered by them in the Argilla UI.
+        batch_size (`int`, *optional*):
+            The number of records logged in one request.
+        flush_interval (`float`, *optional*):
+            The number of seconds between flushes of the buffer.
+        max_retries (`int`, *optional*):
+            The number of times a batch is retried when logging it fails, records
+            of a batch that still fails are kept for the next flush.
+        retry_backoff (`float`, *optional*):
+            The number of seconds to wait before the first retry, doubled on every
+            retry.
+        max_buffer_size (`int`, *optional*):
+            The number of records kept in the buffer while Argilla can't be reached,
+            beyond which the oldest records are dropped with a warning. Defaults to
+            10000, `None` to keep every record.
     """
 
     api_url: Optional[str] = field(default=None)
@@ -42,14 +81,32 @@ class ArgillaStore(Store):
             ]
         ]
     ] = field(default=None)
+    promoted_properties: Optional[List[PromotedProperty]] = field(default=None)
+    batch_size: int = field(default=100)
+    flush_interval: float = field(default=5.0)
+    max_retries: int = field(default=5)
+    retry_backoff: float = field(default=0.5)
+    max_buffer_size: Optional[int] = field(default=10_000)
 
     _dataset: Optional[rg.Dataset] = None
     _dataset_keys: Optional[List[str]] = None
     _client: Optional[Argilla] = None
+    _buffer: List["Record"] = field(default_factory=list, init=False)
+    _dropped: int = field(default=0, init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+    _flush_lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+    _flusher: Optional[PeriodicWorker] = field(default=None, init=False)
+    _init_lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+    _init_future: Optional[Future] = field(default=None, init=False)
 
     def __post_init__(self) -> None:
         """Initialize the store"""
         self._client = Argilla(api_url=self.api_url, api_key=self.api_key)
+        self._flusher = PeriodicWorker(
+            self.flush, self.flush_interval, name="observers-argilla-flush"
+        ).start()
+        # log the buffered records of stores that are never closed, see `close`
+        atexit.register(self.close)
 
     def _init_table(self, record: "Record") -> None:
         dataset_name = (
@@ -63,6 +120,8 @@ class ArgillaStore(Store):
 
         if not dataset:
             settings = record.argilla_settings(self._client)
+            for prop in self.promoted_properties or []:
+                settings.metadata.add(prop.argilla_metadata(self._client))
             if self.questions:
                 settings.questions = self.questions
             dataset = rg.Dataset(
@@ -75,7 +134,6 @@ class ArgillaStore(Store):
             raise ValueError(
                 "Custom questions are not supported for existing datasets."
             )
-        self._dataset = dataset
         dataset_keys = (
             [field.name for field in dataset.settings.fields]
             + [question.name for question in dataset.settings.questions]
@@ -83,6 +141,34 @@ class ArgillaStore(Store):
             + [vector.name for vector in dataset.settings.vectors]
         )
         self._dataset_keys = dataset_keys
+        self._dataset = dataset
+
+    def _ensure_table(self, record: "Record") -> Future:
+        """
+        Get the future of the initialization of the dataset, starting it in a
+        background thread if it isn't running yet. A failed initialization is
+        started again by the next record.
+        """
+        with self._init_lock:
+            if self._init_future is None:
+                self._init_future = Future()
+                threading.Thread(
+                    target=self._run_init,
+                    args=(record, self._init_future),
+                    name="observers-argilla-init",
+                    daemon=True,
+                ).start()
+            return self._init_future
+
+    def _run_init(self, record: "Record", future: Future) -> None:
+        try:
+            self._init_table(record)
+        except Exception as e:
+            with self._init_lock:
+                self._init_future = None
+            future.set_exception(e)
+        else:
+            future.set_result(None)
 
     @classmethod
     def connect(
@@ -92,49 +178,149 @@ class ArgillaStore(Store):
         dataset_name: Optional[str] = None,
         workspace_name: Optional[str] = None,
     ) -> "ArgillaStore":
-        """Create a new store instance with custom settings"""
-        return cls(
+        """
+        Connect to the store of a dataset with custom settings, connections to the
+        same dataset of the same server share one store. A store holds the records
+        of one provider, so without `dataset_name` every connection gets its own
+        store and dataset.
+        """
+        options = dict(
             api_url=api_url,
             api_key=api_key,
             dataset_name=dataset_name,
             workspace_name=workspace_name,
         )
+        if dataset_name is None:
+            return cls(**options)
+        return acquire(
+            ("argilla", api_url, workspace_name, dataset_name),
+            lambda: cls(**options),
+            options,
+        )
 
     def add(self, record: "Record") -> None:
-        """Add a new record to the database"""
+        """Add a new record to the buffer of records to log"""
         if not self._dataset:
-            self._init_table(record)
+            # start looking up the dataset, without waiting for it
+            self._ensure_table(record)
+        self._enqueue(record)
 
+    def _record_dict(self, record: "Record") -> Dict[str, Any]:
+        """Get the fields, questions and metadata of a record to log"""
         record_dict = asdict(record)
 
         for text_field in record.text_fields:
             if text_field in record_dict:
                 record_dict[f"{text_field}_length"] = len(record_dict[text_field])
 
-        record_dict = {k: v for k, v in record_dict.items() if k in self._dataset_keys}
-        self._dataset.records.log([record_dict])
+        record_dict.update(self._promoted_values(record))
+        return {k: v for k, v in record_dict.items() if k in self._dataset_keys}
+
+    def _enqueue(self, record: "Record") -> None:
+        with self._lock:
+            self._buffer.append(record)
+            self._trim_buffer()
+            full = len(self._buffer) >= self.batch_size
+        if full and self._flusher:
+            self._flusher.wake()
+
+    def _trim_buffer(self) -> None:
+        """Drop the oldest records beyond `max_buffer_size`, with the lock held"""
+        if self.max_buffer_size is None:
+            return
+        excess = len(self._buffer) - self.max_buffer_size
+        if excess <= 0:
+            return
+        del self._buffer[:excess]
+        # warn once per outage, the total is reported when logging succeeds again
+        if not self._dropped:
+            logger.warning(
+                "The buffer of records to log to Argilla is full, dropping the "
+                "oldest records beyond %d",
+                self.max_buffer_size,
+            )
+        self._dropped += excess
+
+    def flush(self) -> None:
+        """
+        Log the buffered records, in batches of `batch_size` records, once the
+        dataset is initialized
+        """
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._buffer[: self.batch_size]
+                    self._buffer = self._buffer[self.batch_size :]
+                if not batch:
+                    return
+                try:
+                    if not self._dataset:
+                        self._ensure_table(batch[0]).result()
+                    self._log_batch([self._record_dict(record) for record in batch])
+                except Exception:
+                    with self._lock:
+                        self._buffer = batch + self._buffer
+                        self._trim_buffer()
+                    raise
+                with self._lock:
+                    dropped, self._dropped = self._dropped, 0
+                if dropped:
+                    logger.warning(
+                        "Dropped %d records that couldn't be logged to Argilla",
+                        dropped,
+                    )
+
+    def _log_batch(self, batch: List[Dict[str, Any]]) -> None:
+        """Log a batch of records, retrying with exponential backoff"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._dataset.records.log(batch)
+                return
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_backoff * 2**attempt
+                logger.warning(
+                    "Logging %d records to Argilla failed, retrying in %.1fs",
+                    len(batch),
+                    delay,
+                    exc_info=True,
+                )
+                time.sleep(delay)
+
+    def _promoted_values(self, record: "Record") -> dict:
+        """Get the metadata values of the promoted properties of a record"""
+        values = {}
+        for prop in self.promoted_properties or []:
+            value = prop.value(record.properties)
+            # booleans are stored as terms
+            if prop.type == "bool" and value is not None:
+                value = str(value).lower()
+            values[prop.column] = value
+        return values
 
     async def add_async(self, record: "Record"):
         """
-        Add a new record to the database asynchronously
+        Add a new record to the buffer of records to log, which never waits for
+        Argilla, see `add`
 
         Args:
             record (`Record`):
                 The record to add to the database.
         """
-        if not self._dataset:
-            self._init_table(record)
+        self.add(record)
 
-        record_dict = asdict(record)
+    def close(self) -> None:
+        """Stop the background worker and log the buffered records"""
+        if not release(self):
+            return
+        # don't keep closed stores alive until the interpreter exits
+        atexit.unregister(self.close)
+        if self._flusher:
+            self._flusher.stop()
+            self._flusher = None
+        self.flush()
 
-        for text_field in record.text_fields:
-            if text_field in record_dict:
-                record_dict[f"{text_field}_length"] = len(record_dict[text_field])
-
-        record_dict = {k: v for k, v in record_dict.items() if k in self._dataset_keys}
-        # Use argilla's native async API
-        await self._dataset.records.log(
-            [record_dict],
-            background=True,
-            verbose=False,
-        )
+    async def close_async(self) -> None:
+        """Close the store asynchronously, see `close`"""
+        await asyncio.to_thread(self.close)
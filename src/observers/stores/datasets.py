@@ -1,20 +1,48 @@
 import asyncio
 import atexit
 import base64
+import datetime
+import glob
 import hashlib
 import json
+import logging
 import os
 import tempfile
+import threading
+import time
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from dataclasses import asdict, dataclass, field
 from io import BytesIO
-from typing import TYPE_CHECKING, List, Optional
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+)
 
+import pyarrow as pa
+import pyarrow.parquet as pq
 from datasets.utils.logging import disable_progress_bar
-from huggingface_hub import CommitScheduler, login, metadata_update, whoami
+from huggingface_hub import CommitScheduler, HfApi, login, metadata_update, whoami
 from PIL import Image
 
 from observers.stores.base import Store
+from observers.stores.query import Filters
+from observers.stores.registry import acquire, release
+from observers.stores.spool import (
+    SpoolReader,
+    iter_batches,
+    scan_jsonl,
+    scan_parquet,
+)
 
 if TYPE_CHECKING:
     from observers.base import Record
@@ -22,11 +50,97 @@ if TYPE_CHECKING:
 
 disable_progress_bar()
 
+logger = logging.getLogger(__name__)
+
+# Records are appended to the active shard of a store, which is renamed without
+# its `.partial` suffix when it is rotated and is never uploaded before that
+SHARD_SUFFIXES = {"jsonl": ".jsonl", "parquet": ".parquet"}
+PARTIAL_SUFFIX = ".partial"
+
+# Buffer size of the handle of the active JSONL shard, flushed before every
+# scheduled commit and when the shard is rotated
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Arrow types of the DuckDB column types of records, other columns are strings
+ARROW_TYPES = {
+    "TIMESTAMP": pa.timestamp("us"),
+    "INTEGER": pa.int64(),
+    "BIGINT": pa.int64(),
+    "DOUBLE": pa.float64(),
+    "FLOAT": pa.float32(),
+    "BOOLEAN": pa.bool_(),
+    "VARCHAR[]": pa.list_(pa.string()),
+}
+
+
+def arrow_schema(columns: Dict[str, str]) -> pa.Schema:
+    """Return the Arrow schema of a table with the given DuckDB column types"""
+    return pa.schema(
+        [(name, ARROW_TYPES.get(type, pa.string())) for name, type in columns.items()]
+    )
+
+
+class ShardScheduler(CommitScheduler):
+    """
+    Commit scheduler calling `before_push` before listing the files to upload,
+    for the store to rotate its active shard, and sharing the `lock` of the store
+    """
+
+    def __init__(
+        self,
+        *,
+        before_push: Optional[Callable[[], None]] = None,
+        lock: Optional[threading.Lock] = None,
+        **kwargs,
+    ):
+        self.before_push = before_push
+        super().__init__(**kwargs)
+        if lock is not None:
+            self.lock = lock
+
+    def push_to_hub(self):
+        if self.before_push:
+            self.before_push()
+        return super().push_to_hub()
+
 
 @dataclass
 class DatasetsStore(Store):
     """
     Datasets store
+
+    Records are appended to a shard file that is rotated once it holds
+    `max_shard_bytes` bytes or `max_shard_records` records, or when it is older
+    than `max_shard_age` seconds at a scheduled commit. Only rotated shards are
+    uploaded, each of them once, so every commit uploads only new records. Shard
+    names include the process id, so several processes can share `folder_path`.
+
+    The Hub is only reached in the background, after the first record is written,
+    so neither startup nor requests wait on the network. With `offline=True` the
+    store never reaches the Hub, shards are kept in `folder_path` and can be
+    uploaded later in one commit with `upload`.
+
+    Args:
+        offline (`bool`, *optional*):
+            Whether to only write shards locally, without a commit scheduler.
+        format (`Literal["jsonl", "parquet"]`, *optional*):
+            The format of shards. Parquet shards are ZSTD-compressed with typed
+            columns, records are buffered in memory and written as row groups.
+        row_group_size (`int`, *optional*):
+            The number of records per row group of Parquet shards.
+        image_format (`str`, *optional*):
+            The format to convert images to, e.g. `"png"`, defaults to keeping
+            their original encoding. Images are named after the hash of their
+            bytes, so identical images are written once.
+        image_workers (`int`, *optional*):
+            The number of threads writing images.
+        max_shard_bytes (`int`, *optional*):
+            The size after which a shard is rotated, defaults to 64MB.
+        max_shard_records (`int`, *optional*):
+            The number of records after which a shard is rotated.
+        max_shard_age (`float`, *optional*):
+            The age in seconds after which a shard is rotated by the next scheduled
+            commit, defaults to rotating the shard at every scheduled commit.
     """
 
     org_name: Optional[str] = field(default=None)
@@ -40,20 +154,51 @@ class DatasetsStore(Store):
     allow_patterns: Optional[List[str]] = field(default=None)
     ignore_patterns: Optional[List[str]] = field(default=None)
     squash_history: Optional[bool] = field(default=None)
+    max_shard_bytes: Optional[int] = field(default=64 * 1024 * 1024)
+    max_shard_records: Optional[int] = field(default=None)
+    max_shard_age: Optional[float] = field(default=None)
+    format: Literal["jsonl", "parquet"] = field(default="jsonl")
+    row_group_size: int = field(default=10_000)
+    image_format: Optional[str] = field(default=None)
+    image_workers: int = field(default=4)
+    offline: bool = field(default=False)
 
     _filename: Optional[str] = field(default=None)
-    _scheduler: Optional[CommitScheduler] = None
+    _scheduler: Optional[ShardScheduler] = None
+    _repo_id: Optional[str] = field(default=None, init=False)
+    _hub_thread: Optional[threading.Thread] = field(default=None, init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+    _table_name: Optional[str] = field(default=None, init=False)
+    _shard_index: int = field(default=0, init=False)
+    _shard_records: int = field(default=0, init=False)
+    _shard_bytes: int = field(default=0, init=False)
+    _file: Optional[IO[bytes]] = field(default=None, init=False)
+    _init_lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+    _shard_started: float = field(default=0.0, init=False)
+    _closing: bool = field(default=False, init=False)
+    _columns: Optional[Dict[str, str]] = field(default=None, init=False)
+    _schema: Optional[pa.Schema] = field(default=None, init=False)
+    _rows: List[Dict[str, Any]] = field(default_factory=list, init=False)
+    _parquet_writer: Optional[pq.ParquetWriter] = field(default=None, init=False)
+    _image_pool: Optional[ThreadPoolExecutor] = field(default=None, init=False)
+    # the content hash and path of the images being written
+    _image_writes: Dict[Future, Tuple[str, str]] = field(
+        default_factory=dict, init=False
+    )
+    _known_images: Set[str] = field(default_factory=set, init=False)
+    _failed_images: List[str] = field(default_factory=list, init=False)
+    _image_lock: threading.Lock = field(default_factory=threading.Lock, init=False)
     _temp_dir: Optional[str] = field(default=None, init=False)
 
     def __post_init__(self):
         """Initialize the store and create temporary directory"""
-        if self.ignore_patterns is None:
-            self.ignore_patterns = ["*.json"]
-
-        try:
-            whoami(token=self.token or os.getenv("HF_TOKEN"))
-        except Exception:
-            login()
+        if self.format not in SHARD_SUFFIXES:
+            raise ValueError(
+                f"Unknown format {self.format!r}, use 'jsonl' or 'parquet'"
+            )
+        self.ignore_patterns = list(self.ignore_patterns or [])
+        if f"*{PARTIAL_SUFFIX}" not in self.ignore_patterns:
+            self.ignore_patterns.append(f"*{PARTIAL_SUFFIX}")
 
         if self.folder_path is None:
             self._temp_dir = tempfile.mkdtemp(prefix="observers_dataset_")
@@ -70,36 +215,172 @@ class DatasetsStore(Store):
             shutil.rmtree(self._temp_dir)
 
     def _init_table(self, record: "Record"):
-        import logging
+        self._table_name = record.table_name
+        self._columns = record.duckdb_columns
+        self._schema = arrow_schema(self._columns)
+        self._new_shard()
+        if not self.offline:
+            self._hub_thread = threading.Thread(
+                target=self._connect_hub, name="observers-datasets-hub", daemon=True
+            )
+            self._hub_thread.start()
 
-        logging.getLogger("huggingface_hub").setLevel(logging.ERROR)
+    def _resolve_repo(self, table_name: str) -> str:
+        """Get the id of the dataset repository, creating it if needed"""
+        if self._repo_id is None:
+            logging.getLogger("huggingface_hub").setLevel(logging.ERROR)
+            repo_name = self.repo_name or f"{table_name}_{uuid.uuid4().hex[:8]}"
+            org_name = self.org_name or whoami(
+                token=self.token or os.getenv("HF_TOKEN")
+            ).get("name")
+            repo_id = f"{org_name}/{repo_name}"
+            HfApi(token=self.token).create_repo(
+                repo_id=repo_id,
+                repo_type="dataset",
+                private=self.private,
+                exist_ok=True,
+            )
+            metadata_update(
+                repo_id=repo_id,
+                metadata={"tags": ["observers", table_name.split("_")[0]]},
+                repo_type="dataset",
+                token=self.token,
+                overwrite=True,
+            )
+            self._repo_id = repo_id
+        return self._repo_id
 
-        repo_name = self.repo_name or f"{record.table_name}_{uuid.uuid4().hex[:8]}"
-        org_name = self.org_name or whoami(token=self.token).get("name")
-        repo_id = f"{org_name}/{repo_name}"
-        self._filename = f"{record.table_name}_{uuid.uuid4()}.json"
-        self._scheduler = CommitScheduler(
-            repo_id=repo_id,
+    def _connect_hub(self) -> None:
+        """Create the repository and start the commit scheduler, in the background"""
+        try:
+            repo_id = self._resolve_repo(self._table_name)
+            scheduler = ShardScheduler(
+                before_push=self._rotate_on_commit,
+                lock=self._lock,
+                repo_id=repo_id,
+                folder_path=self.folder_path,
+                every=self.every,
+                path_in_repo=self.path_in_repo,
+                repo_type="dataset",
+                revision=self.revision,
+                private=self.private,
+                token=self.token,
+                allow_patterns=self.allow_patterns,
+                ignore_patterns=self.ignore_patterns,
+                squash_history=self.squash_history,
+            )
+            scheduler.private = self.private
+            self._scheduler = scheduler
+        except Exception:
+            logger.exception(
+                "Couldn't connect to the Hub, records are kept in %s, "
+                "see `DatasetsStore.upload`",
+                self.folder_path,
+            )
+
+    def upload(self) -> None:
+        """
+        Upload the shards of `folder_path` to the Hub in one commit, e.g. those
+        written with `offline=True` or by previous processes. The active shard is
+        sealed first. Raises an `OSError` without uploading if images referenced by
+        records couldn't be written.
+        """
+        self._wait_for_images()
+        with self._lock:
+            if self._shard_records:
+                self._rotate()
+        table_name = self._table_name or self._spool_table_name()
+        if table_name is None:
+            return
+        try:
+            whoami(token=self.token or os.getenv("HF_TOKEN"))
+        except Exception:
+            login()
+        HfApi(token=self.token).upload_folder(
+            repo_id=self._resolve_repo(table_name),
             folder_path=self.folder_path,
-            every=self.every,
             path_in_repo=self.path_in_repo,
             repo_type="dataset",
             revision=self.revision,
-            private=self.private,
-            token=self.token,
             allow_patterns=self.allow_patterns,
             ignore_patterns=self.ignore_patterns,
-            squash_history=self.squash_history,
+            commit_message="Upload spooled records",
         )
-        self._scheduler.private = self.private
-        metadata_update(
-            repo_id=repo_id,
-            metadata={"tags": ["observers", record.table_name.split("_")[0]]},
-            repo_type="dataset",
-            token=self.token,
-            overwrite=True,
+
+    def _spool_table_name(self) -> Optional[str]:
+        """Get the table name of the shards in `folder_path`"""
+        for path in self._spool_files():
+            return os.path.basename(path).split("_records_")[0] + "_records"
+        return None
+
+    def _new_shard(self) -> None:
+        """Start a new active shard"""
+        self._shard_index += 1
+        self._filename = (
+            f"{self._table_name}_{os.getpid()}_{uuid.uuid4().hex[:8]}_"
+            f"{self._shard_index:05d}{SHARD_SUFFIXES[self.format]}{PARTIAL_SUFFIX}"
+        )
+        self._shard_records = 0
+        self._shard_bytes = 0
+        self._shard_started = time.monotonic()
+
+    def _rotate(self) -> None:
+        """
+        Seal the active shard, making it visible to the scheduler, and start a new
+        one. Must be called with the scheduler lock held.
+        """
+        if self._shard_records:
+            self._close_file()
+            if self.format == "parquet":
+                self._write_row_group()
+                self._parquet_writer.close()
+                self._parquet_writer = None
+            path = os.path.join(self.folder_path, self._filename)
+            os.replace(path, path[: -len(PARTIAL_SUFFIX)])
+        self._new_shard()
+
+    def _write_row_group(self) -> None:
+        """Write the buffered records to the active Parquet shard as a row group"""
+        if not self._rows:
+            return
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(
+                os.path.join(self.folder_path, self._filename),
+                self._schema,
+                compression="zstd",
+            )
+        self._parquet_writer.write_table(
+            pa.Table.from_pylist(self._rows, schema=self._schema),
+            row_group_size=len(self._rows),
+        )
+        self._rows = []
+        self._shard_bytes = os.path.getsize(
+            os.path.join(self.folder_path, self._filename)
         )
 
+    def _close_file(self) -> None:
+        """Flush and close the handle of the active JSONL shard"""
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _rotate_on_commit(self) -> None:
+        """
+        Rotate the active shard before a scheduled commit if it is due, and flush
+        the records written to it otherwise. Images referenced by the shard are
+        written first, so that they are uploaded with it; images that couldn't be
+        written are reported by `upload` or `close`.
+        """
+        self._wait_for_images(raise_errors=False)
+        with self._lock:
+            if not self._shard_records:
+                return
+            if self._file:
+                self._file.flush()
+            age = time.monotonic() - self._shard_started
+            if self._closing or not self.max_shard_age or age >= self.max_shard_age:
+                self._rotate()
+
     @classmethod
     def connect(
         cls,
@@ -114,9 +395,24 @@ class DatasetsStore(Store):
         allow_patterns: Optional[List[str]] = None,
         ignore_patterns: Optional[List[str]] = None,
         squash_history: Optional[bool] = None,
+        max_shard_bytes: Optional[int] = 64 * 1024 * 1024,
+        max_shard_records: Optional[int] = None,
+        max_shard_age: Optional[float] = None,
+        format: Literal["jsonl", "parquet"] = "jsonl",
+        row_group_size: int = 10_000,
+        image_format: Optional[str] = None,
+        image_workers: int = 4,
+        offline: bool = False,
     ) -> "DatasetsStore":
-        """Create a new store instance with optional custom path"""
-        return cls(
+        """
+        Connect to the store of a dataset, with optional custom path. Connections
+        to the same `repo_name` or `folder_path` share one store and one commit
+        scheduler, which is stopped when every connection to it is closed, and
+        must be made with the same options. A store holds the records of one
+        provider, so without `repo_name` or `folder_path` every connection gets
+        its own store and dataset.
+        """
+        options = dict(
             org_name=org_name,
             repo_name=repo_name,
             folder_path=folder_path,
@@ -128,73 +424,295 @@ class DatasetsStore(Store):
             allow_patterns=allow_patterns,
             ignore_patterns=ignore_patterns,
             squash_history=squash_history,
+            max_shard_bytes=max_shard_bytes,
+            max_shard_records=max_shard_records,
+            max_shard_age=max_shard_age,
+            format=format,
+            row_group_size=row_group_size,
+            image_format=image_format,
+            image_workers=image_workers,
+            offline=offline,
         )
+        if repo_name is None and folder_path is None:
+            return cls(**options)
+        key = ("datasets", org_name, repo_name, folder_path, path_in_repo, revision)
+        return acquire(key, lambda: cls(**options), options)
 
     def add(self, record: "Record"):
         """Add a new record to the database"""
-        if not self._scheduler:
-            self._init_table(record)
-
-        with self._scheduler.lock:
-            with (self._scheduler.folder_path / self._filename).open("a") as f:
-                record_dict = asdict(record)
-
-                # Handle JSON fields
-                for json_field in record.json_fields:
-                    if record_dict[json_field]:
-                        record_dict[json_field] = json.dumps(record_dict[json_field])
-
-                # Handle image fields
-                for image_field in record.image_fields:
-                    if record_dict[image_field]:
-                        image_folder = self._scheduler.folder_path / "images"
-                        image_folder.mkdir(exist_ok=True)
-
-                        # Generate unique filename based on record content
-                        filtered_dict = {
-                            k: v
-                            for k, v in sorted(record_dict.items())
-                            if k not in ["uri", image_field, "id"]
-                        }
-                        content_hash = hashlib.sha256(
-                            json.dumps(obj=filtered_dict, sort_keys=True).encode()
-                        ).hexdigest()
-                        image_path = image_folder / f"{content_hash}.png"
-
-                        # Save image and update record
-                        image_bytes = base64.b64decode(
-                            record_dict[image_field]["bytes"]
-                        )
-                        Image.open(BytesIO(image_bytes)).save(image_path)
-                        record_dict[image_field].update(
-                            {"path": str(image_path), "bytes": None}
-                        )
-
-                # Clean up empty dictionaries
-                record_dict = {
-                    k: None if v == {} else v for k, v in record_dict.items()
-                }
-                sorted_dict = {
-                    col: record_dict.get(col) for col in record.table_columns
-                }
-                try:
-                    f.write(json.dumps(sorted_dict) + "\n")
-                    f.flush()
-                except Exception:
-                    raise
+        if self._table_name is None:
+            with self._init_lock:
+                if self._table_name is None:
+                    self._init_table(record)
+
+        # serialize outside of the lock, which is only held to hand the record to
+        # the active shard, so adders don't wait on each other or on commits
+        row = self._record_row(record)
+        if self.format == "jsonl":
+            data = (json.dumps(row) + "\n").encode()
+
+        with self._lock:
+            if self.format == "parquet":
+                self._rows.append(row)
+                if len(self._rows) >= self.row_group_size:
+                    self._write_row_group()
+            else:
+                if self._file is None:
+                    self._file = open(
+                        os.path.join(self.folder_path, self._filename),
+                        "ab",
+                        buffering=WRITE_BUFFER_SIZE,
+                    )
+                self._file.write(data)
+                self._shard_bytes += len(data)
+
+            self._shard_records += 1
+            if (self.max_shard_bytes and self._shard_bytes >= self.max_shard_bytes) or (
+                self.max_shard_records and self._shard_records >= self.max_shard_records
+            ):
+                self._rotate()
+
+    def _record_row(self, record: "Record") -> Dict[str, Any]:
+        """Get the row of a record, saving its images to `folder_path`"""
+        record_dict = asdict(record)
+        columns = record.duckdb_columns
+
+        # Handle JSON fields, Parquet shards keep lists as typed columns
+        for json_field in record.json_fields:
+            if record_dict[json_field]:
+                if self.format == "parquet" and columns.get(json_field, "").endswith(
+                    "[]"
+                ):
+                    continue
+                record_dict[json_field] = json.dumps(record_dict[json_field])
+
+        # Handle image fields
+        for image_field in record.image_fields:
+            if record_dict[image_field]:
+                image_bytes = base64.b64decode(record_dict[image_field]["bytes"])
+                image_path = self._save_image(image_bytes)
+                record_dict[image_field].update(
+                    {"path": str(image_path), "bytes": None}
+                )
+
+        # Clean up empty dictionaries
+        record_dict = {k: None if v == {} else v for k, v in record_dict.items()}
+        row = {col: record_dict.get(col) for col in record.table_columns}
+        if self.format == "parquet":
+            for col, value in row.items():
+                if columns.get(col) == "TIMESTAMP" and isinstance(value, str):
+                    row[col] = datetime.datetime.fromisoformat(value)
+                elif isinstance(value, (dict, list)) and not columns.get(
+                    col, ""
+                ).endswith("[]"):
+                    row[col] = json.dumps(value)
+        return row
+
+    def _save_image(self, image_bytes: bytes) -> str:
+        """
+        Get the path of an image, named after the hash of its bytes, and write it
+        in the background unless it was already written
+        """
+        content_hash = hashlib.sha256(image_bytes).hexdigest()
+        if self.image_format:
+            extension = self.image_format.lower()
+        else:
+            # only reads the header of the image
+            extension = (Image.open(BytesIO(image_bytes)).format or "png").lower()
+        extension = {"jpeg": "jpg"}.get(extension, extension)
+        image_path = os.path.join(
+            self.folder_path, "images", f"{content_hash}.{extension}"
+        )
+
+        with self._image_lock:
+            if content_hash in self._known_images:
+                return image_path
+            self._known_images.add(content_hash)
+            if os.path.exists(image_path):
+                return image_path
+            if self._image_pool is None:
+                os.makedirs(os.path.dirname(image_path), exist_ok=True)
+                self._image_pool = ThreadPoolExecutor(
+                    self.image_workers, thread_name_prefix="observers-images"
+                )
+            future = self._image_pool.submit(self._write_image, image_bytes, image_path)
+            self._image_writes[future] = (content_hash, image_path)
+        future.add_done_callback(self._image_written)
+        return image_path
+
+    def _write_image(self, image_bytes: bytes, image_path: str) -> None:
+        """
+        Write an image, converted to `image_format` if set, through a partial file
+        so that the scheduler never uploads half an image
+        """
+        partial_path = f"{image_path}.{uuid.uuid4().hex[:8]}{PARTIAL_SUFFIX}"
+        if self.image_format:
+            Image.open(BytesIO(image_bytes)).save(
+                partial_path,
+                format=Image.registered_extensions()[os.path.splitext(image_path)[1]],
+            )
+        else:
+            with open(partial_path, "wb") as f:
+                f.write(image_bytes)
+        os.replace(partial_path, image_path)
+
+    def _image_written(self, future: Future) -> None:
+        """Forget an image that couldn't be written, so that it is written again"""
+        error = future.exception()
+        with self._image_lock:
+            # also called by `_wait_for_images`, which can return before callbacks
+            if future not in self._image_writes:
+                return
+            content_hash, image_path = self._image_writes.pop(future)
+            if error is not None:
+                self._known_images.discard(content_hash)
+                self._failed_images.append(image_path)
+        if error is not None:
+            logger.error(
+                "Couldn't write image %s",
+                image_path,
+                exc_info=(type(error), error, error.__traceback__),
+            )
+
+    def _wait_for_images(self, raise_errors: bool = True) -> None:
+        """
+        Wait for the images being written, e.g. before a commit, and raise an
+        `OSError` if some images couldn't be written since the last check
+        """
+        with self._image_lock:
+            pending = list(self._image_writes)
+        wait(pending)
+        for future in pending:
+            self._image_written(future)
+        if raise_errors:
+            self._raise_image_errors()
+
+    def _raise_image_errors(self) -> None:
+        with self._image_lock:
+            failed, self._failed_images = self._failed_images, []
+        if failed:
+            raise OSError(
+                f"Couldn't write {len(failed)} images referenced by records, "
+                f"e.g. {failed[0]}"
+            )
 
     async def add_async(self, record: "Record"):
         """Add a new record to the database asynchronously"""
         await asyncio.to_thread(self.add, record)
 
+    def iter_records(
+        self,
+        columns: Optional[List[str]] = None,
+        batch_size: int = 10_000,
+        **filters: Any,
+    ) -> Iterator["pa.RecordBatch"]:
+        """
+        Iterate over the records written to `folder_path` as Arrow record batches.
+        Files are memory-mapped and scanned line by line, so that memory use
+        doesn't depend on the number of records.
+
+        Args:
+            columns (`List[str]`, *optional*):
+                The columns to return, defaults to all columns.
+            batch_size (`int`, *optional*):
+                The maximum number of records per batch.
+            **filters:
+                Filters applied to each record, see `Filters`.
+        """
+        return iter_batches(self._spool_rows(), columns, batch_size, Filters(**filters))
+
+    def analytics(self) -> SpoolReader:
+        """
+        Get a DuckDB handle over the shards of `folder_path`, including the active
+        one, with the `query`, `iter_records` and `stats` API of `DuckDBStore`.
+        The files are read in place on every query.
+
+        A Parquet file can only be read once it is complete, so in Parquet format
+        the records buffered for the next row group of the active shard are read
+        from memory, and the active shard is only sealed by a query once it holds
+        row groups, i.e. at most every `row_group_size` records.
+
+        Returns:
+            `SpoolReader`: The reader of the shards.
+        """
+        from observers.models.base import ChatCompletionRecord
+
+        columns = self._columns or ChatCompletionRecord().duckdb_columns
+        return SpoolReader(
+            folder_path=self.folder_path,
+            columns=columns,
+            before_read=self._pending_table,
+            lock=self._lock,
+        )
+
+    def _pending_rows(self) -> List[Dict[str, Any]]:
+        """
+        Make the records written to the active shard visible to readers, and
+        return the ones only held in memory. Must be called with the lock held.
+        """
+        if self._file:
+            self._file.flush()
+        if self.format != "parquet" or not self._shard_records:
+            return []
+        # row groups written to the active shard can't be read before it is sealed
+        if self._parquet_writer is not None:
+            self._rotate()
+            return []
+        return list(self._rows)
+
+    def _pending_table(self) -> Optional[Tuple[str, pa.Table]]:
+        """The table and records of the active shard only held in memory"""
+        rows = self._pending_rows()
+        if not rows:
+            return None
+        return self._table_name, pa.Table.from_pylist(rows, schema=self._schema)
+
+    def _spool_files(self) -> List[str]:
+        """Get the files holding records in `folder_path`"""
+        return sorted(
+            path
+            for pattern in ("*_records_*.json*", "*_records_*.parquet")
+            for path in glob.glob(os.path.join(self.folder_path, pattern))
+        )
+
+    def _spool_rows(self) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            pending = self._pending_rows()
+            paths = self._spool_files()
+        for path in paths:
+            provider = os.path.basename(path).split("_records_")[0]
+            rows = scan_parquet(path) if path.endswith(".parquet") else scan_jsonl(path)
+            for row in rows:
+                row.setdefault("provider", provider)
+                yield row
+        provider = (self._table_name or "").split("_records")[0]
+        for row in pending:
+            yield {**row, "provider": provider}
+
     async def close_async(self):
         """Close the dataset store asynchronously"""
-        if self._scheduler:
-            await asyncio.to_thread(self._scheduler.__exit__, None, None, None)
-            self._scheduler = None
+        await asyncio.to_thread(self.close)
 
     def close(self):
-        """Close the dataset store synchronously"""
+        """
+        Close the dataset store synchronously, sealing the active shard and
+        committing it unless the store is offline
+        """
+        if not release(self):
+            return
+        if self._hub_thread:
+            self._hub_thread.join()
+            self._hub_thread = None
+        self._closing = True
         if self._scheduler:
             self._scheduler.__exit__(None, None, None)
             self._scheduler = None
+        else:
+            self._wait_for_images(raise_errors=False)
+            with self._lock:
+                if self._shard_records:
+                    self._rotate()
+        if self._image_pool:
+            self._image_pool.shutdown()
+            self._image_pool = None
+        self._raise_image_errors()
@@ -1,94 +1,1230 @@
 import asyncio
-import glob
+import datetime
 import json
 import os
-import re
+import tempfile
+import threading
+import time
 from dataclasses import asdict, dataclass, field
-from pathlib import Path
-from typing import TYPE_CHECKING, List, Optional
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Literal, Optional, Union
 
 import duckdb
+import pyarrow as pa
 
+from observers.stores.query import (
+    DEFAULT_METRICS,
+    Filters,
+    Queryable,
+    escape_identifier,
+    promoted_value_expression,
+    property_expression,
+    quote_identifier,
+    to_arrow_table,
+)
+from observers.base import PromotedProperty
+from observers.stores.embeddings import (
+    EMBEDDING_COLUMN,
+    add_embedding_column,
+    build_similar_sql,
+    create_hnsw_index,
+    embedding_type,
+    pending_embeddings,
+    update_embeddings,
+)
+from observers.stores.extensions import load_extension
+from observers.stores.migrations import MIGRATIONS, Migration
+from observers.stores.registry import acquire, release, with_defaults
+from observers.stores.retention import RetentionPolicy
+from observers.stores.rollups import (
+    ROLLUP_TABLES,
+    backfill_rollups,
+    build_rollup_sql,
+    init_rollups,
+    update_rollups,
+)
+from observers.stores.search import (
+    SEARCH_TABLE,
+    build_search_sql,
+    init_search,
+    load_fts,
+    rebuild_search_index,
+    search_index_is_stale,
+    update_search,
+)
 from observers.stores.sql_base import SQLStore
+from observers.stores.sync import (
+    SyncState,
+    build_sync_sql,
+    init_sync_state,
+    next_watermark,
+    read_sync_state,
+    shard_name,
+    write_sync_state,
+)
+from observers.stores.worker import PeriodicWorker
 
 if TYPE_CHECKING:
     from observers.base import Record
 
 DEFAULT_DB_NAME = "store.db"
 
+# Table holding the records of every provider when `unified` is set
+UNIFIED_TABLE = "records"
+# View over the records of every provider, whether they are unified or not
+RECORDS_VIEW = "all_records"
+# Same view including the payload columns, when they are stored separately
+FULL_RECORDS_VIEW = "all_records_full"
+# Large columns that are rarely used in analytical queries
+PAYLOAD_COLUMNS = ["messages", "raw_response"]
+
 
 @dataclass
-class DuckDBStore(SQLStore):
+class DuckDBStore(SQLStore, Queryable):
     """
     DuckDB store
+
+    Args:
+        path (`str`, *optional*):
+            The path to the database file, defaults to `store.db` in the working directory.
+        mode (`Literal["file", "memory"]`, *optional*):
+            With `memory`, records are written to an in-memory database, loaded from
+            `path` if it exists, which is saved to `path` every `snapshot_interval`
+            seconds and when the store is closed. Records written since the last
+            snapshot are lost if the process dies.
+        snapshot_interval (`float`, *optional*):
+            The number of seconds between snapshots in `memory` mode, defaults to
+            one minute.
+        memory_limit (`str`, *optional*):
+            The DuckDB memory limit, e.g. `2GB`.
+        threads (`int`, *optional*):
+            The number of threads used by DuckDB.
+        publish_path (`str`, *optional*):
+            If set, a copy of the database is published to this path every
+            `publish_interval` seconds, so that `DuckDBReader` can query it while the
+            store is open. In `memory` mode, readers can also open `path`.
+        publish_interval (`float`, *optional*):
+            The number of seconds between publications, defaults to one minute.
+        sync_repo_id (`str`, *optional*):
+            If set, the records written since the last sync are uploaded to this
+            Hub dataset every `sync_interval` seconds, see `sync`.
+        sync_interval (`float`, *optional*):
+            The number of seconds between syncs, defaults to five minutes.
+        sync_lag (`float`, *optional*):
+            Records are only synced once they are `sync_lag` seconds old, so that
+            records written out of timestamp order aren't skipped. Defaults to one
+            minute.
+        sync_token (`str`, *optional*):
+            The Hub token used to sync, defaults to the logged in user's.
+        batch_size (`int`, *optional*):
+            The number of records to buffer before writing them in a single
+            transaction, defaults to 1.
+        flush_interval (`float`, *optional*):
+            If set, buffered records are also written every `flush_interval` seconds.
+        rollups (`bool`, *optional*):
+            Whether to maintain per minute and per hour rollup tables on each write,
+            see `rollup_stats`.
+        primary_key (`bool`, *optional*):
+            Whether record tables declare `id` as their primary key. Without it
+            inserts and checkpoints are faster and duplicate ids are dropped when
+            records are written instead, see `dedup_window`. Existing record tables
+            are rewritten once to drop the constraint.
+        dedup_window (`float`, *optional*):
+            Without a primary key, the number of seconds before the oldest record
+            of a batch in which duplicate ids are looked up, defaults to one hour.
+        retention (`RetentionPolicy`, *optional*):
+            If set, the policy is applied in the background every
+            `retention_interval` seconds, see `apply_retention`.
+        retention_interval (`float`, *optional*):
+            The number of seconds between retention runs, defaults to one hour.
+        retention_batch_size (`int`, *optional*):
+            The number of records slimmed or deleted per transaction.
+        unified (`bool`, *optional*):
+            Whether to write the records of every provider to a single `records`
+            table with a `provider` column, instead of one table per provider.
+            Either way, the `all_records` view covers the records of every provider.
+        payload_columns (`List[str]`, *optional*):
+            If set, these columns, e.g. `PAYLOAD_COLUMNS`, are stored in a companion
+            `<table>_payload` table keyed by `id`, so that scans of the record table
+            stay narrow. The `<table>_full` and `all_records_full` views join them
+            back, and `query` only reads them when they are selected. Payload columns
+            can't be used in filters. Existing record tables are split when the
+            store is opened.
+        promoted_properties (`List[PromotedProperty]`, *optional*):
+            Properties extracted into typed `property_<name>` columns when records
+            are written, which `query` and `stats` use to filter and group by these
+            properties. Existing records are backfilled when the store is opened.
+        search_index (`bool`, *optional*):
+            Whether to maintain a full-text index over the message contents and
+            assistant message of records, see `search`. Requires the DuckDB `fts`
+            extension, which is never downloaded by the store.
+        fts_extension_path (`str`, *optional*):
+            The path of the `fts` extension file, defaults to the extension
+            installed in the local DuckDB extension directory.
+        search_refresh_interval (`float`, *optional*):
+            The full-text index is rebuilt from scratch, so `search` only rebuilds
+            it once it is this number of seconds old, defaults to one minute.
+        search_refresh_rows (`int`, *optional*):
+            The number of records written since the index was built after which
+            `search` rebuilds it regardless of its age.
+        embedding_fn (`Callable[[List[str]], List[List[float]]]`, *optional*):
+            If set, records are embedded in the background by calling this function
+            with the message contents and assistant message of batches of records,
+            see `similar`. Embeddings are stored in an `embedding FLOAT[n]` column.
+        embedding_dim (`int`, *optional*):
+            The dimension of the embeddings, required with `embedding_fn`.
+        embedding_interval (`float`, *optional*):
+            The number of seconds between background embedding runs.
+        embedding_batch_size (`int`, *optional*):
+            The number of records passed to `embedding_fn` at once.
+        vector_index (`bool`, *optional*):
+            Whether to build HNSW indexes over embeddings with the DuckDB `vss`
+            extension. Without it, `similar` computes exact distances, which is fast
+            enough for millions of records. HNSW indexes rely on the experimental
+            persistence of `vss` for database files.
+        vss_extension_path (`str`, *optional*):
+            The path of the `vss` extension file, defaults to the extension
+            installed in the local DuckDB extension directory.
     """
 
     path: str = field(
         default_factory=lambda: os.path.join(os.getcwd(), DEFAULT_DB_NAME)
     )
+    mode: Literal["file", "memory"] = "file"
+    snapshot_interval: Optional[float] = 60.0
+    memory_limit: Optional[str] = None
+    threads: Optional[int] = None
+    publish_path: Optional[str] = None
+    publish_interval: float = 60.0
+    sync_repo_id: Optional[str] = None
+    sync_interval: float = 300.0
+    sync_lag: float = 60.0
+    sync_token: Optional[str] = None
+    batch_size: int = 1
+    flush_interval: Optional[float] = None
+    rollups: bool = False
+    primary_key: bool = True
+    dedup_window: float = 3600.0
+    retention: Optional[RetentionPolicy] = None
+    retention_interval: float = 3600.0
+    retention_batch_size: int = 10_000
+    unified: bool = False
+    payload_columns: Optional[List[str]] = None
+    promoted_properties: Optional[List[PromotedProperty]] = None
+    search_index: bool = False
+    fts_extension_path: Optional[str] = None
+    search_refresh_interval: float = 60.0
+    search_refresh_rows: int = 10_000
+    embedding_fn: Optional[Callable[[List[str]], List[List[float]]]] = None
+    embedding_dim: Optional[int] = None
+    embedding_interval: float = 10.0
+    embedding_batch_size: int = 256
+    vector_index: bool = False
+    vss_extension_path: Optional[str] = None
     _tables: List[str] = field(default_factory=list)
     _conn: Optional[duckdb.DuckDBPyConnection] = None
+    _buffer: Dict[str, List[Dict[str, Any]]] = field(default_factory=dict, init=False)
+    _lock: threading.RLock = field(default_factory=threading.RLock, init=False)
+    _flusher: Optional[PeriodicWorker] = field(default=None, init=False)
+    _retention_worker: Optional[PeriodicWorker] = field(default=None, init=False)
+    _search_pending: int = field(default=0, init=False)
+    _search_built: Optional[float] = field(default=None, init=False)
+    _embedder: Optional[PeriodicWorker] = field(default=None, init=False)
+    _snapshotter: Optional[PeriodicWorker] = field(default=None, init=False)
+    _publisher: Optional[PeriodicWorker] = field(default=None, init=False)
+    _syncer: Optional[PeriodicWorker] = field(default=None, init=False)
+    _sync_lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+    _copy_lock: threading.Lock = field(default_factory=threading.Lock, init=False)
 
     def __post_init__(self):
         """Initialize database connection and table"""
+        if (self.embedding_fn or self.vector_index) and not self.embedding_dim:
+            raise ValueError(
+                "`embedding_dim` is required with `embedding_fn` and `vector_index`"
+            )
         if self._conn is None:
-            self._conn = duckdb.connect(self.path)
-            self._tables = self._get_tables()
-            self._get_current_schema_version()
-            self._apply_pending_migrations()
+            self._conn = self._open()
+            # opening an up to date database costs a single query
+            tables = self._load_schema_state()
+            migrated = tables is None
+            if migrated:
+                self._apply_pending_migrations()
+                tables = self._get_tables()
+            self._tables = tables
+            if self.payload_columns:
+                # migrations may add payload columns back to record tables
+                self._split_payload_tables(
+                    [
+                        table
+                        for table in self._record_tables()
+                        if migrated or self._payload_table(table) not in tables
+                    ]
+                )
+            elif any(table.endswith("_payload") for table in tables):
+                raise ValueError(
+                    "The database stores payload columns separately, "
+                    "use `DuckDBStore(payload_columns=...)`"
+                )
+            if self.promoted_properties:
+                self._promote_properties()
+            if not self.primary_key:
+                self._drop_primary_keys()
+            if self.rollups and not set(ROLLUP_TABLES.values()) <= set(tables):
+                init_rollups(self._conn)
+                self._tables = self._get_tables()
+            if self._record_tables() and RECORDS_VIEW not in self._tables:
+                self._refresh_records_view()
+            if self.search_index:
+                self._init_search()
+            if self.embedding_dim:
+                self._init_embeddings()
+        if self.mode == "memory" and self.snapshot_interval:
+            self._snapshotter = PeriodicWorker(
+                self.snapshot, self.snapshot_interval, name="observers-duckdb-snapshot"
+            ).start()
+        if self.publish_path:
+            self._publisher = PeriodicWorker(
+                self.publish, self.publish_interval, name="observers-duckdb-publish"
+            ).start()
+        if self.sync_repo_id:
+            self._syncer = PeriodicWorker(
+                self.sync, self.sync_interval, name="observers-duckdb-sync"
+            ).start()
+        if self.embedding_fn:
+            self._embedder = PeriodicWorker(
+                self.embed_pending,
+                self.embedding_interval,
+                name="observers-duckdb-embeddings",
+            ).start()
+        if self.flush_interval:
+            self._flusher = PeriodicWorker(
+                self.flush, self.flush_interval, name="observers-duckdb-flush"
+            ).start()
+        if self.retention:
+            self._retention_worker = PeriodicWorker(
+                self.apply_retention,
+                self.retention_interval,
+                name="observers-duckdb-retention",
+            ).start()
 
     @classmethod
-    def connect(cls, path: Optional[str] = None) -> "DuckDBStore":
-        """Create a new store instance with optional custom path"""
+    def connect(cls, path: Optional[str] = None, **kwargs: Any) -> "DuckDBStore":
+        """
+        Connect to the store of a database, with optional custom path, other keyword
+        arguments are passed to the constructor.
+
+        Connections to the same database share one store, and so one connection,
+        write buffer and flusher, and must be made with the same options. The
+        store is closed when every connection to it is closed.
+        """
         if not path:
             path = os.path.join(os.getcwd(), DEFAULT_DB_NAME)
-        return cls(path=path)
+        return acquire(
+            ("duckdb", os.path.abspath(path)),
+            lambda: cls(path=path, **kwargs),
+            with_defaults(cls, kwargs),
+        )
+
+    def _init_table(self, record: "Record", table: str) -> None:
+        columns = record.duckdb_columns
+        if table == UNIFIED_TABLE:
+            columns = {**columns, "provider": "VARCHAR"}
+        for prop in self.promoted_properties or []:
+            columns[prop.column] = prop.duckdb_type
+        if self.embedding_dim:
+            columns[EMBEDDING_COLUMN] = embedding_type(self.embedding_dim)
+        payload = self._payload_columns(columns)
+        self._conn.execute(
+            self._table_schema(
+                table, {c: t for c, t in columns.items() if c not in payload}
+            )
+        )
+        self._tables.append(table)
+        if self.vector_index:
+            create_hnsw_index(self._conn, table)
+        if self.payload_columns:
+            self._init_payload_table(
+                table, {"id": columns["id"], **{c: columns[c] for c in payload}}
+            )
+        self._refresh_records_view()
+
+    def _init_search(self) -> None:
+        """Load the fts extension and fill the search table if it doesn't exist"""
+        load_fts(self._conn, self.fts_extension_path)
+        if SEARCH_TABLE not in self._tables:
+            self._conn.execute("BEGIN TRANSACTION")
+            try:
+                init_search(self._conn)
+                for table in self._record_tables():
+                    update_search(self._conn, self._relation(table, ["messages"]))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._tables.append(SEARCH_TABLE)
+        self._search_pending = int(search_index_is_stale(self._conn))
+
+    def _open(self) -> duckdb.DuckDBPyConnection:
+        """Open the database, loading the last snapshot in `memory` mode"""
+        config = {}
+        if self.memory_limit:
+            config["memory_limit"] = self.memory_limit
+        if self.threads:
+            config["threads"] = self.threads
+        if self.mode == "file":
+            return duckdb.connect(self.path, config=config)
+        if self.mode != "memory":
+            raise ValueError(f"Invalid mode {self.mode!r}, expected `file` or `memory`")
+        conn = duckdb.connect(":memory:", config=config)
+        if os.path.exists(self.path):
+            conn.execute(
+                f"ATTACH {self._quote_path(self.path)} AS observers_snapshot "
+                "(READ_ONLY)"
+            )
+            try:
+                conn.execute("COPY FROM DATABASE observers_snapshot TO memory")
+            finally:
+                conn.execute("DETACH observers_snapshot")
+        return conn
+
+    @staticmethod
+    def _quote_path(path: str) -> str:
+        return "'" + path.replace("'", "''") + "'"
+
+    def snapshot(self) -> None:
+        """
+        Save the in-memory database to `path`. The snapshot is written to a
+        temporary file which then replaces `path`, so that `path` always holds a
+        complete snapshot.
+        """
+        if self.mode != "memory":
+            raise ValueError("Snapshots are only taken in `memory` mode")
+        self._copy_to(self.path)
 
-    def _init_table(self, record: "Record") -> str:
-        self._conn.execute(record.duckdb_schema)
-        self._tables.append(record.table_name)
+    def publish(self) -> None:
+        """
+        Publish a read-only copy of the database to `publish_path`, for
+        `DuckDBReader`. Like snapshots, the copy atomically replaces the previous one.
+        """
+        if not self.publish_path:
+            raise ValueError("No publish path, use `DuckDBStore(publish_path=...)`")
+        self._copy_to(self.publish_path)
+
+    def sync(self) -> Optional[str]:
+        """
+        Upload the records written since the last sync to `sync_repo_id`, as one
+        ZSTD-compressed Parquet shard in a single commit.
+
+        Records are synced in (timestamp, id) order up to a watermark saved in the
+        database. The range of a sync is saved before its shard is exported and
+        uploaded, and the watermark only moves once the commit succeeded, so a
+        sync interrupted by a crash is retried with the same records under the
+        same shard name, and records are never uploaded twice.
+
+        Returns:
+            `Optional[str]`: The path of the shard in the dataset, or `None` if
+            there were no records to sync.
+        """
+        if not self.sync_repo_id:
+            raise ValueError(
+                "No dataset to sync to, use `DuckDBStore(sync_repo_id=...)`"
+            )
+        from huggingface_hub import CommitOperationAdd, HfApi
+
+        self.flush()
+        if RECORDS_VIEW not in self._tables:
+            return None
+        with self._sync_lock:
+            cursor = self._cursor()
+            init_sync_state(cursor)
+            state = read_sync_state(cursor, self.sync_repo_id)
+            relation = self._relation()
+            if state.pending is None:
+                cutoff = datetime.datetime.now() - datetime.timedelta(
+                    seconds=self.sync_lag
+                )
+                upper = next_watermark(cursor, relation, state.watermark, cutoff)
+                if upper is None:
+                    return None
+                state.pending, state.pending_shard = upper, shard_name(upper)
+                write_sync_state(cursor, self.sync_repo_id, state)
+
+            path_in_repo = f"data/{state.pending_shard}"
+            api = HfApi(token=self.sync_token)
+            api.create_repo(self.sync_repo_id, repo_type="dataset", exist_ok=True)
+            # the shard was uploaded before the state was saved by an earlier sync
+            if not api.file_exists(
+                self.sync_repo_id, path_in_repo, repo_type="dataset"
+            ):
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    local_path = os.path.join(tmp_dir, state.pending_shard)
+                    sql, params = build_sync_sql(
+                        relation, state.watermark, state.pending
+                    )
+                    cursor.execute(
+                        f"COPY ({sql}) TO {self._quote_path(local_path)} "
+                        "(FORMAT parquet, COMPRESSION zstd)",
+                        params,
+                    )
+                    api.create_commit(
+                        repo_id=self.sync_repo_id,
+                        repo_type="dataset",
+                        operations=[
+                            CommitOperationAdd(
+                                path_in_repo=path_in_repo, path_or_fileobj=local_path
+                            )
+                        ],
+                        commit_message=f"Sync records up to {state.pending[0]}",
+                    )
+            write_sync_state(
+                cursor, self.sync_repo_id, SyncState(watermark=state.pending)
+            )
+            return path_in_repo
+
+    def _copy_to(self, path: str) -> None:
+        """
+        Copy the database to a temporary file which then replaces `path`. The copy
+        is made from a consistent snapshot on its own cursor, so writes proceed.
+        Snapshots and publications are made one at a time, as they attach their
+        copy under the same name.
+        """
+        self.flush()
+        tmp_path = f"{path}.tmp"
+        with self._copy_lock:
+            for stale in (tmp_path, f"{tmp_path}.wal"):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            cursor = self._cursor()
+            (database,) = cursor.execute("SELECT current_database()").fetchone()
+            cursor.execute(f"ATTACH {self._quote_path(tmp_path)} AS observers_copy")
+            try:
+                cursor.execute(
+                    f"COPY FROM DATABASE {escape_identifier(database)} "
+                    "TO observers_copy"
+                )
+            finally:
+                cursor.execute("DETACH observers_copy")
+                cursor.close()
+            os.replace(tmp_path, path)
+
+    def _load_vss(self) -> None:
+        """Load the vss extension, letting HNSW indexes be persisted"""
+        load_extension(self._conn, "vss", self.vss_extension_path, "vss_extension_path")
+        self._conn.execute("SET hnsw_enable_experimental_persistence = true")
+
+    def _init_embeddings(self) -> None:
+        """Add the embedding column to record tables, and their HNSW index"""
+        if self.vector_index:
+            self._load_vss()
+        for table in self._record_tables():
+            add_embedding_column(self._conn, table, self.embedding_dim)
+            if self.vector_index:
+                create_hnsw_index(self._conn, table)
+
+    def _promote_properties(self) -> None:
+        """Add the promoted property columns missing from record tables, and fill them"""
+        columns = dict(
+            self._conn.execute(
+                "SELECT table_name, list(column_name) FROM information_schema.columns "
+                "WHERE table_catalog = current_database() GROUP BY table_name"
+            ).fetchall()
+        )
+        for table in self._record_tables():
+            name = quote_identifier(table)
+            for prop in self.promoted_properties:
+                if prop.column in columns.get(table, []):
+                    continue
+                column = quote_identifier(prop.column)
+                self._conn.execute(
+                    f"ALTER TABLE {name} ADD COLUMN {column} {prop.duckdb_type}"
+                )
+                self._conn.execute(
+                    f"UPDATE {name} SET {column} = {promoted_value_expression(prop)} "
+                    "WHERE properties IS NOT NULL"
+                )
+
+    def _promoted_columns(self) -> Dict[str, str]:
+        return {prop.name: prop.column for prop in self.promoted_properties or []}
+
+    def _payload_columns(self, columns: List[str]) -> List[str]:
+        """Get the payload columns among the columns of a record table"""
+        return [c for c in self.payload_columns or [] if c in columns]
+
+    def _payload_table(self, table: str) -> str:
+        return f"{table}_payload"
+
+    def _init_payload_table(self, table: str, columns: Dict[str, str]) -> None:
+        """Create the payload table of a record table and the view joining them"""
+        payload = self._payload_table(table)
+        self._conn.execute(self._table_schema(payload, columns))
+        for column, type in columns.items():
+            self._conn.execute(
+                f"ALTER TABLE {quote_identifier(payload)} "
+                f"ADD COLUMN IF NOT EXISTS {quote_identifier(column)} {type}"
+            )
+        self._conn.execute(
+            f"CREATE OR REPLACE VIEW {quote_identifier(f'{table}_full')} AS "
+            f"SELECT * FROM {quote_identifier(table)} "
+            f"LEFT JOIN {quote_identifier(payload)} USING (id)"
+        )
+        for name in (payload, f"{table}_full"):
+            if name not in self._tables:
+                self._tables.append(name)
+
+    def _split_payload_tables(self, tables: List[str]) -> None:
+        """Move the payload columns of record tables to their payload tables"""
+        for table in tables:
+            types = dict(
+                self._conn.execute(
+                    "SELECT column_name, data_type FROM information_schema.columns "
+                    "WHERE table_name = ? AND table_catalog = current_database()",
+                    [table],
+                ).fetchall()
+            )
+            payload = self._payload_columns(types)
+            name = quote_identifier(table)
+            self._conn.execute("BEGIN TRANSACTION")
+            try:
+                self._init_payload_table(
+                    table, {"id": types["id"], **{c: types[c] for c in payload}}
+                )
+                if payload:
+                    columns = ", ".join(quote_identifier(c) for c in payload)
+                    not_null = " OR ".join(
+                        f"{quote_identifier(c)} IS NOT NULL" for c in payload
+                    )
+                    self._conn.execute(
+                        f"INSERT INTO {quote_identifier(self._payload_table(table))} "
+                        f"BY NAME SELECT id, {columns} FROM {name} WHERE {not_null}"
+                    )
+                    for column in payload:
+                        self._conn.execute(
+                            f"ALTER TABLE {name} DROP COLUMN {quote_identifier(column)}"
+                        )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if tables:
+            self._refresh_records_view()
+
+    def _refresh_records_view(self) -> None:
+        """
+        (Re)create the views over every record table, with the provider of records
+        from per-provider tables as a constant so that filters on it prune tables
+        """
+        views = {RECORDS_VIEW: ""}
+        if self.payload_columns:
+            views[FULL_RECORDS_VIEW] = "_full"
+        for view, suffix in views.items():
+            selects = []
+            for table in self._record_tables():
+                relation = quote_identifier(f"{table}{suffix}")
+                provider = self._table_provider(table)
+                selects.append(
+                    f"SELECT * FROM {relation}"
+                    if provider is None
+                    else f"SELECT *, '{provider}' AS provider FROM {relation}"
+                )
+            self._conn.execute(
+                f"CREATE OR REPLACE VIEW {view} AS "
+                + " UNION ALL BY NAME ".join(selects)
+            )
+            if view not in self._tables:
+                self._tables.append(view)
+
+    def _drop_primary_keys(self) -> None:
+        """
+        Rewrite record tables declaring a primary key without it, creating their
+        indexes, such as HNSW indexes, again on the new table
+        """
+        tables = [
+            table
+            for (table,) in self._conn.execute(
+                "SELECT table_name FROM duckdb_constraints() "
+                "WHERE constraint_type = 'PRIMARY KEY' "
+                "AND database_name = current_database()"
+            ).fetchall()
+            if table in self._record_tables() or table.endswith("_payload")
+        ]
+        if tables and self.vector_index:
+            self._load_vss()
+        for table in tables:
+            name = quote_identifier(table)
+            staging = quote_identifier(f"{table}_rewrite")
+            indexes = self._conn.execute(
+                "SELECT sql FROM duckdb_indexes() WHERE table_name = ? "
+                "AND database_name = current_database()",
+                [table],
+            ).fetchall()
+            self._conn.execute("BEGIN TRANSACTION")
+            try:
+                self._conn.execute(f"CREATE TABLE {staging} AS SELECT * FROM {name}")
+                self._conn.execute(f"DROP TABLE {name}")
+                self._conn.execute(f"ALTER TABLE {staging} RENAME TO {name}")
+                for (sql,) in indexes:
+                    self._conn.execute(sql)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _table_schema(self, table: str, columns: Dict[str, str]) -> str:
+        """Get the DDL creating a table with the given column types"""
+        definitions = [
+            f"{quote_identifier(name)} {type}"
+            + (" PRIMARY KEY" if name == "id" and self.primary_key else "")
+            for name, type in columns.items()
+        ]
+        return (
+            f"CREATE TABLE IF NOT EXISTS {quote_identifier(table)} "
+            f"({', '.join(definitions)})"
+        )
 
     def _get_tables(self) -> List[str]:
         """Get all tables in the database"""
         return [table[0] for table in self._conn.execute("SHOW TABLES").fetchall()]
 
+    def _record_tables(self, tables: Optional[List[str]] = None) -> List[str]:
+        """Get the tables holding records"""
+        tables = self._tables if tables is None else tables
+        return [
+            table
+            for table in tables
+            if table == UNIFIED_TABLE
+            or (table.endswith("_records") and table != RECORDS_VIEW)
+        ]
+
+    def _table_provider(self, table: str) -> Optional[str]:
+        """
+        Get the provider of the records in a table, or `None` for the unified table
+        where it is stored with each record
+        """
+        if table == UNIFIED_TABLE:
+            return None
+        provider = table[: -len("_records")]
+        quote_identifier(provider)
+        return provider
+
+    def _cursor(self) -> duckdb.DuckDBPyConnection:
+        """Get a cursor for reads that is safe to use from the calling thread"""
+        return self._conn.cursor()
+
+    def _relation(
+        self, table: Optional[str] = None, columns: Optional[List[str]] = None
+    ) -> str:
+        """
+        Get the SQL relation for a table, or for all record tables, joining the
+        payload columns only if some of the columns are payload columns
+        """
+        if table is None and RECORDS_VIEW not in self._tables:
+            raise ValueError("No records have been stored yet")
+        full = self.payload_columns and (
+            columns is None or self._payload_columns(columns)
+        )
+        if table is None:
+            return FULL_RECORDS_VIEW if full else RECORDS_VIEW
+        if full and table in self._record_tables():
+            return quote_identifier(f"{table}_full")
+        return quote_identifier(table)
+
     def add(self, record: "Record"):
         """Add a new record to the database"""
-        if record.table_name not in self._tables:
-            self._init_table(record)
+        row = self._record_row(record)
+        table = record.table_name
+        if self.unified:
+            table = UNIFIED_TABLE
+            row["provider"] = record.client_name
+        with self._lock:
+            if table not in self._tables:
+                self._init_table(record, table)
+            self._buffer.setdefault(table, []).append(row)
+            pending = sum(len(rows) for rows in self._buffer.values())
+        if pending >= self.batch_size:
+            self.flush()
 
+    def _record_row(self, record: "Record") -> Dict[str, Any]:
+        """Convert a record into a row matching its table columns"""
         record_dict = asdict(record)
+        row = {}
+        for column in record.table_columns:
+            value = record_dict.get(column)
+            # tags are stored as a list, other nested values as JSON
+            if isinstance(value, (dict, list)) and column != "tags":
+                value = json.dumps(value)
+            row[column] = value
+        for prop in self.promoted_properties or []:
+            row[prop.column] = prop.value(record.properties)
+        return row
+
+    def flush(self) -> None:
+        """Write all buffered records to the database"""
+        with self._lock:
+            buffer, self._buffer = self._buffer, {}
+            for table, rows in buffer.items():
+                self._insert_rows(table, rows)
+
+    def _deduplicate(self, table: str, rows: List[Dict[str, Any]]):
+        """
+        Drop rows whose id is already in the batch or in the table, keeping the last
+        row for each id. Without a primary key, ids are only looked up among the
+        records written within `dedup_window` seconds of the batch.
+        """
+        rows = list({row["id"]: row for row in rows}.values())
+        condition, params = "", []
+        if not self.primary_key:
+            timestamps = [
+                datetime.datetime.fromisoformat(str(row["timestamp"]))
+                for row in rows
+                if row.get("timestamp")
+            ]
+            since = min(
+                timestamps, default=datetime.datetime.now()
+            ) - datetime.timedelta(seconds=self.dedup_window)
+            condition, params = "timestamp >= ? AND ", [since]
+        existing = {
+            id
+            for (id,) in self._conn.execute(
+                f"SELECT id FROM {quote_identifier(table)} "
+                f"WHERE {condition}id IN (SELECT unnest(?::VARCHAR[]))",
+                params + [[row["id"] for row in rows]],
+            ).fetchall()
+        }
+        return [row for row in rows if row["id"] not in existing]
+
+    def _insert_rows(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        """
+        Insert a batch of rows, dropping the rows with an id that was already
+        written, e.g. by a retry of the same completion
+        """
+        if not self.primary_key:
+            rows = self._deduplicate(table, rows)
+            if not rows:
+                return
+        try:
+            self._write_batch(table, rows)
+        except duckdb.ConstraintException:
+            if not self.primary_key:
+                raise
+            # the batch was rolled back, write it again without the duplicate ids
+            rows = self._deduplicate(table, rows)
+            if rows:
+                self._write_batch(table, rows)
+
+    def _write_batch(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        """Insert a batch of rows, and update the rollups, in a single transaction"""
+        self._conn.register("observers_batch", pa.Table.from_pylist(rows))
+        payload = self._payload_columns(rows[0])
+        columns = ", ".join(quote_identifier(c) for c in payload)
+        try:
+            self._conn.execute("BEGIN TRANSACTION")
+            try:
+                self._conn.execute(
+                    f"INSERT INTO {quote_identifier(table)} BY NAME SELECT * "
+                    + (f"EXCLUDE ({columns}) " if payload else "")
+                    + "FROM observers_batch"
+                )
+                if payload:
+                    self._conn.execute(
+                        f"INSERT INTO {quote_identifier(self._payload_table(table))} "
+                        f"BY NAME SELECT id, {columns} FROM observers_batch"
+                    )
+                if self.rollups:
+                    update_rollups(
+                        self._conn, "observers_batch", self._table_provider(table)
+                    )
+                if self.search_index:
+                    update_search(self._conn, "observers_batch")
+                    self._search_pending += len(rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        finally:
+            self._conn.unregister("observers_batch")
+
+    def refresh_search_index(self, force: bool = True) -> None:
+        """
+        Rebuild the full-text index if records were written since it was built.
+
+        Args:
+            force (`bool`, *optional*):
+                Whether to rebuild the index even if it is less than
+                `search_refresh_interval` seconds old and less than
+                `search_refresh_rows` records were written since.
+        """
+        if not self.search_index:
+            raise ValueError(
+                "Search is not enabled, use `DuckDBStore(search_index=True)`"
+            )
+        self.flush()
+        with self._lock:
+            if not self._search_pending:
+                return
+            if (
+                force
+                # the index may be missing until it is built by this store
+                or self._search_built is None
+                or time.monotonic() - self._search_built >= self.search_refresh_interval
+                or self._search_pending >= self.search_refresh_rows
+            ):
+                rebuild_search_index(self._conn)
+                self._search_pending = 0
+                self._search_built = time.monotonic()
+
+    def search(
+        self,
+        text: str,
+        limit: int = 10,
+        columns: Optional[List[str]] = None,
+        **filters: Any,
+    ) -> "pa.Table":
+        """
+        Return the records whose message contents or assistant message best match
+        `text`, ranked by BM25 `score`, as an Arrow table.
 
-        for json_field in record.json_fields:
-            if record_dict[json_field]:
-                record_dict[json_field] = json.dumps(record_dict[json_field])
+        Rebuilding the index takes time proportional to the number of records, so
+        it is only refreshed first if it is `search_refresh_interval` seconds old or
+        `search_refresh_rows` records were written since it was built. Call
+        `refresh_search_index` to search the latest records.
 
-        placeholders = ", ".join(
-            ["$" + str(i + 1) for i in range(len(record.table_columns))]
+        Args:
+            text (`str`):
+                The words to search for.
+            limit (`int`, *optional*):
+                The maximum number of records to return, defaults to 10.
+            columns (`List[str]`, *optional*):
+                The columns to return along with `score`, defaults to all columns.
+            **filters:
+                Filters pushed down into DuckDB, see `Filters`.
+        """
+        self.refresh_search_index(force=False)
+        sql, params = build_search_sql(
+            self._relation(None, columns),
+            text,
+            Filters(**filters),
+            columns,
+            limit,
+            self._promoted_columns(),
         )
+        return to_arrow_table(self._cursor().execute(sql, params))
 
-        # Sort record_dict based on table_columns order
-        if hasattr(record, "table_columns"):
-            sorted_dict = {k: record_dict[k] for k in record.table_columns}
-            record_dict = sorted_dict
+    def embed_pending(self) -> int:
+        """
+        Embed a batch of records of each table which don't have an embedding yet,
+        this runs in the background every `embedding_interval` seconds.
 
-        self._conn.execute(
-            f"INSERT INTO {record.table_name} VALUES ({placeholders})",
-            [
-                record_dict[k] if k in record_dict else None
-                for k in record.table_columns
-            ],
+        Returns:
+            `int`: The number of records embedded.
+        """
+        if not self.embedding_fn:
+            raise ValueError(
+                "No embedding function, use `DuckDBStore(embedding_fn=...)`"
+            )
+        count = 0
+        for table in self._record_tables():
+            pending = pending_embeddings(
+                self._cursor(),
+                self._relation(table, ["messages"]),
+                self.embedding_batch_size,
+            )
+            if not pending:
+                continue
+            ids, texts = zip(*pending)
+            # the embedding function may be slow, it is called without the lock
+            vectors = [list(map(float, v)) for v in self.embedding_fn(list(texts))]
+            batch = pa.table({"id": list(ids), "embedding": vectors})
+            with self._lock:
+                self._conn.register("observers_embeddings", batch)
+                try:
+                    update_embeddings(
+                        self._conn, table, "observers_embeddings", self.embedding_dim
+                    )
+                finally:
+                    self._conn.unregister("observers_embeddings")
+            count += len(ids)
+        return count
+
+    def similar(
+        self,
+        text_or_vector: Union[str, List[float]],
+        k: int = 10,
+        columns: Optional[List[str]] = None,
+        **filters: Any,
+    ) -> "pa.Table":
+        """
+        Return the `k` embedded records closest to a text or an embedding, with
+        their cosine `distance`, as an Arrow table.
+
+        Args:
+            text_or_vector (`Union[str, List[float]]`):
+                The text to embed with `embedding_fn`, or an embedding.
+            k (`int`, *optional*):
+                The number of records to return, defaults to 10.
+            columns (`List[str]`, *optional*):
+                The columns to return along with `distance`, defaults to all columns.
+            **filters:
+                Filters pushed down into DuckDB, see `Filters`.
+        """
+        if not self.embedding_dim:
+            raise ValueError(
+                "Embeddings are not enabled, use `DuckDBStore(embedding_dim=...)`"
+            )
+        vector = text_or_vector
+        if isinstance(text_or_vector, str):
+            if not self.embedding_fn:
+                raise ValueError("Pass a vector or use `DuckDBStore(embedding_fn=...)`")
+            vector = self.embedding_fn([text_or_vector])[0]
+        sql, params = build_similar_sql(
+            self._relation(None, columns),
+            [float(v) for v in vector],
+            self.embedding_dim,
+            Filters(**filters),
+            columns,
+            k,
+            self._promoted_columns(),
+        )
+        return to_arrow_table(self._cursor().execute(sql, params))
+
+    def backfill_rollups(self) -> None:
+        """Rebuild the rollup tables from all the records in the database"""
+        self.flush()
+        with self._lock:
+            backfill_rollups(
+                self._conn,
+                {table: self._table_provider(table) for table in self._record_tables()},
+            )
+            self._tables = self._get_tables()
+
+    def rollup_stats(
+        self,
+        interval: str = "minute",
+        metrics: Optional[List[str]] = None,
+        group_by: Optional[Union[str, List[str]]] = None,
+        **filters: Any,
+    ) -> "pa.Table":
+        """
+        Return aggregated statistics from the rollup tables as an Arrow table.
+
+        The cost of this query depends on the time range and not on the number of
+        records. Time filters are applied at the resolution of the rollup.
+
+        Args:
+            interval (`str`, *optional*):
+                Bucket the records by time, e.g. `minute`, `5 minutes` or `day`.
+            metrics (`List[str]`, *optional*):
+                The metrics to compute, see `ROLLUP_METRICS`, and `latency_p<quantile>`.
+            group_by (`Union[str, List[str]]`, *optional*):
+                Group by `model` and/or `provider`.
+            **filters:
+                The `provider`, `model`, `since` and `until` filters.
+        """
+        if not self.rollups:
+            raise ValueError("Rollups are not enabled, use `DuckDBStore(rollups=True)`")
+        sql, params = build_rollup_sql(
+            interval, metrics or DEFAULT_METRICS, group_by, Filters(**filters)
         )
+        return to_arrow_table(self._cursor().execute(sql, params))
 
     async def add_async(self, record: "Record"):
         """Add a new record to the database asynchronously"""
         await asyncio.to_thread(self.add, record)
 
+    def apply_retention(self) -> Dict[str, int]:
+        """
+        Apply the retention policy, then checkpoint the database so that its file
+        shrinks. Records are slimmed and deleted in batches of `retention_batch_size`,
+        so writes can proceed in between.
+
+        Returns:
+            `Dict[str, int]`: The number of records slimmed and deleted.
+        """
+        if not self.retention:
+            raise ValueError("No retention policy, use `DuckDBStore(retention=...)`")
+        self.flush()
+        now = datetime.datetime.now()
+        counts = {"slimmed": 0, "deleted": 0}
+        # the text of slimmed records is slimmed in the search table too
+        slimmed_ids = [] if self.search_index else None
+        # records are deleted first so that they are not slimmed needlessly
+        for table in self._record_tables():
+            policy = self.retention.for_table(table)
+            name = quote_identifier(table)
+            columns = [
+                quote_identifier(c)
+                for c in policy.slim_columns
+                if c in self._table_columns(table)
+            ]
+            payload = None
+            if self._payload_table(table) in self._tables:
+                payload = quote_identifier(self._payload_table(table))
+                payload_columns = [
+                    c
+                    for c in self._table_columns(self._payload_table(table))
+                    if c != "id"
+                ]
+            delete = policy.condition("slim_days", now)
+            if delete:
+                condition, params = delete
+                if payload:
+                    self._run_in_batches(
+                        f"DELETE FROM {payload} WHERE rowid IN "
+                        f"(SELECT {payload}.rowid FROM {payload} JOIN {name} USING (id) "
+                        f"WHERE {condition} LIMIT {int(self.retention_batch_size)})",
+                        params,
+                    )
+                counts["deleted"] += self._run_in_batches(
+                    f"DELETE FROM {name} WHERE rowid IN (SELECT rowid FROM {name} "
+                    f"WHERE {condition} LIMIT {int(self.retention_batch_size)})",
+                    params,
+                )
+            slim = policy.condition("full_days", now)
+            slimmed = 0
+            if slim and columns:
+                condition, params = slim
+                not_slim = " OR ".join(f"{c} IS NOT NULL" for c in columns)
+                slimmed = self._run_in_batches(
+                    f"UPDATE {name} SET {', '.join(f'{c} = NULL' for c in columns)} "
+                    f"WHERE rowid IN (SELECT rowid FROM {name} "
+                    f"WHERE {condition} AND ({not_slim}) "
+                    f"LIMIT {int(self.retention_batch_size)})",
+                    params,
+                    slimmed_ids,
+                )
+            if slim and payload:
+                condition, params = slim
+                columns = [
+                    quote_identifier(c)
+                    for c in policy.slim_columns
+                    if c in payload_columns
+                ]
+                rows = (
+                    f"SELECT {payload}.rowid FROM {payload} JOIN {name} USING (id) "
+                    f"WHERE {condition}"
+                )
+                if set(payload_columns) <= set(policy.slim_columns):
+                    # slim payloads are deleted rather than kept as rows of NULLs
+                    slimmed = max(
+                        slimmed,
+                        self._run_in_batches(
+                            f"DELETE FROM {payload} WHERE rowid IN "
+                            f"({rows} LIMIT {int(self.retention_batch_size)})",
+                            params,
+                            slimmed_ids,
+                        ),
+                    )
+                elif columns:
+                    not_slim = " OR ".join(f"{c} IS NOT NULL" for c in columns)
+                    slimmed = max(
+                        slimmed,
+                        self._run_in_batches(
+                            f"UPDATE {payload} "
+                            f"SET {', '.join(f'{c} = NULL' for c in columns)} "
+                            f"WHERE rowid IN ({rows} AND ({not_slim}) "
+                            f"LIMIT {int(self.retention_batch_size)})",
+                            params,
+                            slimmed_ids,
+                        ),
+                    )
+            counts["slimmed"] += slimmed
+        with self._lock:
+            if self.search_index and counts["deleted"]:
+                self._conn.execute(
+                    f"DELETE FROM {SEARCH_TABLE} "
+                    f"WHERE id NOT IN (SELECT id FROM {RECORDS_VIEW})"
+                )
+                self._search_pending += counts["deleted"]
+            if slimmed_ids:
+                self._slim_search(slimmed_ids)
+            self._conn.execute("CHECKPOINT")
+        return counts
+
+    def _slim_search(self, ids: List[str]) -> None:
+        """Replace the searchable text of slimmed records by that of what is left"""
+        ids = list(set(ids))
+        self._conn.execute("BEGIN TRANSACTION")
+        try:
+            self._conn.execute(
+                f"DELETE FROM {SEARCH_TABLE} WHERE id IN (SELECT unnest(?::VARCHAR[]))",
+                [ids],
+            )
+            update_search(
+                self._conn,
+                f"(SELECT * FROM {self._relation(None, ['messages'])} "
+                "WHERE id IN (SELECT unnest(?::VARCHAR[])))",
+                [ids],
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._search_pending += len(ids)
+
+    def _run_in_batches(
+        self, statement: str, params: List[Any], ids: Optional[List[str]] = None
+    ) -> int:
+        """
+        Run a statement affecting a batch of rows until no rows are affected,
+        collecting the ids of the rows into `ids` if given
+        """
+        total = 0
+        while True:
+            with self._lock:
+                if ids is None:
+                    count = self._conn.execute(statement, params).fetchone()[0]
+                else:
+                    rows = self._conn.execute(
+                        f"{statement} RETURNING id", params
+                    ).fetchall()
+                    ids.extend(id for (id,) in rows)
+                    count = len(rows)
+            total += count
+            if not count:
+                return total
+
+    def _table_columns(self, table: str) -> List[str]:
+        """Get the columns of a table"""
+        return [
+            row[0]
+            for row in self._cursor()
+            .execute(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_name = ? ORDER BY ordinal_position",
+                [table],
+            )
+            .fetchall()
+        ]
+
     def close(self) -> None:
-        """Close the database connection"""
+        """Flush buffered records and close the database connection"""
+        if not release(self):
+            return
+        workers = (
+            self._flusher,
+            self._retention_worker,
+            self._embedder,
+            self._snapshotter,
+            self._publisher,
+            self._syncer,
+        )
+        for worker in workers:
+            if worker:
+                worker.stop()
+        self._flusher = self._retention_worker = self._embedder = None
+        self._snapshotter = self._publisher = self._syncer = None
         if self._conn:
-            self._conn.close()
-            self._conn = None
+            try:
+                self.flush()
+                if self.mode == "memory":
+                    self.snapshot()
+                if self.publish_path:
+                    self.publish()
+            finally:
+                self._conn.close()
+                self._conn = None
+
+    async def close_async(self) -> None:
+        """Close the store asynchronously, see `close`"""
+        await asyncio.to_thread(self.close)
 
     def __enter__(self):
         return self
@@ -97,28 +1233,35 @@ class DuckDBStore(SQLStore):
         """Apply a schema migration"""
         self._conn.execute(migration_script)
 
-    def _get_current_schema_version(self) -> int:
-        """Get the current schema version, creating the table if it doesn't exist"""
-        table_exists = self._conn.execute(
-            "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = 'schema_version'"
-        ).fetchone()[0]
-
-        # create the schema_version table if it doesn't exist
-        if not table_exists:
-            self._conn.execute(
+    def _load_schema_state(self) -> Optional[List[str]]:
+        """
+        Get all tables in the database in a single query if every migration has
+        been applied, or `None` if migrations are pending
+        """
+        try:
+            tables, versions, checksums = self._conn.execute(
                 """
-                CREATE TABLE schema_version (
-                    version INTEGER PRIMARY KEY,
-                    migration_name VARCHAR,
-                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """
-            )
-            self._conn.execute(
-                "INSERT INTO schema_version (version, migration_name) VALUES (0, 'initial')"
-            )
+                SELECT
+                    (SELECT list(table_name) FROM information_schema.tables
+                     WHERE table_schema = 'main' AND table_catalog = current_database()),
+                    list(version ORDER BY version),
+                    list(checksum ORDER BY version)
+                FROM schema_version
+                WHERE version > 0
+                """
+            ).fetchone()
+        except duckdb.Error:
+            return None
+        expected = self._get_available_migrations()
+        if versions != [m.version for m in expected] or checksums != [
+            m.checksum for m in expected
+        ]:
+            return None
+        return tables
 
-        # retrieve the current schema version
+    def _get_current_schema_version(self) -> int:
+        """Get the current schema version, creating the table if it doesn't exist"""
+        self._create_version_table()
         result = self._conn.execute(
             "SELECT version FROM schema_version ORDER BY version DESC LIMIT 1"
         ).fetchone()
@@ -127,51 +1270,60 @@ class DuckDBStore(SQLStore):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
-    def _get_migrations_path(self) -> Path:
-        """Get the path to migrations directory"""
-        return Path(__file__).parent / "migrations"
-
-    def _get_available_migrations(self) -> List[tuple[int, str]]:
-        """Get all available migration files sorted by version"""
-        migrations_path = self._get_migrations_path()
-        migration_files = glob.glob(str(migrations_path / "*.sql"))
-
-        # extract version and path using regex
-        migrations = []
-        for file_path in migration_files:
-            # Match migration files in format: any_prefix_NUMBER_any_suffix.sql
-            # e.g., "001_create_users.sql" or "v1_init.sql" - extracts "1" as version
-            if match := re.match(r".*?(\d+)_.+\.sql$", file_path):
-                version = int(match.group(1))
-                migrations.append((version, file_path))
-
-        return sorted(migrations)
+    def _get_available_migrations(self) -> List[Migration]:
+        """Get all bundled migrations sorted by version"""
+        return sorted(MIGRATIONS, key=lambda m: m.version)
 
     def _apply_pending_migrations(self):
-        """Apply any pending migrations"""
-        current_version = self._get_current_schema_version()
-        available_migrations = self._get_available_migrations()
-
-        for version, migration_path in available_migrations:
-            if version > current_version:
-                with open(migration_path, "r") as f:
-                    migration_script = f.read()
+        """
+        Apply any pending migrations, verifying the checksums of applied migrations.
 
-                migration_name = Path(
-                    migration_path
-                ).stem  # Gets filename without extension
+        Per-table migrations are applied to every record table. Migrations recorded
+        without a checksum, by earlier versions of observers, are applied again to
+        every record table, as they may only have been applied to `openai_records`.
+        """
+        self._get_current_schema_version()
+        applied = dict(
+            self._conn.execute(
+                "SELECT version, checksum FROM schema_version WHERE version > 0"
+            ).fetchall()
+        )
 
-                self._conn.execute("BEGIN TRANSACTION")
-                try:
-                    self._migrate_schema(migration_script)
-                    self._conn.execute(
-                        "INSERT INTO schema_version (version, migration_name) VALUES (?, ?)",
-                        [version, migration_name],
+        for migration in self._get_available_migrations():
+            version = migration.version
+            if version in applied and applied[version] is not None:
+                if applied[version] != migration.checksum:
+                    raise Exception(
+                        f"Migration {version} ({migration.name}) does not match the "
+                        "migration applied to the database"
                     )
-                    self._conn.execute("COMMIT")
-                except Exception as e:
-                    self._conn.execute("ROLLBACK")
-                    raise Exception(f"Migration {version} failed: {str(e)}")
+                continue
+            if version in applied and not migration.per_table:
+                self._conn.execute(
+                    "UPDATE schema_version SET checksum = ? WHERE version = ?",
+                    [migration.checksum, version],
+                )
+                continue
+
+            self._conn.execute("BEGIN TRANSACTION")
+            try:
+                if migration.per_table:
+                    for table in self._record_tables(self._get_tables()):
+                        self._migrate_schema(migration.render(quote_identifier(table)))
+                else:
+                    self._migrate_schema(migration.sql)
+                self._conn.execute(
+                    """
+                    INSERT INTO schema_version (version, migration_name, checksum)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT DO UPDATE SET checksum = EXCLUDED.checksum
+                    """,
+                    [version, migration.name, migration.checksum],
+                )
+                self._conn.execute("COMMIT")
+            except Exception as e:
+                self._conn.execute("ROLLBACK")
+                raise Exception(f"Migration {version} failed: {str(e)}")
 
     def _check_table_exists(self, table_name: str) -> bool:
         """Check if a table exists in the database"""
@@ -188,8 +1340,13 @@ class DuckDBStore(SQLStore):
             CREATE TABLE IF NOT EXISTS schema_version (
                 version INTEGER PRIMARY KEY,
                 migration_name VARCHAR,
-                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                checksum VARCHAR
+            );
+            ALTER TABLE schema_version ADD COLUMN IF NOT EXISTS checksum VARCHAR;
+            INSERT INTO schema_version (version, migration_name)
+            SELECT 0, 'initial'
+            WHERE NOT EXISTS (SELECT 1 FROM schema_version);
         """
         )
 
@@ -0,0 +1,81 @@
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from observers.stores.query import Filters, quote_identifier
+from observers.stores.search import SEARCH_TEXT_EXPRESSION
+
+if TYPE_CHECKING:
+    import duckdb
+
+EMBEDDING_COLUMN = "embedding"
+
+
+def embedding_type(dim: int) -> str:
+    """Return the DuckDB type of embeddings, a fixed-size array"""
+    return f"FLOAT[{int(dim)}]"
+
+
+def add_embedding_column(
+    conn: "duckdb.DuckDBPyConnection", table: str, dim: int
+) -> None:
+    """Add the embedding column to a record table if it doesn't have one"""
+    conn.execute(
+        f"ALTER TABLE {quote_identifier(table)} "
+        f"ADD COLUMN IF NOT EXISTS {EMBEDDING_COLUMN} {embedding_type(dim)}"
+    )
+
+
+def pending_embeddings(
+    conn: "duckdb.DuckDBPyConnection", relation: str, limit: int
+) -> List[Tuple[str, str]]:
+    """Return the ids and text of records of a relation without an embedding"""
+    return conn.execute(
+        f"SELECT id, {SEARCH_TEXT_EXPRESSION} AS text FROM {relation} "
+        f"WHERE {EMBEDDING_COLUMN} IS NULL AND text <> '' LIMIT {int(limit)}"
+    ).fetchall()
+
+
+def update_embeddings(
+    conn: "duckdb.DuckDBPyConnection", table: str, source: str, dim: int
+) -> None:
+    """Set the embeddings of a record table from the `id` and `embedding` of `source`"""
+    name = quote_identifier(table)
+    conn.execute(
+        f"UPDATE {name} SET {EMBEDDING_COLUMN} = "
+        f"CAST({source}.embedding AS {embedding_type(dim)}) "
+        f"FROM {source} WHERE {name}.id = {source}.id"
+    )
+
+
+def create_hnsw_index(conn: "duckdb.DuckDBPyConnection", table: str) -> None:
+    """Create a `vss` HNSW index over the embeddings of a record table"""
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS {quote_identifier(f'{table}_embedding_hnsw')} "
+        f"ON {quote_identifier(table)} USING HNSW ({EMBEDDING_COLUMN}) "
+        "WITH (metric = 'cosine')"
+    )
+
+
+def build_similar_sql(
+    relation: str,
+    vector: List[float],
+    dim: int,
+    filters: Filters,
+    columns: Optional[List[str]] = None,
+    k: int = 10,
+    promoted: Optional[Dict[str, str]] = None,
+) -> Tuple[str, List[Any]]:
+    """
+    Build a nearest neighbours search over a relation, returning records with their
+    cosine `distance`. The shape of the query lets `vss` use an HNSW index.
+    """
+    if len(vector) != dim:
+        raise ValueError(f"Expected a vector of dimension {dim}, got {len(vector)}")
+    where, params = filters.to_sql(promoted)
+    projection = ", ".join(quote_identifier(c) for c in columns) if columns else "*"
+    sql = (
+        f"SELECT {projection}, array_cosine_distance({EMBEDDING_COLUMN}, "
+        f"?::{embedding_type(dim)}) AS distance FROM {relation} "
+        f"WHERE {EMBEDDING_COLUMN} IS NOT NULL AND {where} "
+        f"ORDER BY distance LIMIT {int(k)}"
+    )
+    return sql, [list(vector)] + params
@@ -0,0 +1,37 @@
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import duckdb
+
+
+def load_extension(
+    conn: "duckdb.DuckDBPyConnection",
+    name: str,
+    path: Optional[str] = None,
+    option: Optional[str] = None,
+) -> None:
+    """
+    Load a DuckDB extension from `path`, or from the local extension directory.
+    Nothing is downloaded, so that stores work offline.
+
+    Args:
+        conn (`duckdb.DuckDBPyConnection`):
+            The connection to load the extension into.
+        name (`str`):
+            The name of the extension, e.g. `fts`.
+        path (`str`, *optional*):
+            The path of the extension file.
+        option (`str`, *optional*):
+            The store option setting `path`, mentioned in the error message.
+    """
+    try:
+        if path:
+            conn.execute(f"LOAD '{path.replace(chr(39), chr(39) * 2)}'")
+        else:
+            conn.execute(f"LOAD {name}")
+    except Exception as e:
+        hint = f" or pass the path of the extension as `{option}`" if option else ""
+        raise ValueError(
+            f"Could not load the DuckDB {name} extension, run `INSTALL {name}` once "
+            f"with network access{hint}: {e}"
+        ) from e
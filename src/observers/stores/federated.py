@@ -0,0 +1,144 @@
+import glob
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import duckdb
+import pyarrow as pa
+
+from observers.stores.duckdb import FULL_RECORDS_VIEW, RECORDS_VIEW
+from observers.stores.query import Queryable, quote_identifier, to_arrow_table
+from observers.stores.reader import promoted_columns
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+@dataclass
+class FederatedReader(Queryable):
+    """
+    Read-only queries across many databases and Parquet exports, e.g. the
+    `store.db` files of many processes copied to one host, without merging them.
+
+    Every source is exposed through the `all_records` view with a `source` column,
+    the name of its file without extension, and `query`, `stats` and
+    `iter_records` run across all sources, which DuckDB scans in parallel.
+
+    Args:
+        databases (`List[str]`, *optional*):
+            Paths or glob patterns of DuckDB databases written by `DuckDBStore`,
+            attached read-only. They must not be open for writing, see
+            `DuckDBStore(publish_path=...)`.
+        parquet (`List[str]`, *optional*):
+            Paths or glob patterns of Parquet files of records.
+        threads (`int`, *optional*):
+            The number of threads used by DuckDB.
+    """
+
+    databases: List[str] = field(default_factory=list)
+    parquet: List[str] = field(default_factory=list)
+    threads: Optional[int] = None
+    _conn: Optional[duckdb.DuckDBPyConnection] = field(default=None, init=False)
+    _sources: Dict[str, str] = field(default_factory=dict, init=False)
+    _promoted: Dict[str, str] = field(default_factory=dict, init=False)
+
+    def __post_init__(self):
+        config = {"threads": self.threads} if self.threads else {}
+        self._conn = duckdb.connect(":memory:", config=config)
+        paths = sorted({p for pattern in self.databases for p in glob.glob(pattern)})
+        if not paths and not self.parquet:
+            raise ValueError("No databases or Parquet files to read")
+        for i, path in enumerate(paths):
+            alias = f"source_{i}"
+            self._conn.execute(f"ATTACH {_literal(path)} AS {alias} (READ_ONLY)")
+            name = os.path.splitext(os.path.basename(path))[0]
+            if name in self._sources.values():
+                name = f"{name}_{i}"
+            self._sources[alias] = name
+        self._create_views()
+        self._promoted = promoted_columns(self._conn)
+
+    @classmethod
+    def connect(
+        cls,
+        databases: Optional[List[str]] = None,
+        parquet: Optional[List[str]] = None,
+        threads: Optional[int] = None,
+    ) -> "FederatedReader":
+        """Create a new reader over databases and Parquet files"""
+        return cls(databases=databases or [], parquet=parquet or [], threads=threads)
+
+    def _source_tables(self, alias: str) -> List[str]:
+        return [
+            table
+            for (table,) in self._conn.execute(
+                "SELECT table_name FROM information_schema.tables "
+                "WHERE table_catalog = ? AND table_schema = 'main'",
+                [alias],
+            ).fetchall()
+        ]
+
+    def _union(self, table: str, fallback: Optional[str] = None) -> str:
+        """The union of a table of every attached database, with their source"""
+        selects = []
+        for alias, name in self._sources.items():
+            tables = self._source_tables(alias)
+            relation = table if table in tables else fallback
+            if relation in tables:
+                selects.append(
+                    f"SELECT *, {_literal(name)} AS source "
+                    f"FROM {alias}.{quote_identifier(relation)}"
+                )
+        if self.parquet and table in (RECORDS_VIEW, FULL_RECORDS_VIEW):
+            files = ", ".join(_literal(pattern) for pattern in self.parquet)
+            selects.append(
+                "SELECT * EXCLUDE (filename), "
+                r"regexp_extract(filename, '([^/\\]+)\.parquet$', 1) AS source "
+                f"FROM read_parquet([{files}], union_by_name = true, filename = true)"
+            )
+        if not selects:
+            raise ValueError(f"No source has a {table!r} table")
+        return " UNION ALL BY NAME ".join(selects)
+
+    def _create_views(self) -> None:
+        self._conn.execute(f"CREATE VIEW {RECORDS_VIEW} AS {self._union(RECORDS_VIEW)}")
+        self._conn.execute(
+            f"CREATE VIEW {FULL_RECORDS_VIEW} AS "
+            f"{self._union(FULL_RECORDS_VIEW, RECORDS_VIEW)}"
+        )
+
+    def _cursor(self) -> duckdb.DuckDBPyConnection:
+        return self._conn.cursor()
+
+    def _relation(
+        self, table: Optional[str] = None, columns: Optional[List[str]] = None
+    ) -> str:
+        if table is not None:
+            return f"({self._union(table)})"
+        hot = [
+            c
+            for (c,) in self._conn.execute(
+                f"SELECT column_name FROM (DESCRIBE {RECORDS_VIEW})"
+            ).fetchall()
+        ]
+        if columns is None or any(c not in hot for c in columns):
+            return FULL_RECORDS_VIEW
+        return RECORDS_VIEW
+
+    def _promoted_columns(self) -> Dict[str, str]:
+        return dict(self._promoted)
+
+    def sources(self) -> List[str]:
+        """Get the names of the attached databases"""
+        return list(self._sources.values())
+
+    def sql(self, query: str, params: Optional[List[Any]] = None) -> "pa.Table":
+        """Run a read-only SQL query and return the result as an Arrow table"""
+        return to_arrow_table(self._cursor().execute(query, params or []))
+
+    def close(self) -> None:
+        """Close the reader"""
+        if self._conn:
+            self._conn.close()
+            self._conn = None
@@ -1,5 +1,5 @@
-ALTER TABLE IF EXISTS openai_records 
+ALTER TABLE {table}
 ADD COLUMN IF NOT EXISTS arguments JSON;
 
-ALTER TABLE IF EXISTS openai_records 
+ALTER TABLE {table}
 DROP COLUMN IF EXISTS synced_at;
@@ -0,0 +1,2 @@
+ALTER TABLE {table}
+ADD COLUMN IF NOT EXISTS latency_ms DOUBLE;
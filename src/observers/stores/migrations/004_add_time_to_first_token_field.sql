@@ -0,0 +1,2 @@
+ALTER TABLE {table}
+ADD COLUMN IF NOT EXISTS time_to_first_token_ms DOUBLE;
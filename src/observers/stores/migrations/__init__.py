@@ -0,0 +1,45 @@
+import hashlib
+from dataclasses import dataclass
+from functools import cached_property
+from importlib.resources import files
+from typing import List
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    A schema migration bundled with the package.
+
+    Args:
+        version (`int`):
+            The schema version the migration upgrades to.
+        name (`str`):
+            The name of the SQL file holding the migration, without extension.
+        per_table (`bool`, *optional*):
+            Whether the migration is a template applied to every record table, with
+            `{table}` replaced by the table name. These migrations must be idempotent.
+    """
+
+    version: int
+    name: str
+    per_table: bool = False
+
+    @cached_property
+    def sql(self) -> str:
+        return files(__name__).joinpath(f"{self.name}.sql").read_text()
+
+    @cached_property
+    def checksum(self) -> str:
+        return hashlib.sha256(self.sql.encode()).hexdigest()
+
+    def render(self, table: str) -> str:
+        """Return the migration for a record table"""
+        return self.sql.replace("{table}", table)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "001_create_schema_version"),
+    Migration(2, "002_add_arguments_field", per_table=True),
+    Migration(3, "003_add_latency_field", per_table=True),
+    Migration(4, "004_add_time_to_first_token_field", per_table=True),
+]
@@ -1,8 +1,10 @@
 # stdlib features
 import asyncio
-from dataclasses import dataclass
+import datetime
+import json
+from dataclasses import asdict, dataclass, is_dataclass
 from importlib.metadata import PackageNotFoundError, version
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 # Actual dependencies
 from opentelemetry import trace
@@ -10,25 +12,50 @@ from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExport
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import Span, Tracer, TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter
+from opentelemetry.trace import SpanKind, Status, StatusCode
 
 # Observers internal interfaces
-from observers.base import Record
+from observers.base import PromotedProperty, Record
 from observers.stores.base import Store
 
+# Request arguments exported as `gen_ai.request.*` attributes, see
+# https://opentelemetry.io/docs/specs/semconv/gen-ai/gen-ai-spans/
+REQUEST_ATTRIBUTES = {
+    "temperature": "gen_ai.request.temperature",
+    "max_tokens": "gen_ai.request.max_tokens",
+    "max_completion_tokens": "gen_ai.request.max_tokens",
+    "max_new_tokens": "gen_ai.request.max_tokens",
+    "top_p": "gen_ai.request.top_p",
+    "top_k": "gen_ai.request.top_k",
+    "frequency_penalty": "gen_ai.request.frequency_penalty",
+    "presence_penalty": "gen_ai.request.presence_penalty",
+    "seed": "gen_ai.request.seed",
+    "stop": "gen_ai.request.stop_sequences",
+    "n": "gen_ai.request.choice_count",
+    "stream": "gen_ai.request.stream",
+}
 
-def flatten_dict(d, prefix=""):
-    """Flatten a python dictionary, turning nested keys into dotted keys"""
+# `gen_ai.provider.name` of the clients whose name isn't a well-known value
+PROVIDER_NAMES = {"hf_client": "huggingface"}
+
+
+def flatten_dict(d: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """
+    Flatten a python dictionary, turning nested keys into dotted keys, and values
+    that aren't valid span attributes into JSON
+    """
     flat = {}
     for k, v in d.items():
-        if v:
-            if type(v) is dict:
-                if prefix:
-                    flat.extend(flatten_dict(v, f"{prefix}.{k}"))
-            else:
-                if prefix:
-                    flat[(f"{prefix}.{k}")] = v
-                else:
-                    flat[k] = v
+        key = f"{prefix}.{k}" if prefix else str(k)
+        if v is None:
+            continue
+        if isinstance(v, dict):
+            flat.update(flatten_dict(v, key))
+        elif isinstance(v, (str, bool, int, float)):
+            flat[key] = v
+        else:
+            flat[key] = json.dumps(v, default=str)
+    return flat
 
 
 def get_version():
@@ -38,10 +65,51 @@ def get_version():
         return "unknown"
 
 
+def _epoch_ns(timestamp) -> int:
+    """Convert the timestamp of a record to nanoseconds since the epoch"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+    return int(timestamp.timestamp() * 1e9)
+
+
+def _as_dict(value) -> Dict[str, Any]:
+    if is_dataclass(value):
+        return asdict(value)
+    return dict(value)
+
+
 @dataclass
 class OpenTelemetryStore(Store):
     """
     OpenTelemetry Store
+
+    Every record is exported as a `chat <model>` span following the GenAI semantic
+    conventions, which starts and ends with the call to the model, and is a child of
+    the span current when the record is added.
+
+    Args:
+        tracer (`Tracer`, *optional*):
+            The tracer to create spans with, defaults to a tracer exporting spans
+            with `exporter`.
+        root_span (`Span`, *optional*):
+            The parent of every span, instead of the current span.
+        exporter (`SpanExporter`, *optional*):
+            The exporter of the default tracer, defaults to an OTLP exporter
+            configured by the usual environment variables.
+        namespace (`str`, *optional*):
+            The name of the tracer.
+        promoted_properties (`List[PromotedProperty]`, *optional*):
+            Properties set as typed span attributes, named after their
+            `otel_attribute`.
+        max_message_length (`int`, *optional*):
+            The number of characters kept of the content of every message, longer
+            contents are truncated so that large prompts don't blow up the batches
+            of the exporter. Defaults to 16384, `None` to keep whole messages.
+        max_messages_length (`int`, *optional*):
+            The size of `gen_ai.input.messages`, in characters of JSON, beyond which
+            the oldest messages are dropped, their number is set as
+            `observers.input.dropped_messages`. A last message still too long is cut
+            off. Defaults to 65536, `None` to keep every message.
     """
 
     # These are here largely to ease future refactors/conform to
@@ -51,6 +119,9 @@ class OpenTelemetryStore(Store):
     root_span: Optional[Span] = None
     exporter: Optional[SpanExporter] = None
     namespace: str = "observers.dev/observers"
+    promoted_properties: Optional[List[PromotedProperty]] = None
+    max_message_length: Optional[int] = 16_384
+    max_messages_length: Optional[int] = 65_536
 
     def __post_init__(self):
         if not self.tracer:
@@ -68,51 +139,158 @@ class OpenTelemetryStore(Store):
                 provider.add_span_processor(BatchSpanProcessor(self.exporter))
             trace.set_tracer_provider(provider)
             self.tracer = trace.get_tracer(self.namespace)
-        if not self.root_span:
-            # if we initialize a span here, then all subsequent 'add's can be
-            # added to a continuous trace
-            with self.tracer.start_as_current_span(f"{self.namespace}.init") as span:
-                span.set_attribute("connected", True)
-                self.root_span = span
 
     def add(self, record: Record):
         """Add a new record to the store"""
-        with trace.use_span(self.root_span):
-            with self.tracer.start_as_current_span(f"{self.namespace}.add") as span:
-                # Split out to be easily edited if the record api changes
-                event_fields = [
-                    "assistant_message",
-                    "completion_tokens",
-                    "total_tokens",
-                    "prompt_tokens",
-                    "finish_reason",
-                    "tool_calls",
-                    "function_call",
-                    "tags",
-                    "properties",
-                    "error",
-                    "model",
-                    "timestamp",
-                    "id",
-                ]
-                for field in event_fields:
-                    data = record.__getattribute__(field)
-                    if data:
-                        if type(data) is dict:
-                            intermediate = flatten_dict(data, field)
-                            for k, v in intermediate:
-                                span.set_attribute(k, v)
-                        else:
-                            span.set_attribute(field, data)
-                # Special case for `messages` as it is a list of dicts
-                messages = [str(message) for message in record.messages]
-                span.set_attribute("messages", messages)
+        end = _epoch_ns(record.timestamp)
+        start = end - int((record.latency_ms or 0) * 1e6)
+        context = trace.set_span_in_context(self.root_span) if self.root_span else None
+        span = self.tracer.start_span(
+            f"chat {record.model}" if record.model else "chat",
+            context=context,
+            kind=SpanKind.CLIENT,
+            attributes=self._attributes(record),
+            start_time=start,
+        )
+        if record.time_to_first_token_ms is not None:
+            span.add_event(
+                "gen_ai.first_token",
+                timestamp=start + int(record.time_to_first_token_ms * 1e6),
+            )
+        if record.error:
+            span.set_status(Status(StatusCode.ERROR, record.error))
+        span.end(end_time=end)
+
+    def _attributes(self, record: Record) -> Dict[str, Any]:
+        """Get the span attributes of a record"""
+        provider = PROVIDER_NAMES.get(record.client_name, record.client_name)
+        attributes = {
+            "gen_ai.operation.name": "chat",
+            "gen_ai.provider.name": provider,
+            # replaced by `gen_ai.provider.name` in recent conventions
+            "gen_ai.system": provider,
+            "gen_ai.request.model": record.model,
+        }
+        for argument, value in (record.arguments or {}).items():
+            name = REQUEST_ATTRIBUTES.get(argument)
+            if name == "gen_ai.request.stop_sequences" and isinstance(value, str):
+                value = [value]
+            if name and isinstance(value, (str, bool, int, float, list)):
+                attributes[name] = value
+
+        if record.error:
+            attributes["error.type"] = "_OTHER"
+        else:
+            attributes.update(
+                {
+                    "gen_ai.response.id": record.id,
+                    "gen_ai.response.model": self._response_model(record),
+                    "gen_ai.response.finish_reasons": (
+                        [record.finish_reason] if record.finish_reason else None
+                    ),
+                    "gen_ai.usage.input_tokens": record.prompt_tokens,
+                    "gen_ai.usage.output_tokens": record.completion_tokens,
+                    "gen_ai.output.messages": json.dumps(
+                        [self._output_message(record)], default=str
+                    ),
+                }
+            )
+        if record.time_to_first_token_ms is not None:
+            attributes["gen_ai.response.time_to_first_chunk"] = (
+                record.time_to_first_token_ms / 1000
+            )
+        if record.messages:
+            messages, dropped = self._input_messages(record.messages)
+            attributes["gen_ai.input.messages"] = messages
+            if dropped:
+                attributes["observers.input.dropped_messages"] = dropped
+        if record.tags:
+            attributes["tags"] = list(record.tags)
+        attributes.update(flatten_dict(record.properties or {}, "properties"))
+        for prop in self.promoted_properties or []:
+            attributes[prop.otel_attribute] = prop.value(record.properties)
+        return {k: v for k, v in attributes.items() if v is not None}
+
+    @staticmethod
+    def _response_model(record: Record) -> Optional[str]:
+        """Get the model that answered, streamed responses are keyed by chunk"""
+        raw_response = record.raw_response
+        if not isinstance(raw_response, dict):
+            return None
+        if "model" not in raw_response and raw_response:
+            raw_response = next(iter(raw_response.values()))
+        return raw_response.get("model") if isinstance(raw_response, dict) else None
+
+    def _truncate(self, content: str, length: Optional[int] = None) -> str:
+        length = self.max_message_length if length is None else length
+        if length is None or len(content) <= length:
+            return content
+        return f"{content[:length]}...[truncated {len(content) - length} chars]"
+
+    def _input_messages(self, messages: List[Any]) -> Tuple[str, int]:
+        """
+        Serialize the input messages within `max_messages_length`, returning the
+        JSON and the number of oldest messages dropped
+        """
+        encoded = [
+            json.dumps(self._input_message(message), default=str)
+            for message in messages
+        ]
+        start = 0
+        if self.max_messages_length is not None:
+            # the size of the JSON list, with its brackets and ", " separators
+            size = sum(len(message) for message in encoded) + 2 * len(encoded)
+            while start < len(encoded) - 1 and size > self.max_messages_length:
+                size -= len(encoded[start]) + 2
+                start += 1
+        value = "[" + ", ".join(encoded[start:]) + "]"
+        if self.max_messages_length is not None:
+            value = self._truncate(value, self.max_messages_length)
+        return value, start
+
+    def _parts(self, content) -> List[Dict[str, Any]]:
+        if content is None:
+            return []
+        if not isinstance(content, str):
+            content = json.dumps(content, default=str)
+        return [{"type": "text", "content": self._truncate(content)}]
+
+    def _tool_call_parts(self, tool_calls) -> List[Dict[str, Any]]:
+        parts = []
+        for tool_call in tool_calls or []:
+            tool_call = _as_dict(tool_call)
+            function = tool_call.get("function") or {}
+            parts.append(
+                {
+                    "type": "tool_call",
+                    "id": tool_call.get("id"),
+                    "name": function.get("name"),
+                    "arguments": self._truncate(function.get("arguments") or ""),
+                }
+            )
+        return parts
+
+    def _input_message(self, message) -> Dict[str, Any]:
+        message = _as_dict(message)
+        parts = self._parts(message.get("content"))
+        parts += self._tool_call_parts(message.get("tool_calls"))
+        return {"role": message.get("role"), "parts": parts}
+
+    def _output_message(self, record: Record) -> Dict[str, Any]:
+        parts = self._parts(record.assistant_message)
+        parts += self._tool_call_parts(record.tool_calls)
+        return {
+            "role": "assistant",
+            "parts": parts,
+            "finish_reason": record.finish_reason,
+        }
 
     @classmethod
     def connect(cls, tracer=None, root_span=None, namespace=None, exporter=None):
         """Create an ObservabilityStore, optionally starting from a prior tracer or trace,
         assigning a custom namespace, or setting an alternate exporter"""
-        return cls(tracer, root_span, namespace, exporter)
+        kwargs = {"namespace": namespace} if namespace else {}
+        return cls(tracer=tracer, root_span=root_span, exporter=exporter, **kwargs)
 
     def _init_table(self, record: "Record"):
         """Initialize the dataset (no op)"""
@@ -0,0 +1,474 @@
+import datetime
+import json
+import re
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from observers.base import BOOLEANS
+
+if TYPE_CHECKING:
+    import duckdb
+    import pyarrow as pa
+
+    from observers.base import PromotedProperty
+
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+INTERVAL = re.compile(
+    r"^(\d+\s+)?(second|minute|hour|day|week|month|year)s?$", re.IGNORECASE
+)
+ORDER_BY = re.compile(r"^([A-Za-z_][A-Za-z0-9_.]*)(\s+(ASC|DESC))?$", re.IGNORECASE)
+QUANTILE_METRIC = re.compile(r"^(\w+)_p(\d{1,2})$")
+
+# Aggregations that can be requested by name through `stats`
+METRICS = {
+    "count": "count(*)",
+    "error_count": "count(error)",
+    "error_rate": "avg(CASE WHEN error IS NULL THEN 0.0 ELSE 1.0 END)",
+    "prompt_tokens": "sum(prompt_tokens)::BIGINT",
+    "completion_tokens": "sum(completion_tokens)::BIGINT",
+    "total_tokens": "sum(total_tokens)::BIGINT",
+    "latency_avg": "avg(latency_ms)",
+    "latency_max": "max(latency_ms)",
+}
+
+# Columns that can be used with `<name>_p<quantile>` metrics, e.g. `latency_p95`
+QUANTILE_COLUMNS = {
+    "latency": "latency_ms",
+    "prompt_tokens": "prompt_tokens",
+    "completion_tokens": "completion_tokens",
+    "total_tokens": "total_tokens",
+}
+
+DEFAULT_METRICS = [
+    "count",
+    "error_rate",
+    "total_tokens",
+    "latency_p50",
+    "latency_p95",
+]
+
+
+def quote_identifier(name: str) -> str:
+    """Validate and quote a SQL identifier"""
+    if not IDENTIFIER.match(name):
+        raise ValueError(f"Invalid identifier: {name!r}")
+    return f'"{name}"'
+
+
+def escape_identifier(name: str) -> str:
+    """Quote a SQL identifier that doesn't come from users, e.g. a database name"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def property_expression(key: str, promoted: Optional[Dict[str, str]] = None) -> str:
+    """
+    Return the SQL expression for a property, either its promoted column, see
+    `PromotedProperty`, or its value extracted from the properties JSON
+    """
+    if not IDENTIFIER.match(key):
+        raise ValueError(f"Invalid property name: {key!r}")
+    if promoted and key in promoted:
+        return quote_identifier(promoted[key])
+    return f"json_extract_string(properties, '$.{key}')"
+
+
+def promoted_value_expression(prop: "PromotedProperty") -> str:
+    """
+    Return the SQL expression converting a property of the properties JSON to the
+    type of its promoted column, like `PromotedProperty.value`
+    """
+    value = property_expression(prop.name)
+    if prop.type != "bool":
+        return f"TRY_CAST({value} AS {prop.duckdb_type})"
+    # strings are parsed, numbers are only booleans if they are 0 or 1
+    strings = " ".join(
+        f"WHEN '{string}' THEN {str(boolean).lower()}"
+        for string, boolean in BOOLEANS.items()
+    )
+    json_type = f"json_type(properties, '$.{prop.name}')"
+    return (
+        f"CASE WHEN {json_type} = 'VARCHAR' THEN "
+        f"CASE lower(trim({value}, ' \t\n\r')) {strings} END "
+        f"WHEN {json_type} = 'BOOLEAN' THEN {value} = 'true' "
+        f"WHEN {json_type} IN ('BIGINT', 'UBIGINT', 'DOUBLE') THEN "
+        f"CASE TRY_CAST({value} AS DOUBLE) WHEN 1 THEN true WHEN 0 THEN false END "
+        "END"
+    )
+
+
+def as_timestamp(value: Union[str, datetime.datetime, datetime.timedelta]):
+    """Convert a time filter to a value DuckDB can compare with `timestamp`"""
+    if isinstance(value, datetime.timedelta):
+        return datetime.datetime.now() - value
+    return value
+
+
+def as_list(value: Union[str, Sequence[str]]) -> List[str]:
+    return [value] if isinstance(value, str) else list(value)
+
+
+@dataclass
+class Filters:
+    """
+    Filters pushed down into the WHERE clause of store queries.
+
+    Args:
+        provider (`Union[str, List[str]]`, *optional*):
+            Only include records from this provider or these providers, e.g. `openai`.
+        model (`Union[str, List[str]]`, *optional*):
+            Only include records for this model or these models.
+        tags (`List[str]`, *optional*):
+            Only include records that carry all of these tags.
+        since (`Union[str, datetime, timedelta]`, *optional*):
+            Only include records at or after this time. A `timedelta` is relative to now.
+        until (`Union[str, datetime, timedelta]`, *optional*):
+            Only include records before this time. A `timedelta` is relative to now.
+        properties (`Dict[str, Any]`, *optional*):
+            Only include records whose properties equal these values.
+        finish_reason (`Union[str, List[str]]`, *optional*):
+            Only include records with this finish reason or these finish reasons.
+        error (`bool`, *optional*):
+            Only include failed records (`True`) or successful records (`False`).
+    """
+
+    provider: Optional[Union[str, List[str]]] = None
+    model: Optional[Union[str, List[str]]] = None
+    tags: Optional[List[str]] = None
+    since: Optional[Union[str, datetime.datetime, datetime.timedelta]] = None
+    until: Optional[Union[str, datetime.datetime, datetime.timedelta]] = None
+    properties: Optional[Dict[str, Any]] = None
+    finish_reason: Optional[Union[str, List[str]]] = None
+    error: Optional[bool] = None
+
+    def to_sql(
+        self, promoted: Optional[Dict[str, str]] = None
+    ) -> Tuple[str, List[Any]]:
+        """
+        Return the WHERE clause (without the keyword) and its parameters, `promoted`
+        maps promoted properties to their columns
+        """
+        clauses, params = [], []
+        if self.provider is not None:
+            providers = as_list(self.provider)
+            clauses.append(f"provider IN ({', '.join('?' for _ in providers)})")
+            params.extend(providers)
+        if self.model is not None:
+            models = as_list(self.model)
+            clauses.append(f"model IN ({', '.join('?' for _ in models)})")
+            params.extend(models)
+        if self.finish_reason is not None:
+            reasons = as_list(self.finish_reason)
+            clauses.append(f"finish_reason IN ({', '.join('?' for _ in reasons)})")
+            params.extend(reasons)
+        if self.tags:
+            clauses.append("list_has_all(tags, ?::VARCHAR[])")
+            params.append(as_list(self.tags))
+        if self.since is not None:
+            clauses.append("timestamp >= CAST(? AS TIMESTAMP)")
+            params.append(as_timestamp(self.since))
+        if self.until is not None:
+            clauses.append("timestamp < CAST(? AS TIMESTAMP)")
+            params.append(as_timestamp(self.until))
+        for key, value in (self.properties or {}).items():
+            clauses.append(f"{property_expression(key, promoted)} = ?")
+            if promoted and key in promoted:
+                params.append(value)
+            else:
+                params.append(value if isinstance(value, str) else json.dumps(value))
+        if self.error is not None:
+            clauses.append("error IS NOT NULL" if self.error else "error IS NULL")
+        return " AND ".join(clauses) or "TRUE", params
+
+    def matches(self, row: Dict[str, Any]) -> bool:
+        """Whether a row, as stored in JSON, matches the filters"""
+        if self.provider is not None and row.get("provider") not in as_list(
+            self.provider
+        ):
+            return False
+        if self.model is not None and row.get("model") not in as_list(self.model):
+            return False
+        if self.finish_reason is not None and row.get("finish_reason") not in as_list(
+            self.finish_reason
+        ):
+            return False
+        if self.tags:
+            tags = row.get("tags") or []
+            if isinstance(tags, str):
+                tags = json.loads(tags)
+            if not set(as_list(self.tags)) <= set(tags):
+                return False
+        if self.since is not None or self.until is not None:
+            if not row.get("timestamp"):
+                return False
+            timestamp = _as_datetime(row["timestamp"])
+            if self.since is not None and timestamp < _as_datetime(self.since):
+                return False
+            if self.until is not None and timestamp >= _as_datetime(self.until):
+                return False
+        if self.properties:
+            properties = row.get("properties") or {}
+            if isinstance(properties, str):
+                properties = json.loads(properties)
+            for key, value in self.properties.items():
+                if properties.get(key) != value:
+                    return False
+        if self.error is not None and (row.get("error") is not None) != self.error:
+            return False
+        return True
+
+
+def _as_datetime(value: Union[str, datetime.datetime, datetime.timedelta]):
+    value = as_timestamp(value)
+    return datetime.datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def metric_expression(name: str) -> str:
+    """Return the SQL aggregate for a named metric"""
+    if name in METRICS:
+        return METRICS[name]
+    match = QUANTILE_METRIC.match(name)
+    if match and match.group(1) in QUANTILE_COLUMNS:
+        column = QUANTILE_COLUMNS[match.group(1)]
+        return f"quantile_cont({column}, {int(match.group(2)) / 100})"
+    raise ValueError(
+        f"Unknown metric {name!r}, expected one of {sorted(METRICS)} "
+        f"or `<{'|'.join(QUANTILE_COLUMNS)}>_p<quantile>`"
+    )
+
+
+def group_expression(
+    name: str, promoted: Optional[Dict[str, str]] = None
+) -> Tuple[str, str]:
+    """Return the SQL expression and output alias for a group by dimension"""
+    if name == "tag":
+        return "tag", "tag"
+    if name.startswith("properties."):
+        return property_expression(name.split(".", 1)[1], promoted), name
+    return quote_identifier(name), name
+
+
+def normalize_interval(interval: str) -> str:
+    """Validate an interval such as `minute` or `5 minutes` and add its count"""
+    interval = interval.strip()
+    if not INTERVAL.match(interval):
+        raise ValueError(f"Invalid interval: {interval!r}")
+    if not interval[0].isdigit():
+        interval = f"1 {interval}"
+    return interval
+
+
+def interval_expression(interval: str, column: str = "timestamp") -> str:
+    """Return the time bucket expression for an interval such as `minute` or `5 minutes`"""
+    return f"time_bucket(INTERVAL '{normalize_interval(interval)}', {column})"
+
+
+def build_query_sql(
+    relation: str,
+    filters: Filters,
+    columns: Optional[List[str]] = None,
+    order_by: Optional[str] = None,
+    limit: Optional[int] = None,
+    promoted: Optional[Dict[str, str]] = None,
+) -> Tuple[str, List[Any]]:
+    """Build a filtered projection over a relation"""
+    where, params = filters.to_sql(promoted)
+    projection = ", ".join(quote_identifier(c) for c in columns) if columns else "*"
+    sql = f"SELECT {projection} FROM {relation} WHERE {where}"
+    if order_by:
+        match = ORDER_BY.match(order_by.strip())
+        if not match:
+            raise ValueError(f"Invalid order by: {order_by!r}")
+        sql += f" ORDER BY {quote_identifier(match.group(1))}{match.group(2) or ''}"
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    return sql, params
+
+
+def build_stats_sql(
+    relation: str,
+    filters: Filters,
+    metrics: Optional[List[str]] = None,
+    group_by: Optional[List[str]] = None,
+    interval: Optional[str] = None,
+    promoted: Optional[Dict[str, str]] = None,
+) -> Tuple[str, List[Any]]:
+    """Build an aggregation over a relation, grouped by dimensions and time buckets"""
+    where, params = filters.to_sql(promoted)
+    group_by = as_list(group_by or [])
+    dimensions = [group_expression(name, promoted) for name in group_by]
+    if interval:
+        dimensions.insert(0, (interval_expression(interval), "bucket"))
+
+    source = f"(SELECT * FROM {relation} WHERE {where})"
+    if "tag" in group_by:
+        # records without tags are kept under a NULL tag
+        source = (
+            "(SELECT *, unnest(CASE WHEN len(tags) > 0 THEN tags "
+            f"ELSE [NULL]::VARCHAR[] END) AS tag FROM {source})"
+        )
+
+    select = [f'{expr} AS "{alias}"' for expr, alias in dimensions]
+    select += [f'{metric_expression(m)} AS "{m}"' for m in (metrics or DEFAULT_METRICS)]
+    sql = f"SELECT {', '.join(select)} FROM {source}"
+    if dimensions:
+        positions = ", ".join(str(i + 1) for i in range(len(dimensions)))
+        sql += f" GROUP BY {positions} ORDER BY {positions}"
+    return sql, params
+
+
+def to_arrow_reader(
+    result: "duckdb.DuckDBPyConnection", batch_size: int
+) -> "pa.RecordBatchReader":
+    """Stream a DuckDB result as Arrow record batches across DuckDB versions"""
+    if hasattr(result, "to_arrow_reader"):
+        return result.to_arrow_reader(batch_size)
+    return result.fetch_record_batch(batch_size)
+
+
+def to_arrow_table(result: "duckdb.DuckDBPyConnection") -> "pa.Table":
+    """Fetch a DuckDB result as an Arrow table across DuckDB versions"""
+    if hasattr(result, "to_arrow_table"):
+        return result.to_arrow_table()
+    return result.fetch_arrow_table()
+
+
+class Queryable(ABC):
+    """
+    Mixin exposing the query and analytics API over DuckDB relations.
+
+    Subclasses provide `_cursor`, returning a connection safe to use from the
+    calling thread, and `_relation`, returning the SQL relation for a table given
+    the columns read from it, `None` meaning all columns. They may also provide
+    `_promoted_columns`, mapping promoted properties to their columns.
+    """
+
+    @abstractmethod
+    def _cursor(self) -> "duckdb.DuckDBPyConnection":
+        """Get a connection safe to use from the calling thread"""
+        pass
+
+    @abstractmethod
+    def _relation(
+        self, table: Optional[str] = None, columns: Optional[List[str]] = None
+    ) -> str:
+        """Get the SQL relation for a table, given the columns read from it"""
+        pass
+
+    def _promoted_columns(self) -> Dict[str, str]:
+        return {}
+
+    def query(
+        self,
+        table: Optional[str] = None,
+        columns: Optional[List[str]] = None,
+        order_by: Optional[str] = None,
+        limit: Optional[int] = None,
+        **filters: Any,
+    ) -> "pa.Table":
+        """
+        Return the records matching the filters as an Arrow table.
+
+        Args:
+            table (`str`, *optional*):
+                The table to query, defaults to the view over all record tables.
+            columns (`List[str]`, *optional*):
+                The columns to return, defaults to all columns.
+            order_by (`str`, *optional*):
+                The column to order by, optionally followed by `ASC` or `DESC`.
+            limit (`int`, *optional*):
+                The maximum number of records to return.
+            **filters:
+                Filters pushed down into DuckDB, see `Filters`.
+        """
+        read = columns
+        if columns and order_by:
+            read = columns + [order_by.split()[0]]
+        sql, params = build_query_sql(
+            self._relation(table, read),
+            Filters(**filters),
+            columns,
+            order_by,
+            limit,
+            self._promoted_columns(),
+        )
+        return to_arrow_table(self._cursor().execute(sql, params))
+
+    def iter_records(
+        self,
+        columns: Optional[List[str]] = None,
+        batch_size: int = 10_000,
+        table: Optional[str] = None,
+        **filters: Any,
+    ) -> Iterator["pa.RecordBatch"]:
+        """
+        Iterate over the records matching the filters as Arrow record batches,
+        streamed from DuckDB so that memory use doesn't depend on the number of
+        records.
+
+        Args:
+            columns (`List[str]`, *optional*):
+                The columns to return, defaults to all columns.
+            batch_size (`int`, *optional*):
+                The maximum number of records per batch.
+            table (`str`, *optional*):
+                The table to read, defaults to the view over all record tables.
+            **filters:
+                Filters pushed down into DuckDB, see `Filters`.
+        """
+        sql, params = build_query_sql(
+            self._relation(table, columns),
+            Filters(**filters),
+            columns,
+            promoted=self._promoted_columns(),
+        )
+        cursor = self._cursor()
+        try:
+            yield from to_arrow_reader(cursor.execute(sql, params), batch_size)
+        finally:
+            cursor.close()
+
+    def stats(
+        self,
+        metrics: Optional[List[str]] = None,
+        group_by: Optional[Union[str, List[str]]] = None,
+        interval: Optional[str] = None,
+        table: Optional[str] = None,
+        **filters: Any,
+    ) -> "pa.Table":
+        """
+        Return aggregated statistics over the records matching the filters as an Arrow table.
+
+        Args:
+            metrics (`List[str]`, *optional*):
+                The metrics to compute, e.g. `count`, `error_rate`, `total_tokens` or
+                `latency_p95`. Defaults to `DEFAULT_METRICS`.
+            group_by (`Union[str, List[str]]`, *optional*):
+                The dimensions to group by: a column such as `model`, `tag` for
+                individual tags, or `properties.<key>` for a property.
+            interval (`str`, *optional*):
+                Bucket the records by time, e.g. `minute`, `hour` or `5 minutes`.
+            table (`str`, *optional*):
+                The table to query, defaults to the view over all record tables.
+            **filters:
+                Filters pushed down into DuckDB, see `Filters`.
+        """
+        sql, params = build_stats_sql(
+            self._relation(table, []),
+            Filters(**filters),
+            metrics,
+            group_by,
+            interval,
+            self._promoted_columns(),
+        )
+        return to_arrow_table(self._cursor().execute(sql, params))
@@ -0,0 +1,157 @@
+import os
+import threading
+import weakref
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import duckdb
+import pyarrow as pa
+
+from observers.stores.duckdb import FULL_RECORDS_VIEW, RECORDS_VIEW
+from observers.stores.query import Queryable, quote_identifier, to_arrow_table
+
+# Prefix of promoted property columns, see `PromotedProperty.column`
+PROMOTED_PREFIX = "property_"
+
+
+def promoted_columns(
+    conn: duckdb.DuckDBPyConnection, relation: str = RECORDS_VIEW
+) -> Dict[str, str]:
+    """Get the promoted properties of a relation, mapped to their columns"""
+    return {
+        column[len(PROMOTED_PREFIX) :]: column
+        for (column,) in conn.execute(
+            f"SELECT column_name FROM (DESCRIBE {relation})"
+        ).fetchall()
+        if column.startswith(PROMOTED_PREFIX)
+    }
+
+
+@dataclass
+class DuckDBReader(Queryable):
+    """
+    Read-only access to a database published by a running `DuckDBStore`, see
+    `DuckDBStore(publish_path=...)`, or to a database no process writes to.
+
+    Each query runs against the latest published copy: the reader reopens the file
+    when it has been replaced, so it never holds a lock on the writer's database.
+    The connection to a previous copy is closed once its last query is done.
+
+    Args:
+        path (`str`):
+            The path to the published database.
+    """
+
+    path: str
+    _conn: Optional[duckdb.DuckDBPyConnection] = field(default=None, init=False)
+    _version: Optional[Tuple[int, int]] = field(default=None, init=False)
+    _tables: List[str] = field(default_factory=list, init=False)
+    _promoted: Dict[str, str] = field(default_factory=dict, init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+    _cursors: weakref.WeakSet = field(default_factory=weakref.WeakSet, init=False)
+    _retired: List[Tuple[duckdb.DuckDBPyConnection, weakref.WeakSet]] = field(
+        default_factory=list, init=False
+    )
+
+    @classmethod
+    def connect(cls, path: str) -> "DuckDBReader":
+        """Create a new reader of a published database"""
+        return cls(path=path)
+
+    def _refresh(self) -> duckdb.DuckDBPyConnection:
+        """Reopen the database if it has been replaced since it was opened"""
+        with self._lock:
+            return self._reopen()
+
+    def _reopen(self) -> duckdb.DuckDBPyConnection:
+        """See `_refresh`, must be called with the lock held"""
+        stat = os.stat(self.path)
+        version = (stat.st_ino, stat.st_mtime_ns)
+        self._close_retired()
+        if self._conn is None or version != self._version:
+            # connections to the same path share one database, so the file is
+            # attached to a new one, cursors of the previous one keep reading the
+            # previous copy until they are done
+            conn = duckdb.connect(":memory:")
+            conn.execute(
+                f"ATTACH '{self.path.replace(chr(39), chr(39) * 2)}' "
+                "AS published (READ_ONLY)"
+            )
+            conn.execute("USE published")
+            self._tables = [t for (t,) in conn.execute("SHOW TABLES").fetchall()]
+            self._promoted = {}
+            if RECORDS_VIEW in self._tables:
+                self._promoted = promoted_columns(conn)
+            if self._conn is not None:
+                self._retired.append((self._conn, self._cursors))
+                self._cursors = weakref.WeakSet()
+                self._close_retired()
+            self._conn, self._version = conn, version
+        return self._conn
+
+    def _close_retired(self) -> None:
+        """
+        Close the connections to previous copies without cursors left, closing a
+        connection closes its cursors. Must be called with the lock held.
+        """
+        retired = []
+        for conn, cursors in self._retired:
+            if len(cursors):
+                retired.append((conn, cursors))
+            else:
+                conn.close()
+        self._retired = retired
+
+    def _cursor(self) -> duckdb.DuckDBPyConnection:
+        with self._lock:
+            cursor = self._reopen().cursor()
+            # the connection isn't closed while the cursor is in use
+            self._cursors.add(cursor)
+        cursor.execute("USE published")
+        return cursor
+
+    def _relation(
+        self, table: Optional[str] = None, columns: Optional[List[str]] = None
+    ) -> str:
+        self._refresh()
+        full = FULL_RECORDS_VIEW in self._tables and (
+            columns is None or any(c not in self._hot_columns() for c in columns)
+        )
+        if table is None:
+            if RECORDS_VIEW not in self._tables:
+                raise ValueError("No records have been published yet")
+            return FULL_RECORDS_VIEW if full else RECORDS_VIEW
+        if full and f"{table}_full" in self._tables:
+            return quote_identifier(f"{table}_full")
+        return quote_identifier(table)
+
+    def _hot_columns(self) -> List[str]:
+        return [
+            column
+            for (column,) in self._conn.execute(
+                f"SELECT column_name FROM (DESCRIBE {RECORDS_VIEW})"
+            ).fetchall()
+        ]
+
+    def _promoted_columns(self) -> Dict[str, str]:
+        self._refresh()
+        return dict(self._promoted)
+
+    def sql(self, query: str, params: Optional[List[Any]] = None) -> "pa.Table":
+        """Run a read-only SQL query and return the result as an Arrow table"""
+        return to_arrow_table(self._cursor().execute(query, params or []))
+
+    def tables(self) -> List[str]:
+        """Get the tables and views of the published database"""
+        self._refresh()
+        return list(self._tables)
+
+    def close(self) -> None:
+        """Close the reader"""
+        with self._lock:
+            for conn, _ in self._retired:
+                conn.close()
+            if self._conn:
+                self._conn.close()
+            self._conn = self._version = None
+            self._retired = []
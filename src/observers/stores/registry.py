@@ -0,0 +1,109 @@
+import atexit
+import dataclasses
+import threading
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+if TYPE_CHECKING:
+    from observers.stores.base import Store
+
+S = TypeVar("S", bound="Store")
+
+# Stores shared by `connect`, by identity, with the number of open references and
+# the options they were opened with
+_lock = threading.Lock()
+_stores: Dict[Hashable, List] = {}
+_keys: Dict[int, Hashable] = {}
+
+
+def with_defaults(cls: type, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Complete the constructor arguments of a dataclass with its defaults"""
+    defaults = {
+        f.name: f.default
+        for f in dataclasses.fields(cls)
+        if f.init and f.default is not dataclasses.MISSING
+    }
+    return {**defaults, **options}
+
+
+def acquire(
+    key: Hashable,
+    factory: Callable[[], S],
+    options: Optional[Dict[str, Any]] = None,
+) -> S:
+    """
+    Return the store registered under `key`, e.g. the path of a database, creating
+    it with `factory` on first use. Every call takes a reference on the store that
+    is given back by closing it, see `release`.
+
+    Raises a `ValueError` if the store is already open with other `options` than
+    the ones given, which would otherwise be ignored.
+    """
+    with _lock:
+        entry = _stores.get(key)
+        if entry is None:
+            store = factory()
+            entry = _stores[key] = [store, 0, options]
+            _keys[id(store)] = key
+        elif options is not None and entry[2] is not None and options != entry[2]:
+            conflicts = sorted(
+                name
+                for name in set(options) | set(entry[2])
+                if options.get(name) != entry[2].get(name)
+            )
+            raise ValueError(
+                f"The store {key} is already open with different options: "
+                f"{', '.join(conflicts)}. Close it first or connect with the same "
+                "options."
+            )
+        entry[1] += 1
+        return entry[0]
+
+
+def release(store: "Store") -> bool:
+    """
+    Give back a reference on a store, returning whether it should really be
+    closed: it isn't shared, or this was its last reference
+    """
+    with _lock:
+        key = _keys.get(id(store))
+        if key is None:
+            return True
+        entry = _stores[key]
+        entry[1] -= 1
+        if entry[1] > 0:
+            return False
+        del _stores[key]
+        del _keys[id(store)]
+        return True
+
+
+def shared_stores() -> List[Tuple[Hashable, "Store", int]]:
+    """Return the shared stores with their identity and number of references"""
+    with _lock:
+        return [(key, store, refs) for key, (store, refs, _) in _stores.items()]
+
+
+def close_all() -> None:
+    """Close every shared store, whatever its number of references"""
+    with _lock:
+        stores = [store for store, _, _ in _stores.values()]
+        _stores.clear()
+        _keys.clear()
+    for store in stores:
+        close = getattr(store, "close", None)
+        if close:
+            close()
+
+
+# flush the writers of shared stores when the interpreter exits
+atexit.register(close_all)
@@ -0,0 +1,93 @@
+import datetime
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+# Columns dropped from records once they are older than `full_days`
+SLIM_COLUMNS = ["messages", "raw_response"]
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    Retention policy for records.
+
+    Records are kept in full for `full_days`, then only a slim projection without
+    `slim_columns` is kept until `slim_days`, after which they are deleted. `None`
+    keeps records forever.
+
+    Args:
+        full_days (`float`, *optional*):
+            The number of days to keep full records.
+        slim_days (`float`, *optional*):
+            The number of days after which records are deleted.
+        slim_columns (`List[str]`, *optional*):
+            The columns dropped from slim records, defaults to `SLIM_COLUMNS`.
+        tables (`Dict[str, RetentionPolicy]`, *optional*):
+            Policies replacing this one for specific tables.
+        tags (`Dict[str, RetentionPolicy]`, *optional*):
+            Policies for records carrying a tag. When a record carries several of
+            these tags, the longest retention wins.
+    """
+
+    full_days: Optional[float] = None
+    slim_days: Optional[float] = None
+    slim_columns: List[str] = field(default_factory=lambda: list(SLIM_COLUMNS))
+    tables: Dict[str, "RetentionPolicy"] = field(default_factory=dict)
+    tags: Dict[str, "RetentionPolicy"] = field(default_factory=dict)
+
+    def for_table(self, table: str) -> "RetentionPolicy":
+        """Return the policy that applies to a table"""
+        policy = self.tables.get(table)
+        if policy is None:
+            return self
+        if not policy.tags and self.tags:
+            return RetentionPolicy(
+                full_days=policy.full_days,
+                slim_days=policy.slim_days,
+                slim_columns=policy.slim_columns,
+                tags=self.tags,
+            )
+        return policy
+
+    def condition(
+        self, attribute: str, now: Optional[datetime.datetime] = None
+    ) -> Optional[Tuple[str, List[Any]]]:
+        """
+        Return the SQL condition matching records past the `full_days` or `slim_days`
+        retention given by `attribute`, or `None` if no record can match.
+        """
+        now = now or datetime.datetime.now()
+
+        def cutoff(policy: "RetentionPolicy") -> Optional[datetime.datetime]:
+            days = getattr(policy, attribute)
+            return None if days is None else now - datetime.timedelta(days=days)
+
+        clauses, params = [], []
+        base_cutoff = cutoff(self)
+        has_override = "coalesce(list_has_any(tags, ?::VARCHAR[]), false)"
+        if base_cutoff is not None:
+            if self.tags:
+                clauses.append(f"(NOT {has_override} AND timestamp < ?)")
+                params.extend([list(self.tags), base_cutoff])
+            else:
+                clauses.append("timestamp < ?")
+                params.append(base_cutoff)
+
+        cutoffs = {tag: cutoff(policy) for tag, policy in self.tags.items()}
+        forever = [tag for tag, value in cutoffs.items() if value is None]
+        if len(forever) < len(cutoffs):
+            # a record is past its retention once it is past that of every tag it carries
+            override = [has_override]
+            params.append(list(self.tags))
+            if forever:
+                override.append("NOT coalesce(list_has_any(tags, ?::VARCHAR[]), false)")
+                params.append(forever)
+            for tag, value in cutoffs.items():
+                if value is not None:
+                    override.append("(NOT list_contains(tags, ?) OR timestamp < ?)")
+                    params.extend([tag, value])
+            clauses.append(f"({' AND '.join(override)})")
+
+        if not clauses:
+            return None
+        return f"({' OR '.join(clauses)})", params
@@ -0,0 +1,253 @@
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
+
+from observers.stores.query import (
+    QUANTILE_METRIC,
+    Filters,
+    as_list,
+    as_timestamp,
+    interval_expression,
+    normalize_interval,
+    quote_identifier,
+)
+
+if TYPE_CHECKING:
+    import duckdb
+
+# Rollup tables by time unit
+ROLLUP_TABLES = {"minute": "rollup_minute", "hour": "rollup_hour"}
+
+# Latency is sketched as a histogram with log-spaced bins: bin `i` holds latencies
+# in (2^((i-1)/4), 2^(i/4)] milliseconds, so estimates are within ~19% of the
+# true value and two sketches merge by adding them element-wise.
+LATENCY_BINS = 96
+LATENCY_BIN_EXPRESSION = (
+    f"least({LATENCY_BINS - 1}, greatest(0, "
+    "ceil(4 * log2(greatest(latency_ms, 1)))))::INTEGER"
+)
+
+# Metrics that can be computed from rollups
+# with the same types as `METRICS`, sums of BIGINT columns being HUGEINT
+ROLLUP_METRICS = {
+    "count": "sum(count)::BIGINT",
+    "error_count": "sum(error_count)::BIGINT",
+    "error_rate": "(sum(error_count) / sum(count))::DOUBLE",
+    "prompt_tokens": "sum(prompt_tokens)::BIGINT",
+    "completion_tokens": "sum(completion_tokens)::BIGINT",
+    "total_tokens": "sum(total_tokens)::BIGINT",
+    "latency_avg": "sum(latency_sum) / nullif(sum(latency_count), 0)",
+}
+
+ROLLUP_GROUP_BY = ["model", "provider"]
+
+
+def rollup_schema(table: str) -> str:
+    """Return the DDL for a rollup table"""
+    return f"""
+    CREATE TABLE IF NOT EXISTS {table} (
+        provider VARCHAR NOT NULL,
+        model VARCHAR NOT NULL,
+        bucket TIMESTAMP NOT NULL,
+        count BIGINT,
+        error_count BIGINT,
+        prompt_tokens BIGINT,
+        completion_tokens BIGINT,
+        total_tokens BIGINT,
+        latency_count BIGINT,
+        latency_sum DOUBLE,
+        latency_hist BIGINT[],
+        PRIMARY KEY (provider, model, bucket)
+    )
+    """
+
+
+def rollup_upsert(
+    rollup_table: str, unit: str, source: str, provider: Optional[str] = None
+) -> str:
+    """
+    Return the statement merging the records of `source` into a rollup table.
+
+    If `provider` is set, the statement takes it as its only parameter, otherwise
+    the provider is read from the `provider` column of `source`.
+    """
+    provider = "?::VARCHAR" if provider else "CAST(provider AS VARCHAR)"
+    merge_hist = (
+        f"list_transform(range(1, {LATENCY_BINS + 1}), "
+        "i -> latency_hist[i] + EXCLUDED.latency_hist[i])"
+    )
+    return f"""
+    INSERT INTO {rollup_table}
+    SELECT
+        provider, model, bucket, count, error_count,
+        prompt_tokens, completion_tokens, total_tokens, latency_count, latency_sum,
+        list_transform(range({LATENCY_BINS}), i -> len(list_filter(bins, b -> b = i)))
+    FROM (
+        SELECT
+            coalesce(provider, '') AS provider,
+            coalesce(model, '') AS model,
+            date_trunc('{unit}', timestamp) AS bucket,
+            count(*) AS count,
+            count(error) AS error_count,
+            sum(prompt_tokens) AS prompt_tokens,
+            sum(completion_tokens) AS completion_tokens,
+            sum(total_tokens) AS total_tokens,
+            count(latency_ms) AS latency_count,
+            sum(latency_ms) AS latency_sum,
+            coalesce(list({LATENCY_BIN_EXPRESSION}) FILTER (WHERE latency_ms IS NOT NULL), []) AS bins
+        FROM (
+            SELECT
+                {provider} AS provider,
+                CAST(model AS VARCHAR) AS model,
+                CAST(timestamp AS TIMESTAMP) AS timestamp,
+                CAST(error AS VARCHAR) AS error,
+                CAST(prompt_tokens AS BIGINT) AS prompt_tokens,
+                CAST(completion_tokens AS BIGINT) AS completion_tokens,
+                CAST(total_tokens AS BIGINT) AS total_tokens,
+                CAST(latency_ms AS DOUBLE) AS latency_ms
+            FROM {source}
+        )
+        WHERE timestamp IS NOT NULL
+        GROUP BY ALL
+    )
+    ON CONFLICT DO UPDATE SET
+        count = count + EXCLUDED.count,
+        error_count = error_count + EXCLUDED.error_count,
+        prompt_tokens = {merge_sum("prompt_tokens")},
+        completion_tokens = {merge_sum("completion_tokens")},
+        total_tokens = {merge_sum("total_tokens")},
+        latency_count = latency_count + EXCLUDED.latency_count,
+        latency_sum = {merge_sum("latency_sum")},
+        latency_hist = {merge_hist}
+    """
+
+
+def merge_sum(column: str) -> str:
+    """
+    Return the expression adding up two sums of a rollup which are `NULL` without
+    any value, like `sum` over the raw records
+    """
+    return f"coalesce({column} + EXCLUDED.{column}, {column}, EXCLUDED.{column})"
+
+
+def init_rollups(conn: "duckdb.DuckDBPyConnection") -> None:
+    """Create the rollup tables if they don't exist"""
+    for table in ROLLUP_TABLES.values():
+        conn.execute(rollup_schema(table))
+
+
+def update_rollups(
+    conn: "duckdb.DuckDBPyConnection", source: str, provider: Optional[str] = None
+) -> None:
+    """
+    Merge the records of `source` into every rollup table, `provider` is the
+    provider of all the records, or `None` to read it from their `provider` column
+    """
+    for unit, rollup_table in ROLLUP_TABLES.items():
+        conn.execute(
+            rollup_upsert(rollup_table, unit, source, provider),
+            [provider] if provider else [],
+        )
+
+
+def backfill_rollups(
+    conn: "duckdb.DuckDBPyConnection", tables: Dict[str, Optional[str]]
+) -> None:
+    """
+    Rebuild the rollup tables from the records already stored in `tables`, a
+    mapping of record tables to their provider as in `update_rollups`
+    """
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        for rollup_table in ROLLUP_TABLES.values():
+            conn.execute(f"DROP TABLE IF EXISTS {rollup_table}")
+        init_rollups(conn)
+        for table, provider in tables.items():
+            update_rollups(conn, quote_identifier(table), provider)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _hist_quantile(q: float) -> str:
+    """Return the expression estimating a latency quantile from a merged histogram"""
+    position = (
+        f"list_position(list_transform(range(1, {LATENCY_BINS + 1}), "
+        f"i -> list_sum(latency_hist[1:i]) >= {q} * list_sum(latency_hist)), true)"
+    )
+    return f"CASE WHEN list_sum(latency_hist) > 0 THEN pow(2, ({position} - 1) / 4) END"
+
+
+def build_rollup_sql(
+    interval: str,
+    metrics: List[str],
+    group_by: Optional[Union[str, List[str]]] = None,
+    filters: Optional[Filters] = None,
+) -> Tuple[str, List[Any]]:
+    """Build an aggregation over the rollup tables"""
+    interval = normalize_interval(interval)
+    if interval.rstrip("s").endswith("second"):
+        raise ValueError("Rollups have a resolution of one minute")
+    unit = "minute" if interval.rstrip("s").endswith("minute") else "hour"
+
+    filters = filters or Filters()
+    unsupported = [
+        name
+        for name in ("tags", "properties", "finish_reason", "error")
+        if getattr(filters, name) is not None
+    ]
+    if unsupported:
+        raise ValueError(f"Rollups can't be filtered by {', '.join(unsupported)}")
+
+    group_by = as_list(group_by or [])
+    for name in group_by:
+        if name not in ROLLUP_GROUP_BY:
+            raise ValueError(f"Rollups can only be grouped by {ROLLUP_GROUP_BY}")
+
+    clauses, params = [], []
+    if filters.provider is not None:
+        providers = as_list(filters.provider)
+        clauses.append(f"provider IN ({', '.join('?' for _ in providers)})")
+        params.extend(providers)
+    if filters.model is not None:
+        models = as_list(filters.model)
+        clauses.append(f"model IN ({', '.join('?' for _ in models)})")
+        params.extend(models)
+    # time filters are applied at the resolution of the rollup
+    if filters.since is not None:
+        clauses.append(f"bucket >= date_trunc('{unit}', CAST(? AS TIMESTAMP))")
+        params.append(as_timestamp(filters.since))
+    if filters.until is not None:
+        clauses.append("bucket < CAST(? AS TIMESTAMP)")
+        params.append(as_timestamp(filters.until))
+    where = " AND ".join(clauses) or "TRUE"
+
+    dimensions = [f"{interval_expression(interval, 'bucket')} AS bucket"]
+    dimensions += [
+        "nullif(model, '') AS model" if name == "model" else quote_identifier(name)
+        for name in group_by
+    ]
+    aggregates, outputs = [], []
+    for metric in metrics:
+        match = QUANTILE_METRIC.match(metric)
+        if metric in ROLLUP_METRICS:
+            aggregates.append(f'{ROLLUP_METRICS[metric]} AS "{metric}"')
+            outputs.append(f'"{metric}"')
+        elif match and match.group(1) == "latency":
+            outputs.append(f'{_hist_quantile(int(match.group(2)) / 100)} AS "{metric}"')
+        else:
+            raise ValueError(f"Metric {metric!r} is not available from rollups")
+    merged_hist = (
+        "list_reduce(list(latency_hist), (a, b) -> "
+        f"list_transform(range(1, {LATENCY_BINS + 1}), i -> a[i] + b[i])) AS latency_hist"
+    )
+    positions = ", ".join(str(i + 1) for i in range(len(dimensions)))
+    names = ["bucket"] + group_by
+    inner = (
+        f"SELECT {', '.join(dimensions + aggregates + [merged_hist])} "
+        f"FROM {ROLLUP_TABLES[unit]} WHERE {where} GROUP BY {positions}"
+    )
+    select = ", ".join([quote_identifier(n) for n in names] + outputs)
+    return (
+        f"SELECT {select} FROM ({inner}) ORDER BY {positions}",
+        params,
+    )
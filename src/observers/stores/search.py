@@ -0,0 +1,90 @@
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from observers.stores.extensions import load_extension
+from observers.stores.query import Filters, quote_identifier
+
+if TYPE_CHECKING:
+    import duckdb
+
+# Table holding the searchable text of every record, indexed with the fts extension
+SEARCH_TABLE = "records_search"
+SEARCH_SCHEMA = f"fts_main_{SEARCH_TABLE}"
+
+# The text of a record: the contents of its messages and the assistant message
+SEARCH_TEXT_EXPRESSION = (
+    "concat_ws(' ', array_to_string(json_extract_string("
+    "CAST(messages AS JSON), '$[*].content'), ' '), assistant_message)"
+)
+
+
+def load_fts(
+    conn: "duckdb.DuckDBPyConnection", extension_path: Optional[str] = None
+) -> None:
+    """Load the fts extension, see `load_extension`"""
+    load_extension(conn, "fts", extension_path, "fts_extension_path")
+
+
+def init_search(conn: "duckdb.DuckDBPyConnection") -> None:
+    """Create the search table if it doesn't exist"""
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} (id VARCHAR, text VARCHAR)"
+    )
+
+
+def update_search(
+    conn: "duckdb.DuckDBPyConnection",
+    source: str,
+    params: Optional[List[Any]] = None,
+) -> None:
+    """Add the text of the records of `source`, with `params`, to the search table"""
+    conn.execute(
+        f"INSERT INTO {SEARCH_TABLE} "
+        f"SELECT id, {SEARCH_TEXT_EXPRESSION} FROM {source} "
+        f"WHERE {SEARCH_TEXT_EXPRESSION} <> ''",
+        params or [],
+    )
+
+
+def search_index_is_stale(conn: "duckdb.DuckDBPyConnection") -> bool:
+    """Whether the search index is missing or out of date with the search table"""
+    try:
+        indexed, stored = conn.execute(
+            f"SELECT (SELECT count(*) FROM {SEARCH_SCHEMA}.docs), "
+            f"(SELECT count(*) FROM {SEARCH_TABLE})"
+        ).fetchone()
+    except Exception:
+        return True
+    return indexed != stored
+
+
+def rebuild_search_index(conn: "duckdb.DuckDBPyConnection") -> None:
+    """
+    Rebuild the BM25 index over the search table. The fts extension can't update
+    an index in place, but the search table is narrow, so this is cheap compared
+    to scanning the records.
+    """
+    conn.execute(
+        f"PRAGMA create_fts_index('{SEARCH_TABLE}', 'id', 'text', overwrite=1)"
+    )
+
+
+def build_search_sql(
+    relation: str,
+    text: str,
+    filters: Filters,
+    columns: Optional[List[str]] = None,
+    limit: int = 10,
+    promoted: Optional[Dict[str, str]] = None,
+) -> Tuple[str, List[Any]]:
+    """Build a search over a relation, returning records with their BM25 `score`"""
+    where, params = filters.to_sql(promoted)
+    projection = (
+        ", ".join(quote_identifier(c) for c in columns) if columns else "records.*"
+    )
+    sql = (
+        f"SELECT {projection}, score FROM ("
+        f"SELECT id, {SEARCH_SCHEMA}.match_bm25(id, ?) AS score FROM {SEARCH_TABLE}"
+        f") AS matches JOIN (SELECT * FROM {relation} WHERE {where}) AS records "
+        f"USING (id) WHERE score IS NOT NULL ORDER BY score DESC LIMIT {int(limit)}"
+    )
+    return sql, [text] + params
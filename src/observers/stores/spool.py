@@ -0,0 +1,207 @@
+import contextlib
+import glob
+import json
+import mmap
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from observers.stores.query import Filters, Queryable, quote_identifier, to_arrow_table
+
+
+def scan_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over the records of a JSONL file through a memory map, so that files
+    larger than memory can be read. A last line without a newline is skipped, as
+    it may still be being written.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = 0
+            while True:
+                end = data.find(b"\n", start)
+                if end == -1:
+                    return
+                if end > start:
+                    yield json.loads(data[start:end])
+                start = end + 1
+
+
+def scan_parquet(path: str) -> Iterator[Dict[str, Any]]:
+    """Iterate over the records of a Parquet file, one row group at a time"""
+    parquet_file = pq.ParquetFile(path)
+    for i in range(parquet_file.num_row_groups):
+        yield from parquet_file.read_row_group(i).to_pylist()
+
+
+def iter_batches(
+    rows: Iterable[Dict[str, Any]],
+    columns: Optional[List[str]] = None,
+    batch_size: int = 10_000,
+    filters: Optional[Filters] = None,
+) -> Iterator[pa.RecordBatch]:
+    """Group the rows matching the filters into Arrow record batches"""
+    batch = []
+    for row in rows:
+        if filters is not None and not filters.matches(row):
+            continue
+        batch.append({c: row.get(c) for c in columns} if columns else row)
+        if len(batch) >= batch_size:
+            yield pa.RecordBatch.from_pylist(batch)
+            batch = []
+    if batch:
+        yield pa.RecordBatch.from_pylist(batch)
+
+
+# The view of the records returned by `SpoolReader.before_read`
+PENDING_VIEW = "observers_pending"
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+@dataclass
+class SpoolReader(Queryable):
+    """
+    Queries over the shards of a `DatasetsStore` in place, with DuckDB reading the
+    JSONL and Parquet files of `folder_path` on every query, so the records don't
+    need to be loaded into a database first. Records are exposed through the
+    `all_records` view, with the `provider` taken from the name of their file,
+    and a `table` is the set of files of one record table, e.g. `openai_records`.
+
+    Args:
+        folder_path (`str`):
+            The folder holding the shards.
+        columns (`Dict[str, str]`):
+            The DuckDB type of each column of the records.
+        before_read (`Callable[[], Optional[Tuple[str, pa.Table]]]`, *optional*):
+            Called before every query, e.g. to flush the active shard. It can
+            return the name of a record table and records of it that aren't in
+            files yet, which are queried along with the shards.
+        lock (`threading.Lock`, *optional*):
+            The lock of the writer, held while `before_read` runs and the shards are
+            listed, so that records moving from memory to a shard are read once.
+    """
+
+    folder_path: str
+    columns: Dict[str, str]
+    before_read: Optional[Callable[[], Optional[Tuple[str, pa.Table]]]] = None
+    lock: Optional[threading.Lock] = None
+    _conn: Optional[duckdb.DuckDBPyConnection] = field(default=None, init=False)
+    # the records returned by `before_read` for the query of each thread
+    _local: threading.local = field(default_factory=threading.local, init=False)
+
+    def __post_init__(self):
+        self._conn = duckdb.connect(":memory:")
+
+    def _files(self, table: Optional[str], pattern: str) -> List[str]:
+        prefix = f"{table}_" if table else "*_records_"
+        return sorted(glob.glob(os.path.join(self.folder_path, prefix + pattern)))
+
+    def _projection(self, source_types: Dict[str, str]) -> str:
+        """Cast the columns as read from files to the types of the records"""
+        selects = []
+        for name, type in self.columns.items():
+            column = quote_identifier(name)
+            if source_types.get(name) != type:
+                column = (
+                    f"CAST(CAST({column} AS JSON) AS {type})"
+                    if type.endswith("[]")
+                    else f"CAST({column} AS {type})"
+                )
+            selects.append(f"{column} AS {quote_identifier(name)}")
+        selects.append(
+            r"regexp_extract(filename, '([^/\\]+)_records_[^/\\]*$', 1) AS provider"
+        )
+        return ", ".join(selects)
+
+    def _union(
+        self,
+        table: Optional[str] = None,
+        pending: Optional[Tuple[str, pa.Table]] = None,
+    ) -> str:
+        """The union of the records of the JSONL and Parquet shards, and `pending`"""
+        selects = []
+        jsonl = self._files(table, "*.json*")
+        if jsonl:
+            # JSON fields are stored as strings or values, read them as text
+            read_types = {
+                name: "VARCHAR" if type == "JSON" or type.endswith("[]") else type
+                for name, type in self.columns.items()
+            }
+            schema = ", ".join(
+                f"{_literal(name)}: {_literal(type)}"
+                for name, type in read_types.items()
+            )
+            files = ", ".join(_literal(path) for path in jsonl)
+            # the last line of the active shard may be partially written
+            selects.append(
+                f"SELECT {self._projection(read_types)} FROM read_json([{files}], "
+                f"format = 'newline_delimited', columns = {{{schema}}}, "
+                "ignore_errors = true, filename = true) WHERE id IS NOT NULL"
+            )
+        # Parquet shards and pending records have the Arrow schema of the writer
+        read_types = {
+            name: "VARCHAR" if type == "JSON" else type
+            for name, type in self.columns.items()
+        }
+        parquet = self._files(table, "*.parquet")
+        if parquet:
+            files = ", ".join(_literal(path) for path in parquet)
+            selects.append(
+                f"SELECT {self._projection(read_types)} FROM read_parquet([{files}], "
+                "union_by_name = true, filename = true)"
+            )
+        if pending and table in (None, pending[0]):
+            # named like a shard, for the provider to be read from its name
+            filename = _literal(f"{pending[0]}_pending")
+            selects.append(
+                f"SELECT {self._projection(read_types)} FROM "
+                f"(SELECT *, {filename} AS filename FROM {PENDING_VIEW})"
+            )
+        if not selects:
+            empty = ", ".join(
+                f"CAST(NULL AS {type}) AS {quote_identifier(name)}"
+                for name, type in {**self.columns, "provider": "VARCHAR"}.items()
+            )
+            selects.append(f"SELECT {empty} WHERE false")
+        return " UNION ALL BY NAME ".join(selects)
+
+    def _cursor(self) -> duckdb.DuckDBPyConnection:
+        cursor = self._conn.cursor()
+        pending = getattr(self._local, "pending", None)
+        if pending is not None:
+            cursor.register(PENDING_VIEW, pending)
+        return cursor
+
+    def _relation(
+        self, table: Optional[str] = None, columns: Optional[List[str]] = None
+    ) -> str:
+        with self.lock or contextlib.nullcontext():
+            pending = self.before_read() if self.before_read else None
+            self._local.pending = pending[1] if pending else None
+            return f"({self._union(table, pending)})"
+
+    def sql(self, query: str, params: Optional[List[Any]] = None) -> pa.Table:
+        """
+        Run a SQL query over the `all_records` view of the shards and return the
+        result as an Arrow table
+        """
+        relation = self._relation()
+        cursor = self._cursor()
+        cursor.execute(f"CREATE OR REPLACE TEMP VIEW all_records AS {relation}")
+        return to_arrow_table(cursor.execute(query, params or []))
+
+    def close(self) -> None:
+        """Close the reader"""
+        if self._conn:
+            self._conn.close()
+            self._conn = None
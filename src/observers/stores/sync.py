@@ -0,0 +1,116 @@
+import datetime
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    import duckdb
+
+# Progress of the sync of the records to each Hub dataset. Records are synced in
+# (timestamp, id) order: `timestamp` and `id` are the last synced record, and the
+# `pending_*` columns the last record and shard of a sync that hasn't completed.
+SYNC_STATE_TABLE = "hub_sync_state"
+
+Watermark = Tuple[datetime.datetime, str]
+
+
+@dataclass
+class SyncState:
+    """The progress of the sync of the records to a Hub dataset"""
+
+    watermark: Optional[Watermark] = None
+    pending: Optional[Watermark] = None
+    pending_shard: Optional[str] = None
+
+
+def init_sync_state(conn: "duckdb.DuckDBPyConnection") -> None:
+    """Create the sync state table if it doesn't exist"""
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {SYNC_STATE_TABLE} (
+            repo_id VARCHAR PRIMARY KEY,
+            timestamp TIMESTAMP,
+            id VARCHAR,
+            pending_timestamp TIMESTAMP,
+            pending_id VARCHAR,
+            pending_shard VARCHAR
+        )
+        """
+    )
+
+
+def read_sync_state(conn: "duckdb.DuckDBPyConnection", repo_id: str) -> SyncState:
+    """Get the progress of the sync to a dataset"""
+    row = conn.execute(
+        f"SELECT timestamp, id, pending_timestamp, pending_id, pending_shard "
+        f"FROM {SYNC_STATE_TABLE} WHERE repo_id = ?",
+        [repo_id],
+    ).fetchone()
+    if row is None:
+        return SyncState()
+    timestamp, id, pending_timestamp, pending_id, pending_shard = row
+    return SyncState(
+        watermark=(timestamp, id) if timestamp is not None else None,
+        pending=(pending_timestamp, pending_id) if pending_timestamp else None,
+        pending_shard=pending_shard,
+    )
+
+
+def write_sync_state(
+    conn: "duckdb.DuckDBPyConnection", repo_id: str, state: SyncState
+) -> None:
+    """Save the progress of the sync to a dataset"""
+    watermark = state.watermark or (None, None)
+    pending = state.pending or (None, None)
+    conn.execute(
+        f"INSERT OR REPLACE INTO {SYNC_STATE_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+        [repo_id, *watermark, *pending, state.pending_shard],
+    )
+
+
+def _after(watermark: Optional[Watermark]) -> Tuple[str, list]:
+    """The condition selecting the records after a watermark"""
+    if watermark is None:
+        return "timestamp IS NOT NULL", []
+    return (
+        "(timestamp > ? OR (timestamp = ? AND id > ?))",
+        [watermark[0], watermark[0], watermark[1]],
+    )
+
+
+def next_watermark(
+    conn: "duckdb.DuckDBPyConnection",
+    relation: str,
+    watermark: Optional[Watermark],
+    cutoff: datetime.datetime,
+) -> Optional[Watermark]:
+    """
+    Get the last record after `watermark` with a timestamp before `cutoff`, or
+    `None` if there is none. Records more recent than `cutoff` are left for a later
+    sync, as records may be written slightly out of timestamp order.
+    """
+    after, params = _after(watermark)
+    return conn.execute(
+        f"SELECT timestamp, id FROM {relation} WHERE {after} AND timestamp <= ? "
+        "ORDER BY timestamp DESC, id DESC LIMIT 1",
+        params + [cutoff],
+    ).fetchone()
+
+
+def build_sync_sql(
+    relation: str, watermark: Optional[Watermark], upper: Watermark
+) -> Tuple[str, list]:
+    """Build the query of the records after `watermark` up to `upper` included"""
+    after, params = _after(watermark)
+    return (
+        f"SELECT * FROM {relation} WHERE {after} "
+        "AND (timestamp < ? OR (timestamp = ? AND id <= ?)) ORDER BY timestamp, id",
+        params + [upper[0], upper[0], upper[1]],
+    )
+
+
+def shard_name(upper: Watermark) -> str:
+    """
+    The name of the shard of the records up to `upper`, which is the same when a
+    sync is retried, so that a shard is never uploaded twice under two names
+    """
+    return f"records-{upper[0]:%Y%m%dT%H%M%S%f}-{upper[1]}.parquet"
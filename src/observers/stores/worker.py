@@ -0,0 +1,61 @@
+import logging
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicWorker:
+    """
+    Run a function periodically in a daemon thread, or earlier when woken up.
+
+    Args:
+        fn (`Callable[[], None]`):
+            The function to run.
+        interval (`float`):
+            The number of seconds to wait between runs.
+        name (`str`, *optional*):
+            The name of the thread, used in logs.
+    """
+
+    def __init__(
+        self, fn: Callable[[], None], interval: float, name: Optional[str] = None
+    ):
+        self.fn = fn
+        self.interval = interval
+        self.name = name or getattr(fn, "__name__", "observers-worker")
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "PeriodicWorker":
+        """Start the worker thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name=self.name, daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.fn()
+            except Exception:
+                logger.exception("%s failed", self.name)
+
+    def wake(self) -> None:
+        """Run the function now instead of at the end of the interval"""
+        self._wake.set()
+
+    def stop(self) -> None:
+        """Stop the worker thread and wait for the current run to finish"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
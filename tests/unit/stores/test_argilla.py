@@ -0,0 +1,162 @@
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from observers.models.openai import OpenAIRecord
+from observers.stores.argilla import ArgillaStore
+
+
+class MockArgilla:
+    """Local stand-in for the Argilla API, recording the batches logged"""
+
+    def __init__(self, *args, **kwargs):
+        self.batches = []
+        self.failures = 0
+        settings = SimpleNamespace(
+            fields=[SimpleNamespace(name="messages")],
+            questions=[],
+            metadata=[SimpleNamespace(name="model")],
+            vectors=[],
+        )
+        self.dataset = MagicMock(settings=settings)
+        self.dataset.records.log.side_effect = self._log
+        self.me = SimpleNamespace(username="me")
+        self.workspaces = MagicMock()
+        self.datasets = MagicMock(return_value=self.dataset)
+
+    def _log(self, records, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Argilla is unavailable")
+        self.batches.append(records)
+
+
+@pytest.fixture
+def argilla():
+    with patch("observers.stores.argilla.Argilla", MockArgilla):
+        yield
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_records_are_logged_in_batches(argilla):
+    store = ArgillaStore(dataset_name="records", batch_size=2, flush_interval=60)
+    for model in ["a", "b"]:
+        store.add(OpenAIRecord(model=model))
+
+    # the worker logs a full batch without waiting for the interval
+    wait_for(lambda: len(store._client.batches) == 1)
+    assert [r["model"] for r in store._client.batches[0]] == ["a", "b"]
+
+    store.add(OpenAIRecord(model="c"))
+    time.sleep(0.05)
+    assert len(store._client.batches) == 1
+    store.close()
+    assert [r["model"] for r in store._client.batches[1]] == ["c"]
+    assert store._client.dataset.records.log.call_count == 2
+
+
+def test_failed_batches_are_retried(argilla):
+    store = ArgillaStore(
+        dataset_name="records", flush_interval=60, max_retries=2, retry_backoff=0
+    )
+    store._client.failures = 2
+    store.add(OpenAIRecord(model="a"))
+    store.flush()
+    assert len(store._client.batches) == 1
+    assert store._client.dataset.records.log.call_count == 3
+
+    # records of a batch that keeps failing are kept for the next flush
+    store._client.failures = 3
+    store.add(OpenAIRecord(model="b"))
+    with pytest.raises(ConnectionError):
+        store.flush()
+    store.close()
+    assert [r["model"] for r in store._client.batches[1]] == ["b"]
+
+
+def test_buffer_is_bounded(argilla, caplog):
+    """Test that the oldest records are dropped while Argilla can't be reached"""
+    store = ArgillaStore(
+        dataset_name="records",
+        flush_interval=60,
+        max_retries=0,
+        max_buffer_size=3,
+    )
+    store._client.failures = 1
+    with caplog.at_level("WARNING", logger="observers.stores.argilla"):
+        for model in "abcde":
+            store.add(OpenAIRecord(model=model))
+        assert len(caplog.records) == 1
+        with pytest.raises(ConnectionError):
+            store.flush()
+        store.close()
+    assert [r["model"] for r in store._client.batches[0]] == ["c", "d", "e"]
+    assert "Dropped 2 records" in caplog.records[-1].getMessage()
+
+
+def test_records_are_buffered_until_the_dataset_is_ready(argilla):
+    """Test that adding records doesn't wait for Argilla, nor fails without it"""
+    store = ArgillaStore(dataset_name="records", flush_interval=60)
+    lookup = store._client.datasets
+    store._client.datasets = MagicMock(side_effect=ConnectionError("unavailable"))
+    for model in "ab":
+        store.add(OpenAIRecord(model=model))
+    with pytest.raises(ConnectionError):
+        store.flush()
+    assert len(store._buffer) == 2
+
+    store._client.datasets = lookup
+    store.add(OpenAIRecord(model="c"))
+    store.close()
+    assert [r["model"] for r in store._client.batches[0]] == ["a", "b", "c"]
+
+
+def test_close_unregisters_exit_handler(argilla):
+    """Test that closed stores aren't kept alive by their exit handler"""
+    import gc
+    import weakref
+
+    store = ArgillaStore(dataset_name="records", flush_interval=60)
+    ref = weakref.ref(store)
+    store.close()
+    del store
+    gc.collect()
+    assert ref() is None
+
+
+@pytest.mark.asyncio
+async def test_add_async_does_not_block_the_loop(argilla):
+    import asyncio
+
+    store = ArgillaStore(dataset_name="records", flush_interval=60)
+    lookup = store._client.datasets
+
+    def slow_lookup(**kwargs):
+        time.sleep(0.2)
+        return lookup.return_value
+
+    store._client.datasets = MagicMock(side_effect=slow_lookup)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while store._dataset is None:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    records = [OpenAIRecord(model=model) for model in "abcde"]
+    await asyncio.gather(ticker(), *(store.add_async(r) for r in records))
+
+    # the loop kept running while the dataset was looked up, once
+    assert ticks > 5
+    assert store._client.datasets.call_count == 1
+    await store.close_async()
+    assert len(store._client.batches[0]) == 5
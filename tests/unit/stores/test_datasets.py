@@ -57,3 +57,264 @@ def test_custom_folder_path(mock_whoami, mock_login, tmp_path):
     assert os.path.exists(
         custom_path
     ), "Custom folder should not be deleted during cleanup"
+
+
+def test_iter_records(mock_whoami, mock_login, tmp_path):
+    """Test that records are read back from the spool files in batches"""
+    from observers.models.openai import OpenAIRecord
+
+    store = DatasetsStore(folder_path=str(tmp_path), offline=True)
+    for model in ["gpt-4o", "gpt-4o", "gpt-4o-mini"]:
+        store.add(OpenAIRecord(model=model, tags=["prod"], latency_ms=1.0))
+
+    batches = list(store.iter_records(columns=["model"], batch_size=2))
+    assert [batch.num_rows for batch in batches] == [2, 1]
+    assert list(store.iter_records(model="gpt-4o-mini"))[0].column(
+        "model"
+    ).to_pylist() == ["gpt-4o-mini"]
+    assert list(store.iter_records(provider="openai", tags=["prod"]))[0].num_rows == 3
+    assert list(store.iter_records(tags=["dev"])) == []
+
+
+def test_shard_rotation(mock_whoami, mock_login, tmp_path):
+    """Test that shards are sealed by record count and before scheduled commits"""
+    from observers.models.openai import OpenAIRecord
+
+    store = DatasetsStore(folder_path=str(tmp_path), offline=True, max_shard_records=2)
+    for _ in range(3):
+        store.add(OpenAIRecord(model="gpt-4o"))
+
+    assert "*.partial" in store.ignore_patterns
+    sealed = sorted(p.name for p in tmp_path.glob("*.jsonl"))
+    active = list(tmp_path.glob("*.jsonl.partial"))
+    assert len(sealed) == 1 and len(active) == 1
+    assert f"_{os.getpid()}_" in sealed[0]
+
+    # the scheduler seals the active shard before listing files to upload
+    store._rotate_on_commit()
+    assert len(list(tmp_path.glob("*.jsonl"))) == 2
+    assert not list(tmp_path.glob("*.jsonl.partial"))
+    assert list(store.iter_records())[0].num_rows == 3
+
+
+def test_parquet_shards(mock_whoami, mock_login, tmp_path):
+    """Test that Parquet shards are written in row groups with typed columns"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    from observers.models.openai import OpenAIRecord
+
+    store = DatasetsStore(
+        folder_path=str(tmp_path),
+        repo_name="records",
+        format="parquet",
+        row_group_size=2,
+        offline=True,
+    )
+    for _ in range(3):
+        store.add(OpenAIRecord(model="gpt-4o", tags=["prod"], properties={"a": 1}))
+    store._rotate_on_commit()
+
+    (shard,) = tmp_path.glob("*.parquet")
+    parquet_file = pq.ParquetFile(shard)
+    assert parquet_file.num_row_groups == 2
+    assert parquet_file.metadata.row_group(0).column(0).compression == "ZSTD"
+    table = parquet_file.read()
+    assert table.schema.field("tags").type == pa.list_(pa.string())
+    assert table.schema.field("timestamp").type == pa.timestamp("us")
+    assert table.column("properties").to_pylist() == ['{"a": 1}'] * 3
+    assert list(store.iter_records(tags=["prod"]))[0].num_rows == 3
+    store.close()
+
+
+def test_buffered_writer(mock_whoami, mock_login, tmp_path):
+    """Test that records go through one buffered handle flushed before commits"""
+    from observers.models.openai import OpenAIRecord
+
+    store = DatasetsStore(folder_path=str(tmp_path), offline=True, max_shard_age=3600)
+    store.add(OpenAIRecord(model="gpt-4o"))
+    handle = store._file
+    store.add(OpenAIRecord(model="gpt-4o"))
+    assert store._file is handle
+
+    (shard,) = tmp_path.glob("*.jsonl.partial")
+    assert shard.stat().st_size == 0
+    # the shard isn't due for rotation yet, but its records are flushed
+    store._rotate_on_commit()
+    assert len(shard.read_text().splitlines()) == 2
+    assert store._file is handle
+
+
+def test_images_are_content_addressed(mock_whoami, mock_login, tmp_path):
+    """Test that images are named after their bytes, kept as is and written once"""
+    from io import BytesIO
+
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new("RGB", (4, 4), "red").save(buffer, format="JPEG")
+    image_bytes = buffer.getvalue()
+
+    store = DatasetsStore(folder_path=str(tmp_path))
+    path = store._save_image(image_bytes)
+    assert store._save_image(image_bytes) == path
+    assert path.endswith(".jpg")
+    store._wait_for_images()
+    with open(path, "rb") as f:
+        assert f.read() == image_bytes
+    assert len(list((tmp_path / "images").iterdir())) == 1
+
+    converted = DatasetsStore(folder_path=str(tmp_path), image_format="png")
+    path = converted._save_image(image_bytes)
+    converted._wait_for_images()
+    assert Image.open(path).format == "PNG"
+
+
+def test_failed_images_are_reported(mock_whoami, mock_login, tmp_path, monkeypatch):
+    """Test that images that couldn't be written are reported and written again"""
+    from io import BytesIO
+
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new("RGB", (4, 4), "red").save(buffer, format="PNG")
+    image_bytes = buffer.getvalue()
+
+    store = DatasetsStore(folder_path=str(tmp_path), offline=True)
+    write_image = store._write_image
+
+    def fail(image_bytes, image_path):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, "_write_image", fail)
+    path = store._save_image(image_bytes)
+    with pytest.raises(OSError, match="Couldn't write 1 images"):
+        store._wait_for_images()
+    # failures are only reported once
+    store._wait_for_images()
+
+    monkeypatch.setattr(store, "_write_image", write_image)
+    assert store._save_image(image_bytes) == path
+    store._wait_for_images()
+    assert os.path.exists(path)
+    store.close()
+
+
+def test_hub_setup_is_lazy(mock_whoami, mock_login, tmp_path):
+    """Test that the Hub is only reached in the background, after the first record"""
+    from observers.models.openai import OpenAIRecord
+
+    with (
+        patch("observers.stores.datasets.HfApi"),
+        patch("observers.stores.datasets.ShardScheduler") as scheduler,
+        patch("observers.stores.datasets.metadata_update"),
+    ):
+        store = DatasetsStore(folder_path=str(tmp_path), repo_name="records")
+        mock_whoami.assert_not_called()
+
+        mock_whoami.return_value = {"name": "me"}
+        store.add(OpenAIRecord(model="gpt-4o"))
+        store._hub_thread.join()
+
+    kwargs = scheduler.call_args.kwargs
+    assert kwargs["repo_id"] == "me/records"
+    assert kwargs["lock"] is store._lock
+    assert store._scheduler is scheduler.return_value
+
+
+def test_offline_upload(mock_whoami, mock_login, tmp_path):
+    """Test that offline stores never reach the Hub until shards are uploaded"""
+    from observers.models.openai import OpenAIRecord
+
+    store = DatasetsStore(folder_path=str(tmp_path), repo_name="records", offline=True)
+    store.add(OpenAIRecord(model="gpt-4o"))
+    assert store._hub_thread is None
+    mock_whoami.assert_not_called()
+
+    mock_whoami.return_value = {"name": "me"}
+    with (
+        patch("observers.stores.datasets.HfApi") as api,
+        patch("observers.stores.datasets.metadata_update"),
+    ):
+        store.upload()
+
+    assert len(list(tmp_path.glob("*.jsonl"))) == 1
+    upload = api.return_value.upload_folder.call_args.kwargs
+    assert upload["repo_id"] == "me/records"
+    assert "*.partial" in upload["ignore_patterns"]
+
+
+def test_analytics(mock_whoami, mock_login, tmp_path):
+    """Test that the shards are queried in place with DuckDB"""
+    from observers.models.openai import OpenAIRecord
+
+    store = DatasetsStore(folder_path=str(tmp_path), offline=True, max_shard_records=2)
+    for model in ["gpt-4o", "gpt-4o", "gpt-4o-mini"]:
+        store.add(
+            OpenAIRecord(
+                model=model, tags=["prod"], properties={"a": 1}, latency_ms=10.0
+            )
+        )
+
+    analytics = store.analytics()
+    # one sealed shard and the active one
+    assert analytics.query().num_rows == 3
+    assert analytics.query(model="gpt-4o-mini", tags=["prod"]).num_rows == 1
+    assert analytics.query(properties={"a": 1}, provider="openai").num_rows == 3
+    stats = analytics.stats(metrics=["count"], group_by="model").to_pylist()
+    assert sorted((row["model"], row["count"]) for row in stats) == [
+        ("gpt-4o", 2),
+        ("gpt-4o-mini", 1),
+    ]
+    assert analytics.sql("SELECT count(*) AS n FROM all_records").to_pylist() == [
+        {"n": 3}
+    ]
+    analytics.close()
+
+
+def test_connect_shares_named_stores(mock_whoami, mock_login, monkeypatch, tmp_path):
+    """Test that only connections to the same dataset share a store"""
+    # restore the `connect` mocked for observer tests
+    monkeypatch.undo()
+    first, second = DatasetsStore.connect(), DatasetsStore.connect()
+    assert first is not second
+
+    named = DatasetsStore.connect(folder_path=str(tmp_path), repo_name="records")
+    assert (
+        DatasetsStore.connect(folder_path=str(tmp_path), repo_name="records") is named
+    )
+    with pytest.raises(ValueError, match="format"):
+        DatasetsStore.connect(
+            folder_path=str(tmp_path), repo_name="records", format="parquet"
+        )
+    for store in [first, second, named, named]:
+        store.close()
+        store._cleanup()
+
+    store = DatasetsStore.connect(
+        folder_path=str(tmp_path / "images"),
+        offline=True,
+        image_format="png",
+        image_workers=2,
+    )
+    assert (store.offline, store.image_format, store.image_workers) == (True, "png", 2)
+    store.close()
+
+
+def test_parquet_analytics(mock_whoami, mock_login, tmp_path):
+    """Test that queries see every Parquet record without sealing tiny shards"""
+    from observers.models.openai import OpenAIRecord
+
+    store = DatasetsStore(
+        folder_path=str(tmp_path), offline=True, format="parquet", row_group_size=3
+    )
+    analytics = store.analytics()
+    for count in range(1, 8):
+        store.add(OpenAIRecord(model="gpt-4o"))
+        assert analytics.query().num_rows == count
+        assert analytics.query(provider="openai").num_rows == count
+        assert sum(batch.num_rows for batch in store.iter_records()) == count
+    # the active shard is only sealed by queries once it holds a row group
+    assert len(list(tmp_path.glob("*.parquet"))) == 2
+    analytics.close()
+    store.close()
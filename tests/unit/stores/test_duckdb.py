@@ -0,0 +1,804 @@
+import datetime
+
+import duckdb
+import pytest
+
+from observers.base import PromotedProperty
+from observers.models.openai import OpenAIRecord
+from observers.stores.duckdb import PAYLOAD_COLUMNS, DuckDBStore
+from observers.stores.federated import FederatedReader
+from observers.stores.reader import DuckDBReader
+from observers.stores.retention import RetentionPolicy
+
+
+def make_record(**kwargs):
+    defaults = {
+        "model": "gpt-4o",
+        "messages": [{"role": "user", "content": "Hello"}],
+        "assistant_message": "Hi!",
+        "prompt_tokens": 10,
+        "completion_tokens": 5,
+        "total_tokens": 15,
+        "finish_reason": "stop",
+        "tags": ["prod"],
+        "properties": {"tenant": "acme"},
+        "latency_ms": 100.0,
+    }
+    return OpenAIRecord(**{**defaults, **kwargs})
+
+
+@pytest.fixture
+def duckdb_store(tmp_path):
+    store = DuckDBStore(path=str(tmp_path / "store.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def populated_store(duckdb_store):
+    for latency in [100.0, 200.0, 300.0]:
+        duckdb_store.add(make_record(latency_ms=latency))
+    duckdb_store.add(
+        make_record(
+            model="gpt-4o-mini",
+            tags=["dev"],
+            properties={"tenant": "globex"},
+            error="rate limited",
+            finish_reason="error",
+            total_tokens=None,
+        )
+    )
+    return duckdb_store
+
+
+def test_query_filters(populated_store):
+    """Test that query pushes filters down and returns an Arrow table"""
+    table = populated_store.query(model="gpt-4o", columns=["id", "latency_ms"])
+    assert table.num_rows == 3
+    assert table.column_names == ["id", "latency_ms"]
+
+    assert populated_store.query(tags=["dev"]).num_rows == 1
+    assert populated_store.query(properties={"tenant": "globex"}).num_rows == 1
+    assert populated_store.query(error=True).num_rows == 1
+    assert populated_store.query(since=datetime.timedelta(hours=1)).num_rows == 4
+    assert populated_store.query(until="2000-01-01").num_rows == 0
+
+
+def test_query_order_and_limit(populated_store):
+    """Test that order_by and limit are applied in SQL"""
+    table = populated_store.query(
+        model="gpt-4o", order_by="latency_ms DESC", limit=2, columns=["latency_ms"]
+    )
+    assert table.column("latency_ms").to_pylist() == [300.0, 200.0]
+
+
+def test_stats_group_by_model(populated_store):
+    """Test that stats aggregates counts, quantiles and error rates per model"""
+    table = populated_store.stats(
+        metrics=["count", "error_rate", "total_tokens", "latency_p50"],
+        group_by="model",
+    )
+    rows = {row["model"]: row for row in table.to_pylist()}
+    assert rows["gpt-4o"]["count"] == 3
+    assert rows["gpt-4o"]["error_rate"] == 0
+    assert rows["gpt-4o"]["total_tokens"] == 45
+    assert rows["gpt-4o"]["latency_p50"] == 200.0
+    assert rows["gpt-4o-mini"]["error_rate"] == 1
+
+
+def test_stats_group_by_tag_property_and_interval(populated_store):
+    """Test grouping by individual tags, properties and time buckets"""
+    by_tag = populated_store.stats(metrics=["count"], group_by="tag").to_pylist()
+    assert by_tag == [{"tag": "dev", "count": 1}, {"tag": "prod", "count": 3}]
+
+    by_tenant = populated_store.stats(
+        metrics=["count"], group_by="properties.tenant"
+    ).to_pylist()
+    assert {row["properties.tenant"]: row["count"] for row in by_tenant} == {
+        "acme": 3,
+        "globex": 1,
+    }
+
+    by_minute = populated_store.stats(metrics=["count"], interval="minute")
+    assert by_minute.column_names == ["bucket", "count"]
+    assert sum(by_minute.column("count").to_pylist()) == 4
+
+
+def test_stats_rejects_unknown_metric(populated_store):
+    """Test that unknown metrics and identifiers are rejected before reaching SQL"""
+    with pytest.raises(ValueError):
+        populated_store.stats(metrics=["latency_p50; DROP TABLE x"])
+    with pytest.raises(ValueError):
+        populated_store.stats(group_by="model; --")
+
+
+def test_batched_writes(tmp_path):
+    """Test that records are buffered until the batch is full or the store is flushed"""
+    store = DuckDBStore(path=str(tmp_path / "store.db"), batch_size=3)
+    store.add(make_record())
+    store.add(make_record())
+    assert store.query().num_rows == 0
+    store.add(make_record())
+    assert store.query().num_rows == 3
+
+    store.add(make_record())
+    store.flush()
+    assert store.query().num_rows == 4
+    store.close()
+
+
+def test_batch_with_duplicate_id(tmp_path):
+    """Test that a duplicate id in a batch doesn't drop the other records"""
+    store = DuckDBStore(path=str(tmp_path / "store.db"), batch_size=4, rollups=True)
+    store.add(make_record(id="chatcmpl-1"))
+    store.flush()
+    for id in ["chatcmpl-2", "chatcmpl-1", "chatcmpl-3", "chatcmpl-3"]:
+        store.add(make_record(id=id))
+
+    ids = store.query(columns=["id"], order_by="id").column("id").to_pylist()
+    assert ids == ["chatcmpl-1", "chatcmpl-2", "chatcmpl-3"]
+    assert store.rollup_stats()["count"].to_pylist() == [3]
+    store.close()
+
+
+def test_rollups_match_raw_stats(tmp_path):
+    """Test that rollups maintained on insert agree with stats over the raw records"""
+    store = DuckDBStore(path=str(tmp_path / "store.db"), batch_size=2, rollups=True)
+    for latency in [10.0, 20.0, 40.0, 80.0, 160.0]:
+        store.add(make_record(latency_ms=latency))
+    store.add(make_record(model="gpt-4o-mini", error="timeout", latency_ms=None))
+    # records without token counts, in two batches
+    for _ in range(2):
+        store.add(
+            make_record(
+                model="llama",
+                prompt_tokens=None,
+                completion_tokens=None,
+                total_tokens=None,
+            )
+        )
+        store.flush()
+
+    metrics = [
+        "count",
+        "error_count",
+        "error_rate",
+        "prompt_tokens",
+        "total_tokens",
+        "latency_avg",
+    ]
+    raw = store.stats(metrics=metrics, group_by="model")
+    rolled = store.rollup_stats(interval="day", metrics=metrics, group_by="model")
+    assert rolled.schema.remove(0) == raw.schema
+    assert all(type(row["count"]) is int for row in rolled.to_pylist())
+    raw = raw.to_pylist()
+    rolled = [
+        {k: v for k, v in row.items() if k != "bucket"} for row in rolled.to_pylist()
+    ]
+    assert rolled == raw
+    assert {row["model"]: row["total_tokens"] for row in raw}["llama"] is None
+
+    # latency quantiles are estimated within one histogram bin
+    p50 = store.rollup_stats(interval="hour", metrics=["latency_p50"], model="gpt-4o")
+    assert 40.0 <= p50.column("latency_p50")[0].as_py() <= 40.0 * 2**0.25
+    store.close()
+
+
+def test_backfill_rollups(duckdb_store, tmp_path):
+    """Test that rollups can be backfilled from existing records"""
+    for _ in range(3):
+        duckdb_store.add(make_record())
+    duckdb_store.close()
+
+    store = DuckDBStore(path=str(tmp_path / "store.db"), rollups=True)
+    store.backfill_rollups()
+    rolled = store.rollup_stats(interval="minute", metrics=["count"]).to_pylist()
+    assert sum(row["count"] for row in rolled) == 3
+    store.close()
+
+
+def days_ago(days):
+    return (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat()
+
+
+def test_retention_slims_and_deletes(tmp_path):
+    """Test that records are slimmed after full_days and deleted after slim_days"""
+    store = DuckDBStore(
+        path=str(tmp_path / "store.db"),
+        retention=RetentionPolicy(
+            full_days=7,
+            slim_days=30,
+            tags={"audit": RetentionPolicy(full_days=None)},
+        ),
+        retention_batch_size=1,
+    )
+    store.add(make_record(timestamp=days_ago(1)))
+    store.add(make_record(timestamp=days_ago(10)))
+    store.add(make_record(timestamp=days_ago(10)))
+    store.add(make_record(timestamp=days_ago(40)))
+    store.add(make_record(timestamp=days_ago(40), tags=["audit"]))
+
+    assert store.apply_retention() == {"slimmed": 2, "deleted": 1}
+    rows = store.query(order_by="timestamp DESC").to_pylist()
+    assert len(rows) == 4
+    assert [row["messages"] is None for row in rows] == [False, True, True, False]
+    assert all(row["assistant_message"] == "Hi!" for row in rows)
+    store.close()
+
+
+def test_retention_table_override(tmp_path):
+    """Test that table policies replace the default policy"""
+    policy = RetentionPolicy(
+        slim_days=1, tables={"openai_records": RetentionPolicy(slim_days=None)}
+    )
+    store = DuckDBStore(path=str(tmp_path / "store.db"), retention=policy)
+    store.add(make_record(timestamp=days_ago(10)))
+    assert store.apply_retention() == {"slimmed": 0, "deleted": 0}
+    store.close()
+
+
+def test_migrations_fast_path(duckdb_store, tmp_path):
+    """Test that an up to date database is detected with a single query"""
+    duckdb_store.close()
+    store = DuckDBStore(path=str(tmp_path / "store.db"))
+    assert store._load_schema_state() is not None
+    checksums = store._execute(
+        "SELECT checksum FROM schema_version WHERE version > 0"
+    ).fetchall()
+    assert all(checksum for (checksum,) in checksums)
+    store.close()
+
+
+def test_migrations_upgrade_every_record_table(tmp_path):
+    """Test that per-table migrations reach record tables created by older versions"""
+    path = str(tmp_path / "store.db")
+    conn = duckdb.connect(path)
+    conn.execute(
+        """
+        CREATE TABLE schema_version (
+            version INTEGER PRIMARY KEY,
+            migration_name VARCHAR,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO schema_version (version, migration_name) VALUES
+            (0, 'initial'),
+            (1, '001_create_schema_version'),
+            (2, '002_add_arguments_field');
+        CREATE TABLE hf_client_records (id VARCHAR PRIMARY KEY, synced_at TIMESTAMP);
+        """
+    )
+    conn.close()
+
+    store = DuckDBStore(path=path)
+    assert store._table_columns("hf_client_records") == [
+        "id",
+        "arguments",
+        "latency_ms",
+        "time_to_first_token_ms",
+    ]
+    assert store._load_schema_state() is not None
+    store.close()
+
+
+def test_migrations_checksum_mismatch(duckdb_store, tmp_path):
+    """Test that a modified migration is detected"""
+    duckdb_store._execute("UPDATE schema_version SET checksum = 'x' WHERE version = 2")
+    duckdb_store.close()
+    with pytest.raises(Exception, match="Migration 2"):
+        DuckDBStore(path=str(tmp_path / "store.db"))
+
+
+def test_ordered_ids(tmp_path):
+    """Test that records get time-ordered ids unless the provider gave one"""
+    from observers.models.openai import OpenAIRecord
+
+    store = DuckDBStore(path=str(tmp_path / "store.db"))
+    records = [OpenAIRecord(model="gpt-4o") for _ in range(3)]
+    for record in records:
+        store.add(record)
+    ids = store.query(columns=["id"], order_by="id").column("id").to_pylist()
+    assert ids == [record.id for record in records]
+
+    # a record written twice is still deduplicated by its provider id
+    store.add(make_record(id="chatcmpl-1"))
+    store.add(make_record(id="chatcmpl-1"))
+    ids = store.query(columns=["id"]).column("id").to_pylist()
+    assert ids.count("chatcmpl-1") == 1
+    store.close()
+
+
+def test_deduplication_without_primary_key(tmp_path):
+    """Test that duplicate ids are dropped at flush time without a primary key"""
+    store = DuckDBStore(path=str(tmp_path / "store.db"), primary_key=False)
+    store.add(make_record(id="chatcmpl-1", assistant_message="first"))
+    store.add(make_record(id="chatcmpl-1", assistant_message="retry"))
+    assert store.query().num_rows == 1
+
+    store.batch_size = 3
+    store.add(make_record(id="chatcmpl-2", assistant_message="first"))
+    store.add(make_record(id="chatcmpl-2", assistant_message="second"))
+    store.add(make_record(id="chatcmpl-3"))
+    assert store.query().num_rows == 3
+    assert store._execute(
+        "SELECT count(*) FROM duckdb_constraints() WHERE constraint_type = 'PRIMARY KEY' "
+        "AND table_name = 'openai_records'"
+    ).fetchone() == (0,)
+    store.close()
+
+
+def test_drop_primary_keys_keeps_indexes(tmp_path):
+    """Test that indexes of record tables survive dropping their primary key"""
+    path = str(tmp_path / "store.db")
+    store = DuckDBStore(path=path)
+    store.add(make_record(id="chatcmpl-1"))
+    store._execute("CREATE INDEX openai_records_model ON openai_records (model)")
+    store.close()
+
+    store = DuckDBStore(path=path, primary_key=False)
+    assert store._execute(
+        "SELECT index_name FROM duckdb_indexes() WHERE table_name = 'openai_records'"
+    ).fetchall() == [("openai_records_model",)]
+    assert store.query().num_rows == 1
+    store.close()
+
+
+def test_records_view_across_providers(duckdb_store):
+    """Test that the records view covers every provider table and prunes by provider"""
+    from observers.models.hf_client import HFRecord
+
+    duckdb_store.add(make_record())
+    duckdb_store.add(HFRecord(model="llama", assistant_message="Hi!", latency_ms=50.0))
+    rows = duckdb_store.stats(metrics=["count"], group_by="provider").to_pylist()
+    assert rows == [
+        {"provider": "hf_client", "count": 1},
+        {"provider": "openai", "count": 1},
+    ]
+    assert duckdb_store.query(provider="hf_client").column("model").to_pylist() == [
+        "llama"
+    ]
+
+
+def test_unified_table(tmp_path):
+    """Test that unified stores write every provider to a single table"""
+    from observers.models.hf_client import HFRecord
+
+    store = DuckDBStore(path=str(tmp_path / "store.db"), unified=True, rollups=True)
+    store.add(make_record())
+    store.add(HFRecord(model="llama", assistant_message="Hi!", latency_ms=50.0))
+    assert store.query(table="openai_records").num_rows == 0
+    assert store.query(provider="openai", table="records").num_rows == 1
+    rolled = store.rollup_stats(interval="day", metrics=["count"], group_by="provider")
+    assert [(row["provider"], row["count"]) for row in rolled.to_pylist()] == [
+        ("hf_client", 1),
+        ("openai", 1),
+    ]
+    store.close()
+
+
+def test_payload_columns(duckdb_store, tmp_path):
+    """Test that payload columns are split off existing and new record tables"""
+    duckdb_store.add(make_record(timestamp=days_ago(10)))
+    duckdb_store.close()
+
+    store = DuckDBStore(
+        path=str(tmp_path / "store.db"),
+        payload_columns=PAYLOAD_COLUMNS,
+        retention=RetentionPolicy(full_days=7),
+    )
+    store.add(make_record())
+    assert "messages" not in store._table_columns("openai_records")
+    assert store._relation(columns=["model"]) == "all_records"
+    assert store.query(columns=["messages"]).column("messages").null_count == 0
+
+    assert store.apply_retention() == {"slimmed": 1, "deleted": 0}
+    rows = store.query(order_by="timestamp DESC").to_pylist()
+    assert [row["messages"] is None for row in rows] == [False, True]
+    store.close()
+
+    with pytest.raises(ValueError, match="payload_columns"):
+        DuckDBStore(path=str(tmp_path / "store.db"))
+
+
+def test_promoted_properties(duckdb_store, tmp_path):
+    """Test that promoted properties are stored in typed columns and backfilled"""
+    duckdb_store.add(make_record(properties={"tenant": "acme", "seats": "3"}))
+    duckdb_store.close()
+
+    store = DuckDBStore(
+        path=str(tmp_path / "store.db"),
+        promoted_properties=[
+            PromotedProperty("tenant"),
+            PromotedProperty("seats", type="int"),
+        ],
+    )
+    store.add(make_record(properties={"tenant": "globex", "seats": 10}))
+    rows = store.query(columns=["property_tenant", "property_seats"]).to_pylist()
+    assert sorted(rows, key=lambda row: row["property_seats"]) == [
+        {"property_tenant": "acme", "property_seats": 3},
+        {"property_tenant": "globex", "property_seats": 10},
+    ]
+    assert store.query(properties={"seats": 10}).num_rows == 1
+    by_tenant = store.stats(metrics=["count"], group_by="properties.tenant")
+    assert by_tenant.to_pylist() == [
+        {"properties.tenant": "acme", "count": 1},
+        {"properties.tenant": "globex", "count": 1},
+    ]
+    store.close()
+
+
+def test_promoted_bool_property():
+    """Test that boolean properties are parsed rather than tested for truth"""
+    prop = PromotedProperty("beta", type="bool")
+    values = [True, 0, 1, 2, "true", "False", "0", "1", "yes", "no", "maybe", None]
+    assert [prop.value({"beta": value}) for value in values] == [
+        True,
+        False,
+        True,
+        None,
+        True,
+        False,
+        False,
+        True,
+        True,
+        False,
+        None,
+        None,
+    ]
+
+
+def test_promoted_bool_backfill(tmp_path):
+    """Test that backfilled boolean properties are parsed like new records"""
+    values = [True, False, 0, 1, 2, 1.0, "true", " False", "0", "yes", "no", "maybe"]
+    path = str(tmp_path / "store.db")
+    store = DuckDBStore(path=path)
+    for i, value in enumerate(values):
+        store.add(make_record(id=f"old-{i}", properties={"beta": value}))
+    store.close()
+
+    store = DuckDBStore(
+        path=path, promoted_properties=[PromotedProperty("beta", type="bool")]
+    )
+    for i, value in enumerate(values):
+        store.add(make_record(id=f"new-{i}", properties={"beta": value}))
+    rows = store.query(columns=["id", "property_beta"]).to_pylist()
+    promoted = {row["id"]: row["property_beta"] for row in rows}
+    assert [promoted[f"old-{i}"] for i in range(len(values))] == [
+        promoted[f"new-{i}"] for i in range(len(values))
+    ]
+    assert promoted["old-5"] is True and promoted["old-4"] is None
+    store.close()
+
+
+def fts_available():
+    try:
+        duckdb.connect().execute("LOAD fts")
+    except duckdb.Error:
+        return False
+    return True
+
+
+@pytest.mark.skipif(not fts_available(), reason="the fts extension is not installed")
+def test_search(tmp_path):
+    """Test that search ranks records by their messages and assistant message"""
+    store = DuckDBStore(
+        path=str(tmp_path / "store.db"), search_index=True, search_refresh_rows=1
+    )
+    store.add(make_record(assistant_message="The invoice was sent"))
+    store.add(
+        make_record(
+            messages=[{"role": "user", "content": "Why did ERR_QUOTA happen?"}],
+            model="gpt-4o-mini",
+        )
+    )
+    assert (
+        store.search("invoice", columns=["assistant_message"]).to_pylist()[0][
+            "assistant_message"
+        ]
+        == "The invoice was sent"
+    )
+    assert store.search("err_quota").column("model").to_pylist() == ["gpt-4o-mini"]
+    assert store.search("err_quota", model="gpt-4o").num_rows == 0
+
+    store.add(make_record(assistant_message="Another invoice"))
+    assert store.search("invoice").num_rows == 2
+    store.close()
+
+
+@pytest.mark.skipif(not fts_available(), reason="the fts extension is not installed")
+def test_search_index_refresh_and_retention(tmp_path):
+    """Test that the index is rebuilt past a threshold and slimmed by retention"""
+    store = DuckDBStore(
+        path=str(tmp_path / "store.db"),
+        search_index=True,
+        search_refresh_interval=3600,
+        search_refresh_rows=2,
+        retention=RetentionPolicy(full_days=7),
+    )
+    store.add(
+        make_record(
+            timestamp=days_ago(10),
+            messages=[{"role": "user", "content": "Why did ERR_QUOTA happen?"}],
+        )
+    )
+    assert store.search("err_quota").num_rows == 1
+    store.add(make_record(assistant_message="The invoice was sent"))
+    # the index is only rebuilt once enough records were written
+    assert store.search("invoice").num_rows == 0
+    store.add(make_record(assistant_message="Another invoice"))
+    assert store.search("invoice").num_rows == 2
+
+    assert store.apply_retention()["slimmed"] == 1
+    store.refresh_search_index()
+    assert store.search("err_quota").num_rows == 0
+    assert store.search("invoice").num_rows == 2
+    store.close()
+
+
+def embed(texts):
+    """Embed texts as their letter counts"""
+    return [
+        [text.lower().count(letter) for letter in "abcdefghijklmnopqrstuvwxyz"]
+        for text in texts
+    ]
+
+
+def test_similar(tmp_path):
+    """Test that records are embedded in batches and searched by cosine distance"""
+    store = DuckDBStore(
+        path=str(tmp_path / "store.db"),
+        embedding_fn=embed,
+        embedding_dim=26,
+        embedding_interval=3600,
+        embedding_batch_size=2,
+    )
+    for message in ["aaaa", "zzzz", "aaaz"]:
+        store.add(make_record(assistant_message=message, messages=None))
+    assert store.embed_pending() == 2
+    assert store.embed_pending() == 1
+    assert store.embed_pending() == 0
+
+    nearest = store.similar("aaa", k=2, columns=["assistant_message"]).to_pylist()
+    assert [row["assistant_message"] for row in nearest] == ["aaaa", "aaaz"]
+    assert nearest[0]["distance"] == pytest.approx(0)
+    assert store.similar(embed(["zz"])[0], k=1, model="gpt-4o-mini").num_rows == 0
+    store.close()
+
+
+def test_memory_mode_snapshots(tmp_path):
+    """Test that in-memory stores are saved to and loaded from snapshots"""
+    path = str(tmp_path / "store.db")
+    store = DuckDBStore(path=path, mode="memory", threads=2, memory_limit="1GB")
+    store.add(make_record())
+    assert not (tmp_path / "store.db").exists()
+    store.snapshot()
+    store.add(make_record())
+    store.close()
+    assert not (tmp_path / "store.db.tmp").exists()
+
+    store = DuckDBStore(path=path, mode="memory", snapshot_interval=None)
+    assert store.query().num_rows == 2
+    store.add(make_record())
+    store._conn.close()
+    store._conn = None
+
+    store = DuckDBStore(path=path)
+    assert store.query().num_rows == 2
+    store.close()
+
+
+def test_reader_follows_published_copies(tmp_path):
+    """Test that readers query published copies while the store keeps writing"""
+    published = str(tmp_path / "published.db")
+    store = DuckDBStore(
+        path=str(tmp_path / "store.db"),
+        publish_path=published,
+        publish_interval=3600,
+        promoted_properties=[PromotedProperty("tenant")],
+    )
+    store.add(make_record())
+    store.publish()
+
+    reader = DuckDBReader(path=published)
+    assert reader.query().num_rows == 1
+    store.add(make_record(properties={"tenant": "globex"}))
+    assert reader.query().num_rows == 1
+    store.publish()
+    assert reader.stats(
+        metrics=["count"], properties={"tenant": "globex"}
+    ).to_pylist() == [{"count": 1}]
+    store.close()
+    reader.close()
+
+
+def test_reader_closes_previous_copies(tmp_path):
+    """Test that readers close their connection to a copy once it is replaced"""
+    published = str(tmp_path / "published.db")
+    store = DuckDBStore(path=str(tmp_path / "store.db"), publish_path=published)
+    reader = DuckDBReader(path=published)
+    connections = []
+    for i in range(3):
+        store.add(make_record())
+        store.publish()
+        batches = reader.iter_records(batch_size=1)
+        next(batches)
+        # a query in progress keeps its copy open
+        store.add(make_record())
+        store.publish()
+        assert reader.query().num_rows == 2 * i + 2
+        assert len(list(batches)) == 2 * i
+        connections.append(reader._conn)
+
+    reader.query()
+    assert len(reader._retired) == 0
+    for conn in connections[:-1]:
+        with pytest.raises(duckdb.ConnectionException):
+            conn.execute("SELECT 1")
+    store.close()
+    reader.close()
+
+
+def test_publish_hyphenated_database(tmp_path):
+    """Test that databases named after any file name can be published"""
+    published = str(tmp_path / "published.db")
+    store = DuckDBStore(path=str(tmp_path / "my-store.db"), publish_path=published)
+    store.add(make_record())
+    store.publish()
+    store.add(make_record())
+    store.close()
+    assert store._conn is None
+    reader = DuckDBReader(path=published)
+    assert reader.query().num_rows == 2
+    reader.close()
+
+
+def test_close_after_failed_publish(tmp_path, monkeypatch):
+    """Test that the connection is closed even if the last publish fails"""
+    store = DuckDBStore(
+        path=str(tmp_path / "store.db"), publish_path=str(tmp_path / "published.db")
+    )
+    store.add(make_record())
+
+    def fail():
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, "publish", fail)
+    with pytest.raises(OSError):
+        store.close()
+    assert store._conn is None
+
+
+def test_concurrent_snapshot_and_publish(tmp_path):
+    """Test that snapshots and publications made at the same time don't collide"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    store = DuckDBStore(
+        path=str(tmp_path / "store.db"),
+        mode="memory",
+        publish_path=str(tmp_path / "published.db"),
+    )
+    store.add(make_record())
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(copy)
+            for _ in range(5)
+            for copy in (store.snapshot, store.publish)
+        ]
+        for future in futures:
+            future.result()
+    store.close()
+    reader = DuckDBReader(path=str(tmp_path / "published.db"))
+    assert reader.query().num_rows == 1
+    reader.close()
+
+
+def test_iter_records(populated_store):
+    """Test that records are streamed as Arrow record batches"""
+    batches = list(
+        populated_store.iter_records(
+            columns=["id", "model"], batch_size=3, model="gpt-4o"
+        )
+    )
+    assert sum(batch.num_rows for batch in batches) == 3
+    assert batches[0].schema.names == ["id", "model"]
+
+
+def test_federated_reader(tmp_path):
+    """Test that queries run across databases and Parquet exports"""
+    for name, count in [("host-a", 2), ("host-b", 1)]:
+        with DuckDBStore(path=str(tmp_path / f"{name}.db")) as store:
+            for _ in range(count):
+                store.add(make_record())
+    with DuckDBStore(path=str(tmp_path / "export.db")) as store:
+        store.add(make_record(model="gpt-4o-mini"))
+        store._execute(
+            f"COPY all_records TO '{tmp_path / 'host-c.parquet'}' (FORMAT parquet)"
+        )
+
+    reader = FederatedReader(
+        databases=[str(tmp_path / "host-*.db")],
+        parquet=[str(tmp_path / "*.parquet")],
+    )
+    assert reader.sources() == ["host-a", "host-b"]
+    rows = reader.stats(metrics=["count"], group_by="source").to_pylist()
+    assert rows == [
+        {"source": "host-a", "count": 2},
+        {"source": "host-b", "count": 1},
+        {"source": "host-c", "count": 1},
+    ]
+    assert reader.query(model="gpt-4o-mini", columns=["source"]).to_pylist() == [
+        {"source": "host-c"}
+    ]
+    reader.close()
+
+
+def test_connect_shares_store(tmp_path):
+    """Test that connections to a database share one store until the last closes"""
+    path = str(tmp_path / "store.db")
+    first = DuckDBStore.connect(path)
+    second = DuckDBStore.connect(str(tmp_path / "." / "store.db"))
+    assert first is second
+
+    first.add(make_record())
+    first.close()
+    # still open for the other observer
+    second.add(make_record())
+    assert second.query().num_rows == 2
+    second.close()
+    assert second._conn is None
+
+    third = DuckDBStore.connect(path)
+    assert third is not first
+    assert third.query().num_rows == 2
+    third.close()
+
+
+def test_connect_rejects_different_options(tmp_path):
+    """Test that connecting to an open store with other options raises"""
+    path = str(tmp_path / "store.db")
+    store = DuckDBStore.connect(path, batch_size=10)
+    assert DuckDBStore.connect(path, batch_size=10) is store
+    with pytest.raises(ValueError, match="batch_size"):
+        DuckDBStore.connect(path)
+    store.close()
+    store.close()
+
+
+def test_sync_to_hub(tmp_path):
+    """Test that records are synced once, in shards named after their watermark"""
+    from unittest.mock import patch
+
+    import pyarrow.parquet as pq
+
+    uploads = []
+
+    def create_commit(operations, **kwargs):
+        (operation,) = operations
+        table = pq.read_table(operation.path_or_fileobj)
+        uploads.append((operation.path_in_repo, table.column("model").to_pylist()))
+
+    store = DuckDBStore(
+        path=str(tmp_path / "store.db"), sync_repo_id="me/records", sync_lag=0
+    )
+    with patch("huggingface_hub.HfApi") as api:
+        api.return_value.file_exists.return_value = False
+        api.return_value.create_commit.side_effect = create_commit
+        assert store.sync() is None
+
+        store.add(make_record(model="a"))
+        store.add(make_record(model="b"))
+        first = store.sync()
+        assert uploads == [(first, ["a", "b"])]
+        assert store.sync() is None
+
+        # an interrupted sync is retried with the same records and shard name
+        store.add(make_record(model="c"))
+        api.return_value.create_commit.side_effect = ConnectionError
+        with pytest.raises(ConnectionError):
+            store.sync()
+        store.add(make_record(model="d"))
+        api.return_value.create_commit.side_effect = create_commit
+        second = store.sync()
+        third = store.sync()
+
+    assert uploads[1:] == [(second, ["c"]), (third, ["d"])]
+    store.close()
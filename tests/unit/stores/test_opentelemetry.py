@@ -0,0 +1,140 @@
+import datetime
+import json
+
+import pytest
+
+pytest.importorskip("opentelemetry.exporter.otlp.proto.grpc")
+
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from opentelemetry.trace import SpanKind, StatusCode
+
+from observers.base import PromotedProperty
+from observers.models.openai import OpenAIRecord
+from observers.stores.opentelemetry import OpenTelemetryStore, flatten_dict
+
+
+@pytest.fixture
+def exporter():
+    return InMemorySpanExporter()
+
+
+@pytest.fixture
+def tracer(exporter):
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    return provider.get_tracer("test")
+
+
+def make_record(**kwargs):
+    defaults = dict(
+        id="chatcmpl-1",
+        model="gpt-4o",
+        timestamp=datetime.datetime(2024, 1, 1, 12, 0, 0).isoformat(),
+        messages=[{"role": "user", "content": "Tell me a joke."}],
+        assistant_message="Why did the chicken cross the road?",
+        prompt_tokens=12,
+        completion_tokens=8,
+        finish_reason="stop",
+        arguments={"temperature": 0.5, "max_tokens": 100, "stop": "\n"},
+        latency_ms=250.0,
+        time_to_first_token_ms=40.0,
+        raw_response={"model": "gpt-4o-2024-08-06"},
+    )
+    return OpenAIRecord(**(defaults | kwargs))
+
+
+def test_flatten_dict():
+    """Test that nested dicts are flattened into valid span attributes"""
+    assert flatten_dict({"a": {"b": 1, "c": None}, "d": [1, {}]}, "p") == {
+        "p.a.b": 1,
+        "p.d": "[1, {}]",
+    }
+
+
+def test_span_per_request(tracer, exporter):
+    """Test that records are exported as GenAI spans timed like the model call"""
+    store = OpenTelemetryStore(
+        tracer=tracer, promoted_properties=[PromotedProperty("user")]
+    )
+    record = make_record(properties={"user": "alice", "meta": {"source": "docs"}})
+    with tracer.start_as_current_span("request") as parent:
+        store.add(record)
+    store.add(make_record(id="chatcmpl-2"))
+
+    span, parent_span, other = exporter.get_finished_spans()
+    assert span.name == "chat gpt-4o"
+    assert span.kind == SpanKind.CLIENT
+    # the span is parented to the current span, and covers the call to the model
+    assert span.parent.span_id == parent.get_span_context().span_id
+    assert other.parent is None
+    assert other.context.trace_id != span.context.trace_id
+    end = int(datetime.datetime.fromisoformat(record.timestamp).timestamp() * 1e9)
+    assert span.end_time == end
+    assert span.end_time - span.start_time == 250_000_000
+    (event,) = span.events
+    assert event.timestamp - span.start_time == 40_000_000
+
+    attributes = span.attributes
+    assert attributes["gen_ai.operation.name"] == "chat"
+    assert attributes["gen_ai.provider.name"] == "openai"
+    assert attributes["gen_ai.request.model"] == "gpt-4o"
+    assert attributes["gen_ai.request.temperature"] == 0.5
+    assert attributes["gen_ai.request.max_tokens"] == 100
+    assert attributes["gen_ai.request.stop_sequences"] == ("\n",)
+    assert attributes["gen_ai.response.model"] == "gpt-4o-2024-08-06"
+    assert attributes["gen_ai.response.finish_reasons"] == ("stop",)
+    assert attributes["gen_ai.usage.input_tokens"] == 12
+    assert attributes["gen_ai.usage.output_tokens"] == 8
+    assert attributes["properties.meta.source"] == "docs"
+    assert attributes["properties.user"] == "alice"
+    assert json.loads(attributes["gen_ai.input.messages"]) == [
+        {"role": "user", "parts": [{"type": "text", "content": "Tell me a joke."}]}
+    ]
+    (output,) = json.loads(attributes["gen_ai.output.messages"])
+    assert output["parts"][0]["content"] == record.assistant_message
+
+
+def test_errors_and_truncation(tracer, exporter):
+    """Test that errors set the span status and long messages are truncated"""
+    store = OpenTelemetryStore(tracer=tracer, max_message_length=10)
+    store.add(
+        make_record(
+            messages=[{"role": "user", "content": "x" * 25}],
+            error="Rate limit exceeded",
+            finish_reason="error",
+            time_to_first_token_ms=None,
+        )
+    )
+
+    (span,) = exporter.get_finished_spans()
+    assert span.status.status_code == StatusCode.ERROR
+    assert span.attributes["error.type"] == "_OTHER"
+    assert "gen_ai.output.messages" not in span.attributes
+    assert not span.events
+    (message,) = json.loads(span.attributes["gen_ai.input.messages"])
+    assert message["parts"][0]["content"] == "x" * 10 + "...[truncated 15 chars]"
+
+
+def test_messages_budget(tracer, exporter):
+    """Test that the oldest messages are dropped beyond the size of the attribute"""
+    store = OpenTelemetryStore(
+        tracer=tracer, max_message_length=100, max_messages_length=1000
+    )
+    messages = [{"role": "user", "content": f"{i:03d}" + "x" * 90} for i in range(50)]
+    store.add(make_record(messages=messages))
+    store.add(make_record(messages=messages[-1:]))
+
+    first, second = exporter.get_finished_spans()
+    attribute = first.attributes["gen_ai.input.messages"]
+    assert len(attribute) <= 1000
+    # the most recent messages are kept
+    kept = json.loads(attribute)
+    assert [m["parts"][0]["content"][:3] for m in kept] == [
+        f"{i:03d}" for i in range(50 - len(kept), 50)
+    ]
+    assert first.attributes["observers.input.dropped_messages"] == 50 - len(kept)
+    assert "observers.input.dropped_messages" not in second.attributes